@@ -1,14 +1,35 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
+import json
 import os
+import time
 import logging
 import requests
 
 from ha_client import HomeAssistantClient
+from enrichment import EnrichmentEngine
+from device_cache import DeviceCache
+from device_health import DeviceHealth
+from rollout import RolloutManager
+from discovery import SubnetSweeper, merge_with_inventory
+from poller import StatusPoller
+from http_pool import get_device_session, get_supervisor_session, pool_stats
+from metrics import REGISTRY, PROBE_DURATION, PROBE_TIMEOUTS, CACHE_LOOKUPS
+from log_config import configure_logging
+from snapshot import InventorySnapshot
+from scan_results import ScanResults
+from gen2_rpc import Gen2ChannelPool
+from presence import PresenceListener
+from batch_actions import BatchActionRunner
+from single_flight import SingleFlight, SharedStream
+from device_query import DeviceListIndex, parse_query
+from device_auth import device_auth
+from update_check import UpdateChecker, parse_gen1_ota, parse_gen2_check
+from diagnostics import DiagnosticsRunner
 from shelly_gen1 import ShellyGen1Client
 from shelly_gen2 import ShellyGen2Client
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_LEVEL add-on option)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
@@ -19,36 +40,111 @@ ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', '')
 # Initialize HA client
 ha_client = HomeAssistantClient()
 
-# Log all requests
-@app.before_request
-def log_request():
-    logger.info(f"Request: {request.method} {request.path}")
+# Generation/identity cache so devices are not re-probed on every action
+device_cache = DeviceCache()
 
+# RTT estimates and circuit breakers, so dead devices don't stall scans
+device_health = DeviceHealth()
+
+# Concurrent identical work (scans, per-device probes) runs once and is shared;
+# results are reused for a moment afterwards so many viewers cost one probe
+SCAN_REUSE_SECONDS = float(os.environ.get('SCAN_REUSE_SECONDS', 2))
+# A client whose ETag matches a scan this recent (same inventory) gets 304 without a new scan
+SCAN_MAX_AGE = float(os.environ.get('SCAN_MAX_AGE', 30))
+DEVICE_REUSE_SECONDS = float(os.environ.get('DEVICE_REUSE_SECONDS', 1))
+scan_flight = SingleFlight('scan', SCAN_REUSE_SECONDS)
+generation_flight = SingleFlight('detect_generation', DEVICE_REUSE_SECONDS)
+info_flight = SingleFlight('device_info', DEVICE_REUSE_SECONDS)
+# Streamed scans (one per open panel) share one run
+scan_stream_flight = SharedStream('scan_stream')
+
+
+def handle_presence(record, old_ip):
+    """A device announced itself: its generation is known without probing, moved devices are re-keyed"""
+    device_cache.observe(record['mac'], record['ip'])
+    # Clients exist for Gen1 and Gen2 (RPC, also used by Gen3+), as from probe_generation()
+    device_cache.store(record['ip'], 1 if record['generation'] == 1 else 2, record)
+
+
+# Passive mDNS/CoIoT listener (liveness, generation and IP changes without probes)
+presence = PresenceListener(on_presence=handle_presence)
+if os.environ.get('PASSIVE_DISCOVERY', 'true').lower() == 'true':
+    presence.start()
+
+# Log all requests (one line, only at debug level)
 @app.after_request
 def log_response(response):
-    logger.info(f"Response: {response.status_code} for {request.path}")
+    logger.debug("%s %s -> %d", request.method, request.path, response.status_code)
     return response
 
 
 def detect_generation(ip):
-    """Detect if device is Gen1 or Gen2+"""
-    try:
-        # Try Gen2+ first
-        import requests
-        response = requests.get(f"http://{ip}/rpc/Shelly.GetDeviceInfo", timeout=2)
-        if response.status_code == 200:
-            return 2
-    except:
-        pass
+    """Detect if device is Gen1 or Gen2+ (cached per device)"""
+    cached = device_cache.get_generation(ip)
+    CACHE_LOOKUPS.inc(cache='generation', result='hit' if cached else 'miss')
+    if cached:
+        return cached
+    
+    generation = generation_flight.do(ip, probe_generation, ip)
+    if generation:
+        device_cache.store(ip, generation)
+    return generation
+
+
+def timed_probe(ip, path, probe, generation, auth=None, timeout=None):
+    """
+    GET a path on a device with a timeout adapted to its RTT.
+    
+    Records duration, outcome and device health; returns the response, or
+    None when the device did not answer.
+    """
+    session = get_device_session()
+    started = time.perf_counter()
+    outcome = 'error'
     
     try:
-        # Try Gen1
-        import requests
-        response = requests.get(f"http://{ip}/shelly", timeout=2)
-        if response.status_code == 200:
-            return 1
-    except:
-        pass
+        response = session.get(f"http://{ip}{path}", auth=auth, timeout=timeout or device_health.timeout_for(ip))
+        outcome = 'ok' if response.status_code == 200 else f'http_{response.status_code}'
+        device_health.record_success(ip, time.perf_counter() - started)
+        return response
+    except requests.Timeout:
+        outcome = 'timeout'
+        PROBE_TIMEOUTS.inc(probe=probe)
+        device_health.record_failure(ip, 'timeout')
+        return None
+    except requests.RequestException as e:
+        device_health.record_failure(ip, type(e).__name__)
+        return None
+    finally:
+        PROBE_DURATION.observe(time.perf_counter() - started,
+                               probe=probe, generation=generation, outcome=outcome)
+
+
+def read_device_json(ip, path, probe, generation, auth=None, timeout=None):
+    """timed_probe() for a JSON read: the decoded body, or None on no answer, an error status or bad JSON"""
+    response = timed_probe(ip, path, probe, generation, auth=auth, timeout=timeout)
+    if response is None or response.status_code != 200:
+        return None
+    try:
+        return response.json()
+    except ValueError:
+        return None
+
+
+def probe_generation(ip):
+    """Probe the device to find out if it is Gen1 or Gen2+"""
+    # Try Gen2+ first
+    response = timed_probe(ip, "/rpc/Shelly.GetDeviceInfo", 'detect', 2)
+    if response is None:
+        # Nothing answered - don't wait for a second timeout
+        return None
+    if response.status_code == 200:
+        return 2
+    
+    # Try Gen1
+    response = timed_probe(ip, "/shelly", 'detect', 1)
+    if response is not None and response.status_code == 200:
+        return 1
     
     return None
 
@@ -66,32 +162,224 @@ def get_shelly_client(ip, generation=None):
     return None
 
 
+def get_live_info(ip, generation):
+    """read_device_info(), shared by concurrent callers for the same device (returns a copy)"""
+    device_info = info_flight.do((ip, generation), read_device_info, ip, generation)
+    return dict(device_info) if device_info else device_info
+
+
+def read_device_info(ip, generation):
+    """Identity of a device (/shelly or Shelly.GetDeviceInfo, no auth needed), or None if it did not answer"""
+    if generation == 1:
+        info = read_device_json(ip, '/shelly', 'info', 1)
+        if info is None:
+            return None
+        return {
+            'generation': 1,
+            'type': info.get('type'),
+            'mac': info.get('mac'),
+            'fw': info.get('fw'),
+            'auth': info.get('auth', False)
+        }
+    
+    info = read_device_json(ip, '/rpc/Shelly.GetDeviceInfo', 'info', 2)
+    if info is None:
+        return None
+    return {
+        'generation': 2,
+        'id': info.get('id'),
+        'name': info.get('name'),
+        'type': info.get('model'),
+        'mac': info.get('mac'),
+        'fw': info.get('ver') or info.get('fw_id'),
+        'auth': info.get('auth_en', False)
+    }
+
+
 def enrich_device_info(ha_device):
     """Enrich HA device info with live Shelly data"""
     ip = ha_device.get('ip')
     if not ip:
-        logger.warning(f"No IP found for device {ha_device.get('name')}")
+        logger.warning("No IP found for device %s", ha_device.get('name'))
+        return ha_device
+    
+    # Known-dead devices are only probed now and then (circuit breaker)
+    allowed, reason = device_health.allow(ip)
+    if not allowed:
+        ha_device['skipped'] = reason
+        ha_device['error'] = f'Skipped: {reason}'
         return ha_device
     
+    # Heard from recently and probed not long ago: reuse the last result
+    if presence.can_skip_probe(ip):
+        previous = scan_results.get(ha_device)
+        if previous and previous.get('ip') == ip and previous.get('generation'):
+            ha_device.update({key: previous.get(key) for key in ('generation', 'auth', 'fw', 'type')})
+            ha_device['passive'] = True
+            add_update_info(ha_device)
+            return ha_device
+    
     # Detect generation and get detailed info
     generation = detect_generation(ip)
     
     if generation:
-        client = get_shelly_client(ip, generation)
-        if client:
-            device_info = client.get_device_info()
-            if device_info:
-                # Merge info
-                ha_device.update({
-                    'generation': device_info.get('generation'),
-                    'auth': device_info.get('auth', False),
-                    'fw': device_info.get('fw', ha_device.get('sw_version')),
-                    'type': device_info.get('type', ha_device.get('model'))
-                })
+        device_info = get_live_info(ip, generation)
+        if not device_info:
+            # Cached generation may be stale (device replaced or offline)
+            device_cache.invalidate(ip)
+        else:
+            device_cache.store(ip, generation, device_info)
+            presence.mark_probed(ip)
+            # Merge info
+            ha_device.update({
+                'generation': device_info.get('generation'),
+                'auth': device_info.get('auth', False),
+                'fw': device_info.get('fw') or ha_device.get('sw_version'),
+                'type': device_info.get('type') or ha_device.get('model')
+            })
+            add_update_info(ha_device)
     
     return ha_device
 
 
+# Real devices may ask the update server before answering an update check
+UPDATE_CHECK_READ_TIMEOUT = 5
+
+
+def check_device_update(ip, generation, auth):
+    """Ask one device for its pending firmware update (None if it did not answer)"""
+    if generation == 1:
+        path, parse = '/ota', parse_gen1_ota
+    else:
+        path, parse = '/rpc/Shelly.CheckForUpdate', parse_gen2_check
+    
+    connect_timeout, read_timeout = device_health.timeout_for(ip)
+    data = read_device_json(ip, path, 'update_check', generation,
+                            auth=device_auth(generation, ADMIN_PASSWORD) if auth else None,
+                            timeout=(connect_timeout, max(read_timeout, UPDATE_CHECK_READ_TIMEOUT)))
+    if data is None:
+        return None
+    try:
+        return parse(data)
+    except AttributeError:
+        return None
+
+
+# Update availability, cached per model and firmware (UPDATE_CHECK_TTL)
+update_checker = UpdateChecker(check_device_update)
+
+
+def add_update_info(device):
+    """Set has_update, latest_version and can_update on a probed device (left unset when unknown)"""
+    # Without the password, devices with auth can't be asked (or updated)
+    authorized = bool(ADMIN_PASSWORD) or not device.get('auth')
+    result = update_checker.check(device, query=authorized)
+    if result is None:
+        return
+    device['has_update'] = result['has_update']
+    device['latest_version'] = result['latest_version'] or device.get('fw')
+    device['can_update'] = result['has_update'] and authorized
+
+
+# Initialize enrichment engine (worker limit and deadline from add-on options)
+enrichment_engine = EnrichmentEngine(enrich_device_info)
+
+def rollout_update_check(ip):
+    """Fresh update result for a device about to be updated, with its firmware (None when unknown)"""
+    generation = detect_generation(ip)
+    device_info = get_live_info(ip, generation) if generation else None
+    if not device_info:
+        return None
+    result = check_device_update(ip, generation, device_info.get('auth'))
+    return {**result, 'fw': device_info.get('fw')} if result else None
+
+
+# Background firmware rollouts (devices without a pending update are left alone)
+rollout_manager = RolloutManager(get_shelly_client, update_check=rollout_update_check)
+
+
+def fetch_gen2_details(ip):
+    """Info, config, status and update check over the device's RPC WebSocket (None on failure)"""
+    started = time.perf_counter()
+    try:
+        details = gen2_channels.fetch_details(ip, timeout=device_health.timeout_for(ip)[1] * 2)
+    except Exception as e:
+        PROBE_DURATION.observe(time.perf_counter() - started, probe='rpc_ws', generation=2, outcome='error')
+        logger.debug("Gen2 WebSocket fetch from %s failed, using HTTP: %s", ip, e)
+        return None
+    
+    elapsed = time.perf_counter() - started
+    PROBE_DURATION.observe(elapsed, probe='rpc_ws', generation=2, outcome='ok')
+    device_health.record_success(ip, elapsed)
+    return details
+
+
+# Settings and status reads per generation (Gen2+ config stands in for Gen1 settings)
+DETAIL_PATHS = {
+    1: ('/settings', '/status'),
+    2: ('/rpc/Shelly.GetConfig', '/rpc/Shelly.GetStatus'),
+}
+
+
+def fetch_device_details(ip):
+    """
+    Get info, settings and status from a device (raises LookupError if unreachable).
+    
+    Every read goes through timed_probe, so the RTT timeout and health
+    tracking apply; the poller checks the circuit breaker first.
+    """
+    generation = detect_generation(ip)
+    if generation == 2 and gen2_channels:
+        details = fetch_gen2_details(ip)
+        if details:
+            return details
+    
+    if generation not in DETAIL_PATHS:
+        raise LookupError('Could not detect device generation')
+    
+    device_info = get_live_info(ip, generation)
+    if not device_info:
+        raise LookupError('Device not found')
+    
+    # Settings and status over the pooled device session (RTT timeouts, health, pre-authenticated)
+    auth = device_auth(generation, ADMIN_PASSWORD) if device_info.get('auth') else None
+    settings_path, status_path = DETAIL_PATHS[generation]
+    settings = read_device_json(ip, settings_path, 'settings', generation, auth=auth)
+    if settings is not None:
+        device_info['settings'] = settings
+    
+    status = read_device_json(ip, status_path, 'status', generation, auth=auth)
+    if status is not None:
+        device_info['status'] = status
+    
+    return device_info
+
+
+def poll_device_details(ip):
+    """fetch_device_details() for the poller, skipping devices with an open circuit"""
+    allowed, reason = device_health.allow(ip)
+    if not allowed:
+        raise LookupError(f'Skipped: {reason}')
+    if gen2_channels:
+        # Status kept current by NotifyStatus; only re-fetch when the rest has aged out
+        cached = gen2_channels.cached_details(ip)
+        if cached:
+            return cached
+    return fetch_device_details(ip)
+
+
+# Background poller serving /api/device/<ip> from snapshots
+status_poller = StatusPoller(poll_device_details)
+
+# Optional persistent RPC WebSockets to Gen2+ devices (pipelined calls, pushed status)
+gen2_channels = None
+if os.environ.get('GEN2_WEBSOCKET', 'false').lower() == 'true':
+    gen2_channels = Gen2ChannelPool(ADMIN_PASSWORD, on_status=status_poller.push_status)
+
+# Latest scan results with a version counter (ETag and ?since= deltas)
+scan_results = ScanResults()
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -103,199 +391,548 @@ def health():
     return jsonify({'status': 'ok'}), 200
 
 
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics (text exposition format)"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+# Diagnostics use targeted queries on the shared sessions; a slow HA fails a check, not the job
+DIAGNOSTICS_TIMEOUT = 10
+DIAGNOSTICS_SAMPLE_SIZE = 3
+
+
+def check_connection(report):
+    """Supervisor token, REST API and WebSocket session"""
+    report['supervisor_token_present'] = bool(os.environ.get('SUPERVISOR_TOKEN'))
+    report['ha_api_reachable'] = ha_client.test_connection()
+    report['websocket_connected'] = ha_client.ws_client.connected
+
+
+def check_inventory(report):
+    """Shelly devices from the shared inventory (no registry download unless it needs a resync)"""
+    _, records = ha_client.inventory.records()
+    devices = [record.to_dict() for record in records]
+    report['discovered_devices'] = len(devices)
+    report['discovered_with_ip'] = sum(1 for d in devices if d.get('ip'))
+    report['discovered_without_ip'] = sum(1 for d in devices if not d.get('ip'))
+    report['sample_discovered'] = [
+        {'name': d.get('name'), 'ip': d.get('ip'), 'id': d.get('id'), 'mac': d.get('mac')}
+        for d in devices[:DIAGNOSTICS_SAMPLE_SIZE]
+    ]
+
+
+def check_registry_sample(report):
+    """Raw registry entries of the sample devices (to check configuration_url), looked up by id"""
+    sample_ids = [device['id'] for device in report.get('sample_discovered', []) if device.get('id')]
+    entries = ha_client.fetch_devices_by_id(sample_ids) if sample_ids else []
+    if entries is None:
+        raise RuntimeError('Device registry lookup failed')
+    report['sample_shelly_devices_raw'] = [
+        {
+            'id': device.get('id'),
+            'name': device.get('name'),
+            'manufacturer': device.get('manufacturer'),
+            'model': device.get('model'),
+            'configuration_url': device.get('configuration_url'),
+            'sw_version': device.get('sw_version'),
+            'identifiers': device.get('identifiers'),
+            'all_keys': list(device.keys())
+        }
+        for device in entries
+    ]
+
+
+def check_config_entries(report):
+    """Shelly config entries only (config_entries/get filtered by domain) and their setup state"""
+    entries = ha_client.ws_client.request('config_entries/get', timeout=DIAGNOSTICS_TIMEOUT, domain='shelly') or []
+    states = {}
+    for entry in entries:
+        state = entry.get('state') or 'unknown'
+        states[state] = states.get(state, 0) + 1
+    report['shelly_config_entries'] = len(entries)
+    report['shelly_config_entry_states'] = states
+    report['shelly_config_entries_not_loaded'] = [
+        {'entry_id': entry.get('entry_id'), 'title': entry.get('title'),
+         'state': entry.get('state'), 'reason': entry.get('reason')}
+        for entry in entries if entry.get('state') not in (None, 'loaded')
+    ][:20]
+
+
+def check_entities(report):
+    """
+    Shelly entities from the compact entity registry (ids, platform and
+    device only - no states or attributes), then the states of a few samples
+    """
+    result = ha_client.ws_client.request('config/entity_registry/list_for_display', timeout=DIAGNOSTICS_TIMEOUT) or {}
+    entities = [entity for entity in result.get('entities', []) if entity.get('pl') == 'shelly']
+    device_ids = {entity.get('di') for entity in entities if entity.get('di')}
+    report['shelly_entities_count'] = len(entities)
+    report['shelly_devices_with_entities'] = len(device_ids)
+    
+    report['sample_shelly_entities'] = []
+    session = get_supervisor_session()
+    for entity in entities[:DIAGNOSTICS_SAMPLE_SIZE]:
+        response = session.get(f"{ha_client.ha_url}/api/states/{entity['ei']}",
+                               headers=ha_client.headers, timeout=DIAGNOSTICS_TIMEOUT)
+        if response.status_code != 200:
+            continue
+        state = response.json()
+        attributes = state.get('attributes', {})
+        report['sample_shelly_entities'].append({
+            'entity_id': state.get('entity_id'),
+            'friendly_name': attributes.get('friendly_name'),
+            'state': state.get('state'),
+            'attributes_keys': list(attributes.keys()),
+            'full_attributes': attributes
+        })
+
+
+def check_http_pools(report):
+    report['http_pools'] = pool_stats()
+
+
+# /api/debug runs these in the background, one job at a time; the report is
+# cached for DIAGNOSTICS_MAX_AGE seconds
+diagnostics = DiagnosticsRunner([
+    ('connection', check_connection),
+    ('inventory', check_inventory),
+    ('registry_sample', check_registry_sample),
+    ('config_entries', check_config_entries),
+    ('entities', check_entities),
+    ('http_pools', check_http_pools),
+])
+
+
+@app.route('/debug')
+def debug_page():
+    return render_template('debug.html')
+
+
 @app.route('/api/debug')
 def debug():
-    """Debug endpoint to check HA API connection and show sample data"""
-    logger.info("=== DEBUG: Testing HA API Connection ===")
-    
-    result = {
-        'supervisor_token_present': bool(os.environ.get('SUPERVISOR_TOKEN')),
-        'ha_api_reachable': False,
-        'total_entities': 0,
-        'shelly_entities_count': 0,
-        'sample_shelly_entities': []
-    }
+    """
+    Start a diagnostics job (or reuse the running or a recent one).
     
-    try:
-        # Test basic connection
-        result['ha_api_reachable'] = ha_client.test_connection()
-        
-        # NEW: Test WebSocket device registry access
-        try:
-            logger.info("Testing WebSocket device registry access...")
-            device_registry = ha_client.ws_client.get_device_registry()
-            result['websocket_device_registry_accessible'] = True
-            result['total_devices_in_registry'] = len(device_registry)
-            
-            # Find Shelly devices and show their configuration_url
-            shelly_devices_raw = []
-            for device in device_registry[:50]:  # Check first 50 devices
-                manufacturer = device.get('manufacturer', '').lower()
-                if 'shelly' in manufacturer:
-                    shelly_devices_raw.append(device)
-            
-            result['shelly_devices_in_registry'] = len(shelly_devices_raw)
-            
-            # Show first 3 Shelly devices with full details
-            result['sample_shelly_devices_raw'] = []
-            for device in shelly_devices_raw[:3]:
-                result['sample_shelly_devices_raw'].append({
-                    'id': device.get('id'),
-                    'name': device.get('name'),
-                    'manufacturer': device.get('manufacturer'),
-                    'model': device.get('model'),
-                    'configuration_url': device.get('configuration_url'),  # ← KEY ATTRIBUTE!
-                    'sw_version': device.get('sw_version'),
-                    'identifiers': device.get('identifiers'),
-                    'config_entries': device.get('config_entries'),
-                    'all_keys': list(device.keys())  # Show all available keys
-                })
-            
-        except Exception as e:
-            result['websocket_error'] = str(e)
-            result['websocket_device_registry_accessible'] = False
-        
-        # Get all states
-        try:
-            response = requests.get(
-                f'{ha_client.ha_url}/api/states',
-                headers=ha_client.headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                entities = response.json()
-                result['total_entities'] = len(entities)
-                
-                # Find Shelly entities
-                shelly_entities = []
-                for entity in entities:
-                    entity_id = entity.get('entity_id', '')
-                    attributes = entity.get('attributes', {})
-                    
-                    if 'shelly' in entity_id.lower() or 'shelly' in attributes.get('friendly_name', '').lower():
-                        shelly_entities.append(entity)
-                
-                result['shelly_entities_count'] = len(shelly_entities)
-                
-                # Show up to 3 sample entities with their full structure
-                for i, entity in enumerate(shelly_entities[:3]):
-                    result['sample_shelly_entities'].append({
-                        'entity_id': entity.get('entity_id'),
-                        'friendly_name': entity.get('attributes', {}).get('friendly_name'),
-                        'state': entity.get('state'),
-                        'attributes_keys': list(entity.get('attributes', {}).keys()),
-                        'full_attributes': entity.get('attributes', {})
-                    })
-                
-        except Exception as e:
-            result['entities_error'] = str(e)
-        
-        # Try discovery
-        try:
-            devices = ha_client.get_shelly_devices()
-            result['discovered_devices'] = len(devices)
-            result['discovered_with_ip'] = sum(1 for d in devices if d.get('ip'))
-            result['discovered_without_ip'] = sum(1 for d in devices if not d.get('ip'))
-            
-            # Show sample discovered devices
-            result['sample_discovered'] = [
-                {
-                    'name': d.get('name'),
-                    'ip': d.get('ip'),
-                    'id': d.get('id'),
-                    'entities': d.get('entities', [])
-                }
-                for d in devices[:3]
-            ]
-        except Exception as e:
-            result['discovery_error'] = str(e)
+    Answers 200 with the report when the job is done, otherwise 202 - poll
+    /api/debug/<job_id>. ?refresh=1 starts a new job unless one is running.
+    """
+    job, started = diagnostics.start(force=request.args.get('refresh') in ('1', 'true'))
+    data = job.to_dict()
+    data['cached'] = not started and data['status'] == 'completed'
+    return jsonify(data), 200 if data['status'] == 'completed' else 202
+
+
+@app.route('/api/debug/<job_id>')
+def debug_status(job_id):
+    """Progress and report of a diagnostics job"""
+    job = diagnostics.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+def load_scan_devices():
+    """(inventory revision, Shelly devices from HA) for a scan, or (None, None) if HA is unreachable"""
+    # First, test HA API connection
+    if not ha_client.test_connection():
+        logger.error("❌ Cannot connect to Home Assistant API")
+        return None, None
+    
+    # Read before syncing: a change in between only costs one more scan later
+    revision = ha_client.inventory.revision
+    # Get devices from HA (now includes IP addresses from config entries)
+    devices = ha_client.get_shelly_devices()
+    prepare_for_probe(devices)
+    return revision, devices
+
+
+def prepare_for_probe(devices):
+    """Use announced IPs for moved devices and keep the MAC -> IP mapping current"""
+    for device in devices:
+        # Devices that announced themselves at a new IP are used there right away
+        heard = presence.get_by_mac(device.get('mac'))
+        if heard and heard['ip'] != device.get('ip'):
+            device['discovered_ip'] = heard['ip']
+            device['ip_changed'] = bool(device.get('ip'))
+            device['ip'] = heard['ip']
+            device.pop('error', None)
         
-    except Exception as e:
-        result['error'] = str(e)
+        # Moved devices are re-probed
+        device_cache.observe(device.get('mac'), device.get('ip'))
+
+
+def scan_summary(devices, started):
+    """Per-scan summary counters (also logged as one key=value record)"""
+    summary = {
+        'total': len(devices),
+        'with_ip': sum(1 for d in devices if d.get('ip')),
+        'enriched': sum(1 for d in devices if d.get('generation')),
+        'timed_out': sum(1 for d in devices if d.get('timeout')),
+        'skipped': sum(1 for d in devices if d.get('skipped')),
+        'elapsed': round(time.monotonic() - started, 3)
+    }
+    logger.info("scan total=%(total)d with_ip=%(with_ip)d enriched=%(enriched)d "
+                "timed_out=%(timed_out)d skipped=%(skipped)d elapsed=%(elapsed).3fs", summary)
+    return summary
+
+
+def complete_scan(devices, started, revision):
+    """Log the scan summary, version the results and persist them for the next cold start"""
+    if devices:
+        inventory_snapshot.save(devices)
+    summary = scan_summary(devices, started)
+    summary['version'] = scan_results.update(devices)
+    scan_results.mark_scanned(revision)
+    return summary
+
+
+def scan_response(devices):
+    """
+    Scan results as JSON, versioned by an ETag.
+    
+    Answers 304 when If-None-Match matches, and only the added, changed and
+    removed devices for ?since=<version>.
+    """
+    version = scan_results.update(devices)
+    etag = f'scan-{version}'
+    
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        since = request.args.get('since', type=int)
+        response = jsonify(scan_results.delta(since) if since is not None else devices)
     
-    logger.info(f"Debug result: {result}")
-    return jsonify(result)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def scan_unchanged():
+    """True when the client's ETag matches a recent scan of the current inventory (no need to scan)"""
+    if f'scan-{scan_results.version}' not in request.if_none_match:
+        return False
+    revision, _ = ha_client.inventory.records()
+    return scan_results.is_fresh(revision, SCAN_MAX_AGE)
+
+
+def mark_device_changed(ip):
+    """We changed the device: probe it on the next scan, which can't be answered with a 304"""
+    presence.mark_changed(ip)
+    scan_results.expire()
+
+
+def live_scan():
+    """
+    Load devices from HA and enrich them all; None if HA is unreachable.
+    
+    Concurrent callers share one scan (and its result list - don't mutate it).
+    """
+    return scan_flight.do('scan', run_live_scan)
+
+
+def run_live_scan():
+    started = time.monotonic()
+    revision, devices = load_scan_devices()
+    if devices is None:
+        return None
+    
+    status_poller.set_targets(d.get('ip') for d in devices)
+    enriched_devices = enrichment_engine.enrich_all(devices)
+    complete_scan(enriched_devices, started, revision)
+    return enriched_devices
 
 
 @app.route('/api/scan')
 def scan():
     """Get Shelly devices from Home Assistant"""
-    logger.info("=== SCANNING FOR DEVICES FROM HOME ASSISTANT ===")
-    
     try:
-        # First, test HA API connection
-        if not ha_client.test_connection():
-            logger.error("❌ Cannot connect to Home Assistant API")
+        # Right after a restart, answer from the snapshot while it is revalidated
+        if inventory_snapshot.revalidating:
+            stale_devices = inventory_snapshot.stale_devices()
+            if stale_devices:
+                return scan_response(stale_devices)
+        
+        # Same inventory and results as a recent scan: 304 without probing every device again
+        if scan_unchanged():
+            return scan_response(scan_results.devices())
+        
+        devices = live_scan()
+        if devices is None:
             return jsonify({
                 'error': 'Cannot connect to Home Assistant API',
                 'details': 'Check add-on logs for more information'
             }), 500
         
-        # Get devices from HA (now includes IP addresses from config entries)
-        devices = ha_client.get_shelly_devices()
-        
-        logger.info(f"Found {len(devices)} devices from Home Assistant")
-        
-        # If we found devices, enrich them with live data
-        if devices:
-            enriched_devices = []
-            for device in devices:
-                ip = device.get('ip')
-                name = device.get('name', 'Unknown')
-                
-                if ip:
-                    logger.info(f"Enriching device: {name} at {ip}")
-                    enriched = enrich_device_info(device)
-                    enriched_devices.append(enriched)
-                else:
-                    logger.warning(f"Device {name} has no IP address - skipping enrichment")
-                    # Still add it, but mark as no IP
-                    device['error'] = 'No IP address found'
-                    device['type'] = device.get('model', 'Unknown')
-                    device['fw'] = device.get('sw_version', 'Unknown')
-                    enriched_devices.append(device)
-            
-            logger.info(f"Returning {len(enriched_devices)} devices")
-            logger.info(f"  - With IP: {sum(1 for d in enriched_devices if d.get('ip'))}")
-            logger.info(f"  - Enriched: {sum(1 for d in enriched_devices if d.get('generation'))}")
-            return jsonify(enriched_devices)
-        else:
+        if not devices:
             logger.warning("No Shelly devices found in Home Assistant")
-            return jsonify([])
+        return scan_response(devices)
         
     except Exception as e:
-        logger.error(f"Error scanning devices: {e}", exc_info=True)
+        logger.error("Error scanning devices: %s", e, exc_info=True)
         return jsonify({
             'error': str(e),
             'details': 'Check add-on logs for more information'
         }), 500
 
 
+def stream_scan_events():
+    """
+    (event, data) pairs of one live scan, as each device is done.
+    
+    Runs once for all concurrent /api/scan/stream clients; a client joining
+    late gets the events so far first.
+    """
+    started = time.monotonic()
+    revision, devices = load_scan_devices()
+    if devices is None:
+        yield 'scan_error', {'error': 'Cannot connect to Home Assistant API'}
+        return
+    
+    yield 'devices', devices
+    status_poller.set_targets(d.get('ip') for d in devices)
+    
+    results = list(devices)
+    for index, device in enrichment_engine.iter_enriched(devices):
+        results[index] = device
+        yield 'device', {'index': index, 'device': device}
+    
+    yield 'summary', complete_scan(results, started, revision)
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route('/api/scan/stream')
+def scan_stream():
+    """
+    Stream a scan as Server-Sent Events.
+    
+    Events: 'devices' (registry records, sent right away), 'device' (one
+    enriched device with its index, as soon as it is done), 'summary' (last).
+    Right after a restart the first 'devices' event holds the stale snapshot,
+    followed by the revalidated devices once the background scan is done.
+    Concurrent streams share one scan.
+    """
+    def generate():
+        started = time.monotonic()
+        try:
+            if inventory_snapshot.revalidating:
+                stale_devices = inventory_snapshot.stale_devices()
+                if stale_devices:
+                    yield sse_event('devices', stale_devices)
+                    fresh = inventory_snapshot.wait_revalidated(enrichment_engine.scan_timeout + 30)
+                    if fresh:
+                        yield sse_event('devices', fresh)
+                        yield sse_event('summary', {**scan_summary(fresh, started), 'version': scan_results.version})
+                        return
+            
+            for event, data in scan_stream_flight.subscribe(stream_scan_events):
+                yield sse_event(event, data)
+            
+        except Exception as e:
+            logger.error("Error streaming scan: %s", e, exc_info=True)
+            yield sse_event('scan_error', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+# Fields a scan adds to a registry record, kept for filtering between scans
+SCAN_FIELDS = ('generation', 'auth', 'fw', 'type', 'error', 'timeout', 'skipped', 'passive',
+               'ip_changed', 'discovered_ip', 'has_update', 'latest_version', 'can_update')
+
+# Sorted orderings and value buckets behind /api/devices
+device_list_index = DeviceListIndex()
+
+
+def device_online(device):
+    """Whether a probed device answered"""
+    if device.get('error') or device.get('timeout') or device.get('skipped'):
+        return False
+    return bool(device.get('generation'))
+
+
+def device_rows(records):
+    """Registry records merged with each device's last scan result"""
+    rows = []
+    for record in records:
+        device = record.to_dict()
+        previous = scan_results.get(device)
+        if previous:
+            device.update({field: previous[field] for field in SCAN_FIELDS if field in previous})
+        # None: never probed
+        device['online'] = device_online(device) if previous else None
+        rows.append(device)
+    return rows
+
+
+@app.route('/api/devices')
+def list_devices():
+    """
+    Filtered, sorted and paginated device list.
+    
+    Filters use each device's last known state; only the devices of the
+    returned page are probed (skip that with ?enrich=0).
+    """
+    try:
+        query = parse_query(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        revision, records = ha_client.inventory.records()
+        page, total, next_cursor = device_list_index.query(
+            (revision, scan_results.version), lambda: device_rows(records), query
+        )
+        
+        if request.args.get('enrich', '1') not in ('0', 'false') and page:
+            by_id = {record.id: record for record in records}
+            fresh = [by_id[device['id']].to_dict() for device in page]
+            prepare_for_probe(fresh)
+            page = enrichment_engine.enrich_all(fresh)
+            scan_results.merge(page)
+            page = [{**device, 'online': device_online(device)} for device in page]
+        
+        return jsonify({
+            'version': scan_results.version,
+            'total': total,
+            'offset': query['offset'] if query['cursor'] is None else None,
+            'limit': query['limit'],
+            'next_cursor': next_cursor,
+            'devices': page
+        })
+    
+    except Exception as e:
+        logger.error("Error listing devices: %s", e, exc_info=True)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/updates')
+def updates_summary():
+    """
+    Pending firmware updates from the last scan, grouped by model and firmware.
+    
+    ?refresh=1 drops the cached checks, so the next scan asks the devices again.
+    """
+    if request.args.get('refresh') in ('1', 'true'):
+        update_checker.clear()
+    
+    devices = scan_results.devices()
+    groups = {}
+    for device in devices:
+        if not device.get('has_update'):
+            continue
+        key = (device.get('generation'), device.get('type'), device.get('fw'))
+        group = groups.setdefault(key, {
+            'generation': key[0], 'model': key[1], 'fw': key[2],
+            'latest_version': device.get('latest_version'), 'devices': []
+        })
+        group['devices'].append({'id': device.get('id'), 'name': device.get('name'),
+                                 'ip': device.get('ip'), 'can_update': device.get('can_update', False)})
+    
+    return jsonify({
+        'version': scan_results.version,
+        'total': len(devices),
+        'checked': sum(1 for d in devices if d.get('has_update') is not None),
+        'with_update': sum(len(group['devices']) for group in groups.values()),
+        'can_update': sum(1 for d in devices if d.get('can_update')),
+        'updates': sorted(groups.values(), key=lambda g: (str(g['model']), str(g['fw']))),
+        'cache': update_checker.to_dict()
+    })
+
+
+@app.route('/api/discover')
+def discover():
+    """Sweep NETWORK_RANGE for Shelly devices and merge them with the HA inventory"""
+    logger.info("=== SWEEPING NETWORK FOR SHELLY DEVICES ===")
+    started = time.monotonic()
+    
+    try:
+        sweeper = SubnetSweeper(network_range=request.args.get('range'))
+        found = sweeper.sweep()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Error sweeping network: {e}", exc_info=True)
+        return jsonify({'error': str(e)}), 500
+    
+    # The fingerprint already told us the generation - no need to probe again
+    for result in found:
+        device_cache.observe(result.get('mac'), result['ip'])
+        device_cache.store(result['ip'], 1 if result['generation'] == 1 else 2, result)
+    
+    devices = merge_with_inventory(ha_client.get_shelly_devices(), found)
+    
+    return jsonify({
+        'found': len(found),
+        'unknown_to_home_assistant': sum(1 for d in devices if not d.get('in_home_assistant')),
+        'ip_changed': sum(1 for d in devices if d.get('ip_changed')),
+        'elapsed': round(time.monotonic() - started, 3),
+        'devices': devices
+    })
+
+
+def ha_device_for(ip):
+    """HA registry details for the device at this IP (O(1) inventory index lookup), or None"""
+    device = ha_client.inventory.find_by_ip(ip)
+    if not device:
+        return None
+    return {'id': device['id'], 'name': device['name'], 'mac': device['mac']}
+
+
+def describe_device(ip):
+    """'Name (ip)' for log lines"""
+    device = ha_device_for(ip)
+    return f"{device['name']} ({ip})" if device else ip
+
+
+@app.route('/api/health')
+def health_status():
+    """Per-device health: circuit state, failures and RTT"""
+    devices = device_health.to_dict()
+    return jsonify({
+        'open': sorted(ip for ip, health in devices.items() if health['state'] != 'closed'),
+        'devices': devices
+    })
+
+
+@app.route('/api/presence')
+def presence_status():
+    """Devices heard through mDNS/CoIoT announcements, by MAC"""
+    return jsonify(presence.to_dict())
+
+
 @app.route('/api/device/<ip>')
 def device_info(ip):
-    """Get detailed info for specific device"""
+    """Get detailed info for specific device (from the poller snapshot unless ?fresh=1)"""
+    fresh = request.args.get('fresh') in ('1', 'true')
+    
     try:
-        client = get_shelly_client(ip)
-        if not client:
-            return jsonify({'error': 'Could not detect device generation'}), 404
-        
-        device_info = client.get_device_info()
-        if device_info:
-            # Get additional info
-            if hasattr(client, 'get_settings'):
-                settings = client.get_settings()
-                if settings and 'error' not in settings:
-                    device_info['settings'] = settings
-            
-            status = client.get_status()
-            if status:
-                device_info['status'] = status
+        if status_poller.enabled:
+            status_poller.add_target(ip)
             
-            return jsonify(device_info)
+            snapshot = None if fresh else status_poller.get(ip)
+            if not fresh:
+                CACHE_LOOKUPS.inc(cache='snapshot', result='hit' if snapshot else 'miss')
+            if snapshot:
+                details = {**snapshot['data'], 'snapshot_age': snapshot['age']}
+            else:
+                details = {**status_poller.refresh(ip), 'snapshot_age': 0}
+        else:
+            details = fetch_device_details(ip)
         
-        return jsonify({'error': 'Device not found'}), 404
+        details['ha_device'] = ha_device_for(ip)
+        details['health'] = device_health.get(ip)
+        return jsonify(details)
         
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
     except Exception as e:
         logger.error(f"Error getting device info for {ip}: {e}")
         return jsonify({'error': str(e)}), 500
@@ -305,7 +942,7 @@ def device_info(ip):
 def update_device(ip):
     """Trigger firmware update on device"""
     logger.info("=" * 60)
-    logger.info(f"FIRMWARE UPDATE REQUEST for {ip}")
+    logger.info(f"FIRMWARE UPDATE REQUEST for {describe_device(ip)}")
     logger.info("=" * 60)
     
     try:
@@ -313,13 +950,13 @@ def update_device(ip):
         if not client:
             return jsonify({'error': 'Could not detect device generation'}), 404
         
-        generation = client.get_device_info().get('generation') if client.get_device_info() else None
-        logger.info(f"✓ Device generation: Gen{generation}")
+        logger.info(f"✓ Device generation: Gen{detect_generation(ip)}")
         
         result = client.update_firmware()
         
         if result.get('success'):
             logger.info(f"✅ SUCCESS: Firmware update started")
+            mark_device_changed(ip)
             return jsonify(result)
         else:
             logger.error(f"❌ FAILED: {result.get('error')}")
@@ -332,11 +969,52 @@ def update_device(ip):
         logger.info("=" * 60)
 
 
+@app.route('/api/update/batch', methods=['POST'])
+def update_batch():
+    """Start a batched firmware rollout over several devices"""
+    data = request.get_json(silent=True) or {}
+    ips = data.get('ips') or []
+    
+    if not isinstance(ips, list) or not ips or not all(isinstance(ip, str) for ip in ips):
+        return jsonify({'error': 'No devices selected'}), 400
+    
+    try:
+        job = rollout_manager.start(
+            ips,
+            concurrency=data.get('concurrency', 4),
+            canary_size=data.get('canary_size', 1),
+            wave_size=data.get('wave_size', 10),
+            poll_timeout=data.get('poll_timeout', 300),
+            stop_on_failure=data.get('stop_on_failure', True)
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid rollout options: {e}'}), 400
+    
+    for ip in ips:
+        mark_device_changed(ip)
+    return jsonify(job.to_dict()), 202
+
+
+@app.route('/api/update/batch')
+def update_batch_jobs():
+    """List recent rollout jobs"""
+    return jsonify([job.to_dict() for job in rollout_manager.all_jobs()])
+
+
+@app.route('/api/update/batch/<job_id>')
+def update_batch_status(job_id):
+    """Get progress of a rollout job"""
+    job = rollout_manager.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
 @app.route('/api/auth/<ip>', methods=['POST'])
 def toggle_auth(ip):
     """Toggle authentication on device with extensive debugging"""
     logger.info("=" * 60)
-    logger.info(f"AUTH TOGGLE REQUEST for {ip}")
+    logger.info(f"AUTH TOGGLE REQUEST for {describe_device(ip)}")
     logger.info("=" * 60)
     
     try:
@@ -366,6 +1044,7 @@ def toggle_auth(ip):
         
         if result.get('success'):
             logger.info(f"✅ SUCCESS: Auth {'enabled' if enable else 'disabled'}")
+            mark_device_changed(ip)
             return jsonify({'success': True, 'auth_enabled': enable, 'response': result.get('response')})
         else:
             logger.error(f"❌ FAILED: {result.get('error')}")
@@ -394,12 +1073,131 @@ def reboot_device(ip):
             return jsonify({'error': 'Reboot failed'}), 500
         
     except Exception as e:
-        logger.error(f"Error rebooting device {ip}: {e}")
+        logger.error(f"Error rebooting device {describe_device(ip)}: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+def batch_reboot(ip, params):
+    """Reboot one device of a batch (generation from the cache)"""
+    allowed, reason = device_health.allow(ip)
+    if not allowed:
+        return {'success': False, 'error': f'Skipped: {reason}', 'retry': False}
+    
+    client = get_shelly_client(ip)
+    if not client:
+        return {'success': False, 'error': 'Could not detect device generation'}
+    if not client.reboot():
+        return {'success': False, 'error': 'Reboot failed'}
+    return {'success': True}
+
+
+def batch_set_auth(ip, params):
+    """Enable or disable authentication on one device of a batch (generation from the cache)"""
+    allowed, reason = device_health.allow(ip)
+    if not allowed:
+        return {'success': False, 'error': f'Skipped: {reason}', 'retry': False}
+    
+    client = get_shelly_client(ip)
+    if not client:
+        return {'success': False, 'error': 'Could not detect device generation'}
+    
+    result = client.set_auth(params['enable'], ADMIN_PASSWORD)
+    if not result.get('success'):
+        # A stale cached generation would fail every retry the same way
+        device_cache.invalidate(ip)
+        return {'success': False, 'error': result.get('error') or 'Unknown error'}
+    
+    mark_device_changed(ip)
+    return {'success': True, 'auth_enabled': params['enable']}
+
+
+# Bulk actions (parallel, with retries) behind /api/actions/batch
+batch_runner = BatchActionRunner({'reboot': batch_reboot, 'auth': batch_set_auth})
+
+
+@app.route('/api/actions/batch', methods=['POST'])
+def actions_batch():
+    """Run one action on many devices in parallel, streaming one JSON line per device"""
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    ips = data.get('ips') or []
+    
+    if action not in batch_runner.actions:
+        return jsonify({'error': f"Unknown action: {action}"}), 400
+    if not isinstance(ips, list) or not ips or not all(isinstance(ip, str) for ip in ips):
+        return jsonify({'error': 'No devices selected'}), 400
+    
+    params = {}
+    if action == 'auth':
+        if not ADMIN_PASSWORD:
+            logger.error("❌ No admin password configured in add-on settings")
+            return jsonify({'error': 'Password not configured in app settings'}), 400
+        params['enable'] = bool(data.get('enable', False))
+    
+    try:
+        concurrency = int(data['concurrency']) if data.get('concurrency') is not None else None
+        retries = int(data['retries']) if data.get('retries') is not None else None
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid batch options: {e}'}), 400
+    
+    def generate():
+        started = time.monotonic()
+        succeeded = failed = 0
+        for result in batch_runner.run(ips, action, params, concurrency, retries):
+            if result['success']:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(result) + '\n'
+        
+        summary = {'action': action, 'total': succeeded + failed, 'succeeded': succeeded,
+                   'failed': failed, 'elapsed': round(time.monotonic() - started, 3)}
+        logger.info("batch action=%(action)s total=%(total)d succeeded=%(succeeded)d "
+                    "failed=%(failed)d elapsed=%(elapsed).3fs", summary)
+        yield json.dumps({'done': True, **summary}) + '\n'
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def restore_snapshot():
+    """Warm the generation cache from the on-disk snapshot and revalidate it in the background"""
+    if inventory_snapshot.load():
+        for device in inventory_snapshot.stale_devices():
+            device_cache.observe(device.get('mac'), device.get('ip'))
+            if device.get('ip') and device.get('generation') and device.get('last_seen'):
+                age = max(time.time() - device['last_seen'], 0)
+                device_cache.store(device['ip'], device['generation'], device, age=age)
+    
+    inventory_snapshot.start_revalidation(live_scan)
+
+
+# On-disk snapshot: the first scans after a restart answer from it (marked
+# stale) while a live scan revalidates it in the background
+inventory_snapshot = InventorySnapshot()
+restore_snapshot()
+
+
+def shutdown():
+    """Stop background work before the process exits"""
+    running = [job.id for job in rollout_manager.all_jobs() if job.status == 'running']
+    if running:
+        logger.warning(f"Shutting down with rollouts still running: {', '.join(running)}")
+    
+    status_poller.stop()
+    presence.stop()
+    enrichment_engine.shutdown()
+    ha_client.ws_client.close()
+    if gen2_channels:
+        gen2_channels.close_all()
+
+
 if __name__ == '__main__':
     import sys
+    from server import SERVER_MODE, SERVER_THREADS
     
     # Get port from environment (for ingress mode) or use default
     port = int(os.environ.get('INGRESS_PORT', os.environ.get('PORT', 8099)))
@@ -409,10 +1207,15 @@ if __name__ == '__main__':
     print("=" * 50, file=sys.stderr)
     print(f"Host: 0.0.0.0", file=sys.stderr)
     print(f"Port: {port}", file=sys.stderr)
+    print(f"Server: {SERVER_MODE}" + (f" ({SERVER_THREADS} threads)" if SERVER_MODE == 'production' else ''), file=sys.stderr)
     print(f"Admin Password: {'Configured' if ADMIN_PASSWORD else 'Not set'}", file=sys.stderr)
     print(f"Data Source: Home Assistant", file=sys.stderr)
     print("=" * 50, file=sys.stderr)
     sys.stderr.flush()
     
-    # Enable debug mode for troubleshooting
-    app.run(host='0.0.0.0', port=port, debug=True)
+    if SERVER_MODE == 'development':
+        # Flask debug server for troubleshooting; the reloader would start every background thread twice
+        app.run(host='0.0.0.0', port=port, debug=True, threaded=True, use_reloader=False)
+    else:
+        from server import serve
+        serve(app, '0.0.0.0', port, on_shutdown=shutdown)
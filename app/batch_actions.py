@@ -0,0 +1,74 @@
+"""
+Bulk device actions
+Runs one action (reboot, auth toggle) over many devices in parallel with a
+concurrency cap and per-device retries, yielding each result as it finishes
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = 16
+MAX_RETRIES = 5
+
+
+class BatchActionRunner:
+    """
+    Applies named actions to lists of devices.
+
+    `actions` maps an action name to func(ip, params) returning a dict with
+    'success' and, on failure, 'error'. A failure with 'retry': False (e.g.
+    a device with an open circuit) is not retried; anything else - including
+    exceptions - is retried with exponential back-off.
+    """
+
+    def __init__(self, actions, concurrency=None, retries=None, retry_delay=1.0):
+        self.actions = actions
+        self.concurrency = concurrency or int(os.environ.get('BATCH_CONCURRENCY', 8))
+        self.retries = retries if retries is not None else int(os.environ.get('BATCH_RETRIES', 2))
+        self.retry_delay = retry_delay
+
+    def run(self, ips, action, params=None, concurrency=None, retries=None):
+        """
+        Yield one result per device, in completion order.
+
+        Closing the generator early (client went away) cancels devices that
+        have not started yet.
+        """
+        func = self.actions[action]
+        ips = list(dict.fromkeys(ip for ip in ips if ip))  # drop duplicates, keep order
+        concurrency = max(1, min(int(concurrency or self.concurrency), MAX_CONCURRENCY, len(ips) or 1))
+        retries = max(0, min(int(self.retries if retries is None else retries), MAX_RETRIES))
+
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f'batch-{action}')
+        try:
+            futures = [executor.submit(self._run_one, func, action, ip, params or {}, retries) for ip in ips]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run_one(self, func, action, ip, params, retries):
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                outcome = func(ip, params) or {}
+            except Exception as e:
+                outcome = {'success': False, 'error': str(e)}
+
+            if outcome.get('success') or not outcome.get('retry', True) or attempt > retries:
+                break
+            logger.debug("%s on %s failed (attempt %d): %s", action, ip, attempt, outcome.get('error'))
+            time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        result = {'ip': ip, 'action': action, 'attempts': attempt,
+                  'elapsed': round(time.monotonic() - started, 3)}
+        result.update({key: value for key, value in outcome.items() if key != 'retry'})
+        result['success'] = bool(outcome.get('success'))
+        if not result['success']:
+            result.setdefault('error', 'Action failed')
+        return result
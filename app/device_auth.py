@@ -0,0 +1,167 @@
+"""
+Cached device authentication
+Per-device HTTP Digest state (realm, nonce, nonce count) shared by every
+pooled connection, so requests to password-protected Gen2+ devices go out
+pre-authenticated instead of collecting a 401 challenge first
+"""
+import hashlib
+import logging
+import os
+import threading
+from urllib.parse import urlsplit
+
+from requests.auth import AuthBase, HTTPBasicAuth
+from requests.cookies import extract_cookies_to_jar
+from requests.utils import parse_dict_header
+
+from metrics import DEVICE_AUTH_CHALLENGES
+
+logger = logging.getLogger(__name__)
+
+# Shelly devices only know one user
+DEVICE_USERNAME = 'admin'
+
+HASHES = {
+    'MD5': hashlib.md5,
+    'SHA-256': hashlib.sha256,
+}
+
+
+class _DigestState:
+    """Last challenge from one device and how often its nonce was used"""
+
+    __slots__ = ('realm', 'nonce', 'opaque', 'algorithm', 'qop', 'nc', 'ha1')
+
+    def __init__(self, challenge, username, password):
+        self.realm = challenge.get('realm', '')
+        self.nonce = challenge.get('nonce', '')
+        self.opaque = challenge.get('opaque')
+        self.algorithm = (challenge.get('algorithm') or 'MD5').upper()
+        qops = [qop.strip() for qop in (challenge.get('qop') or '').split(',')]
+        self.qop = 'auth' if 'auth' in qops else None
+        self.nc = 0
+        self.ha1 = self.hash(f'{username}:{self.realm}:{password}')
+
+    def hash(self, text):
+        return HASHES[self.algorithm](text.encode()).hexdigest()
+
+
+class DigestSessionCache:
+    """Digest state per device (host), shared by all requests and threads"""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def store(self, host, challenge, username, password):
+        """Remember a new challenge (nonce count starts over)"""
+        if (challenge.get('algorithm') or 'MD5').upper() not in HASHES:
+            return False
+        with self._lock:
+            self._states[host] = _DigestState(challenge, username, password)
+        return True
+
+    def invalidate(self, host):
+        with self._lock:
+            self._states.pop(host, None)
+
+    def authorization(self, host, method, uri, username):
+        """Authorization header for the next request to this host, or None without a cached challenge"""
+        with self._lock:
+            state = self._states.get(host)
+            if state is None:
+                return None
+            state.nc += 1
+            nc = f'{state.nc:08x}'
+
+        cnonce = os.urandom(8).hex()
+        ha2 = state.hash(f'{method}:{uri}')
+        if state.qop:
+            response = state.hash(f'{state.ha1}:{state.nonce}:{nc}:{cnonce}:{state.qop}:{ha2}')
+        else:
+            response = state.hash(f'{state.ha1}:{state.nonce}:{ha2}')
+
+        header = (f'Digest username="{username}", realm="{state.realm}", nonce="{state.nonce}", '
+                  f'uri="{uri}", algorithm={state.algorithm}, response="{response}"')
+        if state.opaque:
+            header += f', opaque="{state.opaque}"'
+        if state.qop:
+            header += f', qop={state.qop}, nc={nc}, cnonce="{cnonce}"'
+        return header
+
+    def __len__(self):
+        return len(self._states)
+
+
+# Shared by every device request in the process
+DIGEST_SESSIONS = DigestSessionCache()
+
+
+class CachedDigestAuth(AuthBase):
+    """
+    HTTP Digest auth that reuses the device's last challenge.
+
+    Requests are signed up front from the cached nonce (with an increasing
+    nonce count). A 401 - first contact, an expired nonce (stale=true) or a
+    nonce the device forgot - stores the new challenge and retries once.
+    """
+
+    def __init__(self, password, username=DEVICE_USERNAME, cache=DIGEST_SESSIONS):
+        self.username = username
+        self.password = password
+        self.cache = cache
+
+    def __call__(self, request):
+        host = urlsplit(request.url).netloc
+        header = self.cache.authorization(host, request.method, request.path_url, self.username)
+        if header:
+            request.headers['Authorization'] = header
+        request.register_hook('response', self._handle_401)
+        return request
+
+    def _handle_401(self, response, **kwargs):
+        if response.status_code != 401:
+            return response
+
+        host = urlsplit(response.request.url).netloc
+        challenge_header = response.headers.get('www-authenticate', '')
+        if getattr(response.request, 'digest_retried', False) or not challenge_header.lower().startswith('digest '):
+            # Wrong password (or not digest): don't keep signing with this nonce
+            self.cache.invalidate(host)
+            DEVICE_AUTH_CHALLENGES.inc(reason='rejected')
+            return response
+
+        challenge = parse_dict_header(challenge_header[7:])
+        preauthenticated = 'Authorization' in response.request.headers
+        if challenge.get('stale', '').lower() == 'true':
+            reason = 'stale'
+        else:
+            reason = 'expired' if preauthenticated else 'new'
+        DEVICE_AUTH_CHALLENGES.inc(reason=reason)
+        logger.debug("Digest challenge from %s (%s)", host, reason)
+
+        if not self.cache.store(host, challenge, self.username, self.password):
+            return response
+
+        # Same approach as requests' HTTPDigestAuth: resend on the same connection pool
+        response.content
+        response.close()
+        retry = response.request.copy()
+        extract_cookies_to_jar(retry._cookies, response.request, response.raw)
+        retry.prepare_cookies(retry._cookies)
+        retry.headers['Authorization'] = self.cache.authorization(host, retry.method, retry.path_url, self.username)
+        retry.digest_retried = True
+
+        retried = response.connection.send(retry, **kwargs)
+        retried.history.append(response)
+        retried.request = retry
+        return retried
+
+
+def device_auth(generation, password):
+    """requests auth for a device: Basic for Gen1 (already pre-emptive), cached Digest for Gen2+"""
+    if not password:
+        return None
+    if generation == 1:
+        return HTTPBasicAuth(DEVICE_USERNAME, password)
+    return CachedDigestAuth(password)
@@ -0,0 +1,111 @@
+"""
+Generation and identity cache for Shelly devices
+Keyed by MAC (from the HA device registry) and by IP
+"""
+import logging
+import os
+import threading
+import time
+
+from device_records import normalize_mac
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceCache:
+    """Remembers the generation and identity of each device so it is probed only once"""
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get('CACHE_TTL', 3600))
+        self._entries = {}     # ip -> entry
+        self._mac_to_ip = {}   # mac -> ip
+        self._ip_to_mac = {}   # ip -> mac
+        self._lock = threading.Lock()
+
+        logger.info(f"Device cache initialized. TTL: {self.ttl}s")
+
+    def _expired(self, entry):
+        return self.ttl <= 0 or time.monotonic() - entry['updated'] > self.ttl
+
+    def _drop(self, ip):
+        """Remove the entry and MAC mapping for an IP (caller holds the lock)"""
+        self._entries.pop(ip, None)
+        mac = self._ip_to_mac.pop(ip, None)
+        if mac and self._mac_to_ip.get(mac) == ip:
+            del self._mac_to_ip[mac]
+
+    def observe(self, mac, ip):
+        """
+        Register the MAC -> IP mapping reported by Home Assistant.
+
+        When a known MAC shows up at a new IP, or a different MAC now owns an
+        IP, the stale entries are invalidated so the device is probed again.
+        """
+        mac = normalize_mac(mac)
+        if not mac or not ip:
+            return
+
+        with self._lock:
+            old_ip = self._mac_to_ip.get(mac)
+            if old_ip and old_ip != ip:
+                logger.info(f"Device {mac} moved from {old_ip} to {ip} - invalidating cache")
+                self._drop(old_ip)
+
+            old_mac = self._ip_to_mac.get(ip)
+            if old_mac and old_mac != mac:
+                logger.info(f"IP {ip} now belongs to {mac} (was {old_mac}) - invalidating cache")
+                self._drop(ip)
+
+            self._mac_to_ip[mac] = ip
+            self._ip_to_mac[ip] = mac
+
+    def get_generation(self, ip):
+        """Return the cached generation for an IP, or None on miss/expiry"""
+        with self._lock:
+            entry = self._entries.get(ip)
+            if not entry:
+                return None
+            if self._expired(entry):
+                self._drop(ip)
+                return None
+            return entry['generation']
+
+    def get_identity(self, ip):
+        """Return the cached identity (type, mac, generation) for an IP"""
+        with self._lock:
+            entry = self._entries.get(ip)
+            if not entry or self._expired(entry):
+                return None
+            identity = dict(entry['identity'])
+            identity.setdefault('mac', self._ip_to_mac.get(ip))
+            return identity
+
+    def store(self, ip, generation, identity=None, age=0):
+        """Store the generation (and optional identity fields) for an IP, `age` seconds old"""
+        if not ip or not generation:
+            return
+
+        with self._lock:
+            entry = self._entries.get(ip)
+            if entry is None or entry['generation'] != generation:
+                entry = {'generation': generation, 'identity': {}}
+                self._entries[ip] = entry
+            entry['updated'] = time.monotonic() - age
+
+            if identity:
+                entry['identity'].update({
+                    key: identity[key]
+                    for key in ('generation', 'type', 'mac')
+                    if identity.get(key)
+                })
+
+    def invalidate(self, ip):
+        """Forget everything cached for an IP"""
+        with self._lock:
+            self._drop(ip)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._mac_to_ip.clear()
+            self._ip_to_mac.clear()
@@ -0,0 +1,158 @@
+"""
+Per-device health tracking
+Rolling RTT estimate, consecutive failures and a circuit breaker per IP,
+so known-dead devices stop costing full timeouts on every scan
+"""
+import logging
+import os
+import threading
+import time
+
+from http_pool import DEVICE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Adaptive timeouts never go below these (seconds)
+MIN_CONNECT_TIMEOUT = 0.3
+MIN_READ_TIMEOUT = 0.5
+
+
+class _Health:
+    __slots__ = ('srtt', 'rttvar', 'failures', 'state', 'opened_at', 'open_for',
+                 'trial_started', 'last_error', 'last_success')
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = None
+        self.open_for = 0
+        self.trial_started = None
+        self.last_error = None
+        self.last_success = None
+
+
+class DeviceHealth:
+    """
+    Circuit breaker per device.
+
+    After `failure_threshold` consecutive failures the circuit opens and the
+    device is skipped for `open_seconds`. Then one trial probe is let through
+    (half-open): success closes the circuit, failure re-opens it for twice as
+    long, up to `max_open_seconds`.
+    """
+
+    def __init__(self, failure_threshold=None, open_seconds=None, max_open_seconds=3600):
+        self.failure_threshold = failure_threshold or int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 3))
+        self.open_seconds = open_seconds or float(os.environ.get('CIRCUIT_OPEN_SECONDS', 60))
+        self.max_open_seconds = max_open_seconds
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def allow(self, ip):
+        """Return (allowed, reason); reason explains why a device is skipped"""
+        now = time.monotonic()
+        with self._lock:
+            health = self._devices.get(ip)
+            if health is None or health.state == CLOSED:
+                return True, None
+
+            if health.state == OPEN:
+                if now < health.opened_at + health.open_for:
+                    # Stable text: it ends up in scan results, where a changing
+                    # reason would change the scan version on every request
+                    # (retry_in is reported by /api/health instead)
+                    return False, f"circuit open after {health.failures} failures ({health.last_error})"
+                health.state = HALF_OPEN
+                health.trial_started = now
+                return True, None
+
+            # Half-open: one trial at a time (a trial that never reported expires)
+            if now - health.trial_started < self.open_seconds:
+                return False, 'circuit half-open; trial probe in progress'
+            health.trial_started = now
+            return True, None
+
+    def record_success(self, ip, rtt):
+        """A response arrived after `rtt` seconds"""
+        with self._lock:
+            health = self._devices.setdefault(ip, _Health())
+            if health.srtt is None:
+                health.srtt = rtt
+                health.rttvar = rtt / 2
+            else:
+                # Jacobson/Karels estimator, as used for TCP retransmission timeouts
+                health.rttvar = 0.75 * health.rttvar + 0.25 * abs(health.srtt - rtt)
+                health.srtt = 0.875 * health.srtt + 0.125 * rtt
+
+            if health.state != CLOSED:
+                logger.info(f"Device {ip} is responding again - closing circuit")
+            health.failures = 0
+            health.state = CLOSED
+            health.open_for = 0
+            health.last_success = time.time()
+
+    def record_failure(self, ip, error):
+        """A request failed (timeout, connection error or no usable answer)"""
+        with self._lock:
+            health = self._devices.setdefault(ip, _Health())
+            health.failures += 1
+            health.last_error = str(error)
+
+            if health.state == HALF_OPEN:
+                health.open_for = min(health.open_for * 2, self.max_open_seconds)
+            elif health.state == CLOSED and health.failures >= self.failure_threshold:
+                health.open_for = self.open_seconds
+                logger.warning(f"Device {ip} failed {health.failures} times - skipping it for {health.open_for:.0f}s")
+            else:
+                return
+
+            health.state = OPEN
+            health.opened_at = time.monotonic()
+
+    def timeout_for(self, ip):
+        """(connect, read) timeout from the device's observed RTT, capped by the defaults"""
+        with self._lock:
+            health = self._devices.get(ip)
+            if health is None or health.srtt is None:
+                return DEVICE_TIMEOUT
+            rto = health.srtt + 4 * health.rttvar
+
+        return (
+            min(max(rto, MIN_CONNECT_TIMEOUT), DEVICE_TIMEOUT[0]),
+            min(max(rto, MIN_READ_TIMEOUT), DEVICE_TIMEOUT[1])
+        )
+
+    def clear(self):
+        """Forget every device's RTT and circuit state"""
+        with self._lock:
+            self._devices.clear()
+
+    @staticmethod
+    def _describe(health, now):
+        return {
+            'state': health.state,
+            'failures': health.failures,
+            'rtt_ms': round(health.srtt * 1000, 1) if health.srtt is not None else None,
+            'last_error': health.last_error,
+            'last_success': health.last_success,
+            'retry_in': (max(round(health.opened_at + health.open_for - now), 0)
+                         if health.state == OPEN else None)
+        }
+
+    def get(self, ip):
+        """Health of one device for the API, or None if it was never probed"""
+        with self._lock:
+            health = self._devices.get(ip)
+            return self._describe(health, time.monotonic()) if health else None
+
+    def to_dict(self):
+        """Health of every tracked device, for the API"""
+        now = time.monotonic()
+        with self._lock:
+            return {ip: self._describe(health, now) for ip, health in self._devices.items()}
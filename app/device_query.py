@@ -0,0 +1,204 @@
+"""
+Device list queries
+Filtering, sorting and keyset pagination over the device list for
+/api/devices, backed by an index rebuilt only when the data changes
+"""
+import base64
+import binascii
+import bisect
+import ipaddress
+import json
+import threading
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+SORT_FIELDS = ('name', 'ip', 'model', 'type', 'generation', 'fw', 'mac', 'auth', 'online')
+
+# Filters answered from value buckets: param -> device field
+BUCKET_FILTERS = {'generation': 'generation', 'model': 'model', 'auth': 'auth', 'online': 'online',
+                  'has_update': 'has_update'}
+
+_BOOLEANS = {'true': True, '1': True, 'yes': True, 'false': False, '0': False, 'no': False}
+
+
+def _bool_param(name, value):
+    try:
+        return _BOOLEANS[value.lower()]
+    except KeyError:
+        raise ValueError(f'{name} must be true or false') from None
+
+
+def _generation_param(value):
+    if value.lower() in ('unknown', 'none'):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError('generation must be a number or "unknown"') from None
+
+
+def _bucket_value(field, value):
+    """Normalized value used for bucket lookups"""
+    if field == 'model':
+        return (value or '').casefold()
+    return value
+
+
+def _sort_value(field, device):
+    """Sort value for a field; missing values sort last in ascending order"""
+    value = device.get(field)
+    if field == 'ip' and value:
+        try:
+            return (0, int(ipaddress.ip_address(value)))
+        except ValueError:
+            return (0, 0)
+    if value is None or value == '':
+        return (1, '')
+    if isinstance(value, bool):
+        return (0, int(value))
+    if isinstance(value, str):
+        return (0, value.casefold())
+    return (0, value)
+
+
+def encode_cursor(sort_key):
+    return base64.urlsafe_b64encode(json.dumps(sort_key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return [tuple(part) if isinstance(part, list) else part for part in data]
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('invalid cursor') from None
+
+
+def parse_query(args):
+    """
+    Parse /api/devices query parameters (a dict-like of strings).
+
+    Raises ValueError with a message for the client on invalid input.
+    """
+    query = {'filters': {}}
+
+    if args.get('generation'):
+        query['filters']['generation'] = _generation_param(args['generation'])
+    if args.get('model'):
+        query['filters']['model'] = args['model']
+    for name in ('auth', 'online', 'has_update'):
+        if args.get(name):
+            query['filters'][name] = _bool_param(name, args[name])
+    query['fw'] = (args.get('fw') or '').casefold() or None
+    query['q'] = (args.get('q') or '').casefold() or None
+
+    sort = args.get('sort') or 'name'
+    query['descending'] = sort.startswith('-')
+    query['sort'] = sort.lstrip('-')
+    if query['sort'] not in SORT_FIELDS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+
+    try:
+        limit = int(args.get('limit') or DEFAULT_LIMIT)
+        offset = int(args.get('offset') or 0)
+    except ValueError:
+        raise ValueError('limit and offset must be numbers') from None
+    query['limit'] = max(1, min(limit, MAX_LIMIT))
+    query['offset'] = max(0, offset)
+    query['cursor'] = decode_cursor(args['cursor']) if args.get('cursor') else None
+    return query
+
+
+class DeviceListIndex:
+    """
+    Sorted orderings and value buckets over the device list.
+
+    Rebuilt when the revision (inventory and scan result versions) changes;
+    orderings are built lazily per sort field.
+    """
+
+    def __init__(self):
+        self._revision = None
+        self._devices = {}    # key -> device dict
+        self._buckets = {}    # field -> value -> set of keys
+        self._orders = {}     # field -> ([sort keys], [device keys]) ascending
+        self._lock = threading.Lock()
+
+    def _rebuild(self, revision, devices):
+        self._revision = revision
+        self._devices = {}
+        self._buckets = {field: {} for field in BUCKET_FILTERS.values()}
+        self._orders = {}
+
+        for device in devices:
+            key = device.get('id') or device.get('ip')
+            if not key:
+                continue
+            self._devices[key] = device
+            for field in BUCKET_FILTERS.values():
+                value = _bucket_value(field, device.get(field))
+                self._buckets[field].setdefault(value, set()).add(key)
+
+    def _order(self, field):
+        order = self._orders.get(field)
+        if order is None:
+            entries = sorted(((_sort_value(field, device), key), key) for key, device in self._devices.items())
+            order = ([entry[0] for entry in entries], [entry[1] for entry in entries])
+            self._orders[field] = order
+        return order
+
+    def query(self, revision, load_devices, query):
+        """
+        Run a parsed query. `load_devices()` is only called when the revision changed.
+
+        Returns (matching devices of the page, total matches, next cursor or None).
+        """
+        with self._lock:
+            if revision != self._revision:
+                self._rebuild(revision, load_devices())
+
+            candidates = None
+            for param, value in query['filters'].items():
+                field = BUCKET_FILTERS[param]
+                keys = self._buckets[field].get(_bucket_value(field, value), set())
+                candidates = keys if candidates is None else candidates & keys
+
+            sort_keys, keys = self._order(query['sort'])
+            positions = range(len(keys))
+            if query['descending']:
+                positions = reversed(positions)
+
+            matches = []
+            for position in positions:
+                key = keys[position]
+                if candidates is not None and key not in candidates:
+                    continue
+                if not self._matches_text(self._devices[key], query):
+                    continue
+                matches.append(position)
+
+            start = query['offset']
+            if query['cursor'] is not None:
+                # Keyset pagination: continue right after the last returned sort key
+                cursor = tuple(query['cursor'])
+                if query['descending']:
+                    start = next((i for i, position in enumerate(matches) if sort_keys[position] < cursor), len(matches))
+                else:
+                    start = bisect.bisect_right([sort_keys[position] for position in matches], cursor)
+
+            page = matches[start:start + query['limit']]
+            next_cursor = None
+            if start + query['limit'] < len(matches) and page:
+                next_cursor = encode_cursor(sort_keys[page[-1]])
+
+            return [dict(self._devices[keys[position]]) for position in page], len(matches), next_cursor
+
+    @staticmethod
+    def _matches_text(device, query):
+        if query['fw'] and query['fw'] not in (device.get('fw') or '').casefold():
+            return False
+        if query['q']:
+            haystack = ' '.join(str(device.get(field) or '') for field in ('name', 'ip', 'mac', 'type', 'model'))
+            if query['q'] not in haystack.casefold():
+                return False
+        return True
@@ -0,0 +1,138 @@
+"""
+Compact Shelly device records
+Single-pass extraction from HA device registry entries and an index by
+HA device id, MAC and IP
+"""
+import re
+from dataclasses import dataclass
+
+SHELLY_PATTERN = re.compile('shelly', re.IGNORECASE)
+# IP from a configuration_url like "http://192.168.1.100" or "http://192.168.1.100/"
+IP_PATTERN = re.compile(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})')
+
+
+def normalize_mac(mac):
+    """Upper-case MAC without separators, or None"""
+    if not mac or mac == 'Unknown':
+        return None
+    return mac.replace(':', '').replace('-', '').upper()
+
+
+@dataclass(slots=True)
+class ShellyDevice:
+    """The registry fields the add-on needs for one Shelly device"""
+
+    id: str
+    name: str
+    ip: str | None
+    model: str
+    sw_version: str
+    mac: str | None
+    manufacturer: str
+
+    def to_dict(self):
+        """API representation (a fresh dict, safe to enrich)"""
+        device = {
+            'id': self.id,
+            'name': self.name,
+            'ip': self.ip,
+            'model': self.model,
+            'sw_version': self.sw_version,
+            'mac': self.mac or 'Unknown',
+            'manufacturer': self.manufacturer,
+            'type': self.model,
+            'fw': self.sw_version,
+            'generation': None,  # Will be enriched later
+            'auth': False  # Will be enriched later
+        }
+        if not self.ip:
+            device['error'] = 'No IP address found'
+        return device
+
+
+def extract_shelly_device(entry):
+    """Turn a device registry entry into a ShellyDevice, or None if it isn't a Shelly"""
+    manufacturer = entry.get('manufacturer') or ''
+    is_shelly = SHELLY_PATTERN.search(manufacturer) is not None
+    mac = None
+
+    # One walk over the identifiers finds both the Shelly domain and the MAC
+    for pair in entry.get('identifiers') or ():
+        if not isinstance(pair, (list, tuple)) or len(pair) < 2:
+            continue
+        domain = pair[0]
+        if domain == 'shelly':
+            is_shelly = True
+            mac = str(pair[1]).upper()
+            break
+        if not is_shelly and SHELLY_PATTERN.search(str(domain)):
+            is_shelly = True
+
+    if not is_shelly:
+        return None
+
+    configuration_url = entry.get('configuration_url')
+    ip_match = IP_PATTERN.search(configuration_url) if configuration_url else None
+
+    return ShellyDevice(
+        id=entry.get('id'),
+        name=entry.get('name') or entry.get('name_by_user') or 'Unknown',
+        ip=ip_match.group(1) if ip_match else None,
+        model=entry.get('model') or 'Unknown',
+        sw_version=entry.get('sw_version') or '',
+        mac=mac,
+        manufacturer=manufacturer or 'Shelly'
+    )
+
+
+class DeviceIndex:
+    """ShellyDevice records by HA device id, with MAC and IP lookups (not thread-safe)"""
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_mac = {}
+        self._by_ip = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def replace(self, records):
+        """Drop everything and index these records"""
+        self._by_id = {}
+        self._by_mac = {}
+        self._by_ip = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """Insert or replace a record"""
+        self.remove(record.id)
+        self._by_id[record.id] = record
+        mac = normalize_mac(record.mac)
+        if mac:
+            self._by_mac[mac] = record
+        if record.ip:
+            self._by_ip[record.ip] = record
+
+    def remove(self, device_id):
+        """Remove a record by HA device id (no-op if unknown)"""
+        record = self._by_id.pop(device_id, None)
+        if record is None:
+            return
+        mac = normalize_mac(record.mac)
+        if mac and self._by_mac.get(mac) is record:
+            del self._by_mac[mac]
+        if record.ip and self._by_ip.get(record.ip) is record:
+            del self._by_ip[record.ip]
+
+    def get(self, device_id):
+        return self._by_id.get(device_id)
+
+    def get_by_mac(self, mac):
+        return self._by_mac.get(normalize_mac(mac))
+
+    def get_by_ip(self, ip):
+        return self._by_ip.get(ip)
@@ -0,0 +1,101 @@
+"""
+Background diagnostics
+Runs the /api/debug checks as one background job at a time and keeps the
+last report, so opening the debug page never holds a request thread while
+Home Assistant is queried
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class DiagnosticsJob:
+    """One diagnostics run: per-check progress and the report it builds"""
+
+    def __init__(self, check_names):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = 'running'
+        self.created = time.time()
+        self.finished = None
+        self.checks = [{'name': name, 'status': 'queued', 'elapsed': None, 'error': None}
+                       for name in check_names]
+        self.report = {}
+        self.lock = threading.Lock()
+
+    def age(self):
+        return time.time() - (self.finished or self.created)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'id': self.id,
+                'status': self.status,
+                'created': self.created,
+                'finished': self.finished,
+                'checks': [dict(check) for check in self.checks],
+                'report': dict(self.report)
+            }
+
+
+class DiagnosticsRunner:
+    """
+    Runs named checks in a background thread.
+
+    `checks` is a list of (name, func(report)); each check adds its findings
+    to the report, which already holds those of the checks before it. A
+    failing check records its error and the next one still runs. While a
+    job is running, or its report is younger than `max_age`, start() hands
+    out that job instead of starting another.
+    """
+
+    def __init__(self, checks, max_age=None):
+        self.checks = checks
+        self.max_age = max_age if max_age is not None else float(os.environ.get('DIAGNOSTICS_MAX_AGE', 60))
+        self._job = None
+        self._lock = threading.Lock()
+
+    def start(self, force=False):
+        """Return (job, started): the running or recent job, or a newly started one"""
+        with self._lock:
+            job = self._job
+            if job and (job.status == 'running' or (not force and job.age() <= self.max_age)):
+                return job, False
+
+            job = DiagnosticsJob([name for name, _ in self.checks])
+            self._job = job
+
+        threading.Thread(target=self._run, args=(job,), name=f'diagnostics-{job.id}', daemon=True).start()
+        logger.info(f"Diagnostics {job.id} started")
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._job
+        return job if job and job.id == job_id else None
+
+    def _run(self, job):
+        for check, (name, func) in zip(job.checks, self.checks):
+            with job.lock:
+                check['status'] = 'running'
+                # Later checks can use earlier findings; the job's report only changes under its lock
+                report = dict(job.report)
+            started = time.perf_counter()
+            try:
+                func(report)
+                status, error = 'ok', None
+            except Exception as e:
+                logger.warning(f"Diagnostics check {name} failed: {e}")
+                status, error = 'failed', str(e)
+
+            with job.lock:
+                job.report.update(report)
+                check.update(status=status, error=error, elapsed=round(time.perf_counter() - started, 3))
+
+        with job.lock:
+            job.status = 'completed'
+            job.finished = time.time()
+        logger.info(f"Diagnostics {job.id} finished")
@@ -0,0 +1,233 @@
+"""
+Active subnet sweep
+Finds Shelly devices in NETWORK_RANGE, including ones HA does not know about
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import socket
+import time
+
+from device_records import normalize_mac
+
+logger = logging.getLogger(__name__)
+
+# Refuse to sweep more than this many addresses in one go (a /20)
+MAX_SWEEP_HOSTS = 4096
+
+
+def detect_local_network():
+    """Guess the /24 the add-on is running in (host network)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # No packet is sent; this only selects the outgoing interface
+        sock.connect(('192.0.2.1', 80))
+        local_ip = sock.getsockname()[0]
+    finally:
+        sock.close()
+    return ipaddress.ip_network(f'{local_ip}/24', strict=False)
+
+
+def parse_network_ranges(value):
+    """Parse comma/space separated CIDR ranges, auto-detecting when empty"""
+    ranges = [part for part in (value or '').replace(',', ' ').split() if part and part != 'null']
+    if not ranges:
+        return [detect_local_network()]
+    return [ipaddress.ip_network(part, strict=False) for part in ranges]
+
+
+def parse_fingerprint(body):
+    """
+    Identify a device from its /shelly response.
+
+    Both generations answer /shelly: Gen2+ includes a 'gen' field, Gen1 has
+    'type'. So one request is enough to tell them apart. Gen3+ devices speak
+    the Gen2 RPC API, so their generation is 2 (the reported one is kept as
+    'gen').
+    """
+    try:
+        data = json.loads(body)
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(data, dict) or 'mac' not in data:
+        return None
+
+    if data.get('gen'):
+        return {
+            'generation': 2,
+            'gen': data.get('gen'),
+            'mac': normalize_mac(data.get('mac')),
+            'type': data.get('model') or data.get('app'),
+            'fw': data.get('ver') or data.get('fw_id'),
+            'auth': bool(data.get('auth_en')),
+            'name': data.get('name') or data.get('id')
+        }
+
+    if data.get('type'):
+        return {
+            'generation': 1,
+            'mac': normalize_mac(data.get('mac')),
+            'type': data.get('type'),
+            'fw': data.get('fw'),
+            'auth': bool(data.get('auth')),
+            'name': None
+        }
+
+    return None
+
+
+def _decode_chunked(body):
+    """Decode a chunked HTTP body"""
+    decoded = b''
+    while body:
+        size_line, _, body = body.partition(b'\r\n')
+        size = int(size_line.split(b';')[0] or b'0', 16)
+        if size == 0:
+            break
+        decoded += body[:size]
+        body = body[size + 2:]
+    return decoded
+
+
+class _RateLimiter:
+    """Spaces out connection attempts to at most `rate` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class SubnetSweeper:
+    """Sweeps CIDR ranges: TCP pre-filter on port 80, then one /shelly fingerprint"""
+
+    def __init__(self, network_range=None, concurrency=None, rate=None,
+                 connect_timeout=0.5, request_timeout=2, port=80):
+        self.network_range = network_range if network_range is not None else os.environ.get('NETWORK_RANGE', '')
+        self.concurrency = concurrency or int(os.environ.get('SWEEP_CONCURRENCY', 128))
+        self.rate = rate or int(os.environ.get('SWEEP_RATE', 200))
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.port = port
+
+    def hosts(self):
+        """All addresses to sweep"""
+        hosts = []
+        for network in parse_network_ranges(self.network_range):
+            hosts.extend(str(ip) for ip in network.hosts())
+            if len(hosts) > MAX_SWEEP_HOSTS:
+                raise ValueError(f"Network range too large to sweep (more than {MAX_SWEEP_HOSTS} addresses)")
+        return hosts
+
+    def sweep(self):
+        """Run a sweep and return fingerprinted devices (blocking)"""
+        hosts = self.hosts()
+        started = time.monotonic()
+
+        found = asyncio.run(self._sweep(hosts))
+
+        logger.info(f"✓ Sweep of {len(hosts)} addresses found {len(found)} Shelly devices "
+                    f"in {time.monotonic() - started:.2f}s")
+        return found
+
+    async def _sweep(self, hosts):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = _RateLimiter(self.rate)
+
+        async def bounded(ip):
+            async with semaphore:
+                await limiter.wait()
+                return await self._probe(ip)
+
+        results = await asyncio.gather(*(bounded(ip) for ip in hosts))
+        return [result for result in results if result]
+
+    async def _probe(self, ip):
+        """TCP-connect to port 80; if it is open, fingerprint over the same connection"""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(ip, self.port),
+                timeout=self.connect_timeout
+            )
+        except (OSError, asyncio.TimeoutError):
+            return None
+
+        try:
+            writer.write(
+                f"GET /shelly HTTP/1.1\r\nHost: {ip}\r\nConnection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout=self.request_timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        finally:
+            writer.close()
+
+        head, _, body = response.partition(b'\r\n\r\n')
+        status_line = head.split(b'\r\n', 1)[0].split()
+        if len(status_line) < 2 or status_line[1] != b'200':
+            return None
+        if b'transfer-encoding: chunked' in head.lower():
+            body = _decode_chunked(body)
+
+        fingerprint = parse_fingerprint(body)
+        if fingerprint:
+            fingerprint['ip'] = ip
+        return fingerprint
+
+
+def merge_with_inventory(ha_devices, found):
+    """
+    Merge sweep results into the HA device list by MAC.
+
+    Known devices get 'discovered_ip' (and 'ip_changed' when HA's
+    configuration_url is out of date). Devices HA does not know are appended
+    with 'in_home_assistant': False.
+    """
+    by_mac = {}
+    for device in ha_devices:
+        mac = normalize_mac(device.get('mac'))
+        device['in_home_assistant'] = True
+        if mac:
+            by_mac[mac] = device
+
+    merged = list(ha_devices)
+    for result in found:
+        device = by_mac.get(result['mac'])
+        if device:
+            device['discovered_ip'] = result['ip']
+            device['ip_changed'] = bool(device.get('ip')) and device.get('ip') != result['ip']
+            if not device.get('ip'):
+                device['ip'] = result['ip']
+                device.pop('error', None)
+        else:
+            merged.append({
+                'id': None,
+                'name': result.get('name') or result.get('type') or 'Unknown',
+                'ip': result['ip'],
+                'model': result.get('type') or 'Unknown',
+                'sw_version': result.get('fw') or '',
+                'mac': result.get('mac') or 'Unknown',
+                'manufacturer': 'Shelly',
+                'type': result.get('type') or 'Unknown',
+                'fw': result.get('fw') or '',
+                'generation': result.get('generation'),
+                'auth': result.get('auth', False),
+                'discovered_ip': result['ip'],
+                'in_home_assistant': False
+            })
+
+    return merged
@@ -0,0 +1,134 @@
+"""
+Concurrent enrichment engine for Shelly devices
+Runs the per-device live probes in a bounded thread pool
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from metrics import SCAN_ENRICHMENT_DURATION, SCAN_DEVICE_RESULTS
+
+logger = logging.getLogger(__name__)
+
+
+class EnrichmentEngine:
+    """Enrich many devices in parallel with a worker limit and a per-scan deadline"""
+
+    def __init__(self, enrich_func, max_workers=None, scan_timeout=None):
+        self.enrich_func = enrich_func
+        self.max_workers = max_workers or int(os.environ.get('SCAN_WORKERS', 16))
+        self.scan_timeout = scan_timeout or float(os.environ.get('SCAN_TIMEOUT', 30))
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='enrich'
+        )
+
+        logger.info(f"Enrichment engine ready: {self.max_workers} workers, {self.scan_timeout}s scan deadline")
+
+    def _submit(self, device):
+        """Submit one device, or return None when it cannot be probed"""
+        if not device.get('ip'):
+            return None
+        # Work on a copy so a late-finishing worker never mutates a returned result
+        return self.executor.submit(self.enrich_func, dict(device))
+
+    @staticmethod
+    def mark_no_ip(device):
+        """Mark a device that has no IP address"""
+        device['error'] = 'No IP address found'
+        device['type'] = device.get('model', 'Unknown')
+        device['fw'] = device.get('sw_version', 'Unknown')
+        return device
+
+    @staticmethod
+    def mark_timeout(device):
+        """Mark a device that did not answer before the scan deadline"""
+        device['timeout'] = True
+        device['error'] = 'Device did not respond before scan deadline'
+        return device
+
+    @staticmethod
+    def mark_failed(device, error):
+        """Mark a device whose enrichment raised an exception"""
+        device['error'] = str(error)
+        return device
+
+    def _result(self, future, device):
+        """Get the enriched device from a finished future"""
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error("Enrichment failed for %s: %s", device.get('ip'), e)
+            SCAN_DEVICE_RESULTS.inc(result='failed')
+            return self.mark_failed(device, e)
+
+        if result.get('skipped'):
+            SCAN_DEVICE_RESULTS.inc(result='skipped')
+        elif result.get('passive'):
+            SCAN_DEVICE_RESULTS.inc(result='passive')
+        else:
+            SCAN_DEVICE_RESULTS.inc(result='enriched' if result.get('generation') else 'unreachable')
+        return result
+
+    def iter_enriched(self, devices):
+        """
+        Yield (index, device) pairs as soon as each device is enriched.
+
+        Devices without an IP are yielded first. Devices that are still being
+        probed when the scan deadline expires are yielded last, unenriched and
+        with a timeout marker.
+        """
+        started = time.monotonic()
+        futures = {}
+
+        try:
+            for index, device in enumerate(devices):
+                future = self._submit(device)
+                if future is None:
+                    SCAN_DEVICE_RESULTS.inc(result='no_ip')
+                    yield index, self.mark_no_ip(device)
+                else:
+                    futures[future] = index
+
+            total = len(futures)
+            try:
+                for future in as_completed(list(futures), timeout=self.scan_timeout):
+                    index = futures.pop(future)
+                    yield index, self._result(future, devices[index])
+            except FuturesTimeoutError:
+                pass
+
+            elapsed = time.monotonic() - started
+            SCAN_ENRICHMENT_DURATION.observe(elapsed)
+            if futures:
+                SCAN_DEVICE_RESULTS.inc(len(futures), result='timeout')
+            logger.debug("Enriched %d/%d devices in %.2fs (%d timed out)",
+                         total - len(futures), total, elapsed, len(futures))
+
+            for future, index in list(futures.items()):
+                # Drop queued work; running probes finish on their own timeouts
+                future.cancel()
+                del futures[future]
+                yield index, self.mark_timeout(devices[index])
+        finally:
+            # Consumer went away (e.g. a closed stream) - don't leave queued probes behind
+            for future in futures:
+                future.cancel()
+
+    def enrich_all(self, devices):
+        """
+        Enrich all devices concurrently.
+
+        Results keep the input order. Devices that are still being probed when
+        the scan deadline expires are returned unenriched with a timeout marker.
+        """
+        results = list(devices)
+        for index, device in self.iter_enriched(devices):
+            results[index] = device
+        return results
+
+    def shutdown(self):
+        """Stop accepting work and cancel queued probes"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
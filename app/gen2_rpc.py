@@ -0,0 +1,349 @@
+"""
+Gen2+ JSON-RPC over WebSocket
+One persistent ws://<ip>/rpc connection per Gen2+ device. Calls are
+pipelined on it (routed back by id on a reader thread) and NotifyStatus
+pushes keep a status cache fresh without polling.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import websocket
+
+logger = logging.getLogger(__name__)
+
+# Identifies us to the device; notifications are only sent to clients with a src
+RPC_SOURCE = 'shelly-manager'
+
+# Calls behind /api/device/<ip>, sent in one burst
+DETAIL_CALLS = (
+    ('Shelly.GetDeviceInfo', None),
+    ('Shelly.GetStatus', None),
+    ('Shelly.GetConfig', None),
+    ('Shelly.CheckForUpdate', None),
+)
+
+
+class RpcError(Exception):
+    """Error object returned by the device for one call"""
+
+    def __init__(self, code, message):
+        super().__init__(f"RPC error {code}: {message}")
+        self.code = code
+        self.message = message
+
+
+class _PendingCall:
+    """A call waiting for its response frame"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def digest_auth(challenge, password, cnonce):
+    """
+    The 'auth' object for a Gen2 digest challenge (username is always admin).
+
+    The RPC auth object carries no nonce count: the device checks the
+    response against the nc of its own challenge. `cnonce` is a number.
+    """
+    nc = challenge.get('nc', 1)
+    ha1 = _sha256(f"admin:{challenge['realm']}:{password}")
+    ha2 = _sha256('dummy_method:dummy_uri')
+    return {
+        'realm': challenge['realm'],
+        'username': 'admin',
+        'nonce': challenge['nonce'],
+        'cnonce': cnonce,
+        'response': _sha256(f"{ha1}:{challenge['nonce']}:{nc}:{cnonce}:auth:{ha2}"),
+        'algorithm': 'SHA-256'
+    }
+
+
+def _merge(target, update):
+    """Merge a partial NotifyStatus update into the full status (in place)"""
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class Gen2RpcChannel:
+    """A JSON-RPC WebSocket to one Gen2+ device"""
+
+    def __init__(self, ip, password='', on_status=None, connect_timeout=3, heartbeat_interval=30):
+        self.ip = ip
+        self.password = password
+        self.on_status = on_status
+        self.connect_timeout = connect_timeout
+        self.heartbeat_interval = heartbeat_interval
+
+        self.status = None           # full status, kept current by notifications
+        self.details = None          # last pipelined GetDeviceInfo/GetStatus/GetConfig result
+        self.details_updated = None
+
+        self._ws = None
+        self._ids = itertools.count(1)
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._status_lock = threading.Lock()
+        self._auth_challenge = None
+        self._closed = threading.Event()
+
+    @property
+    def alive(self):
+        return self._ws is not None and not self._closed.is_set()
+
+    def connect(self):
+        """Open the WebSocket and start the reader thread"""
+        self._ws = websocket.create_connection(f'ws://{self.ip}/rpc', timeout=self.connect_timeout)
+        self._ws.settimeout(self.heartbeat_interval)
+        threading.Thread(target=self._read_loop, name=f'gen2-rpc-{self.ip}', daemon=True).start()
+        logger.debug("Gen2 RPC channel to %s open", self.ip)
+        return self
+
+    def close(self):
+        self._closed.set()
+        ws = self._ws
+        if ws:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        self._fail_pending(ConnectionError('RPC channel closed'))
+
+    def _read_loop(self):
+        try:
+            while not self._closed.is_set():
+                try:
+                    raw = self._ws.recv()
+                except websocket.WebSocketTimeoutException:
+                    # Idle: a ping keeps NAT/firewall state alive and detects dead peers
+                    with self._send_lock:
+                        self._ws.ping()
+                    continue
+
+                if not raw:
+                    raise ConnectionError('closed by device')
+                self._dispatch(json.loads(raw))
+        except Exception as e:
+            if not self._closed.is_set():
+                logger.debug("Gen2 RPC channel to %s lost: %s", self.ip, e)
+        finally:
+            self._closed.set()
+            self._fail_pending(ConnectionError('RPC channel lost'))
+
+    def _dispatch(self, message):
+        method = message.get('method')
+        if method in ('NotifyStatus', 'NotifyFullStatus'):
+            self._on_notify(method, message.get('params', {}))
+            return
+
+        with self._pending_lock:
+            pending = self._pending.pop(message.get('id'), None)
+        if pending:
+            pending.response = message
+            pending.event.set()
+
+    def _on_notify(self, method, params):
+        with self._status_lock:
+            if method == 'NotifyFullStatus' or self.status is None:
+                self.status = dict(params)
+            else:
+                _merge(self.status, params)
+            status = json.loads(json.dumps(self.status))
+
+        if self.on_status:
+            try:
+                self.on_status(self.ip, status)
+            except Exception as e:
+                logger.error(f"Status callback failed for {self.ip}: {e}", exc_info=True)
+
+    def _fail_pending(self, error):
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for call in pending:
+            call.error = error
+            call.event.set()
+
+    def _auth(self):
+        """Auth object for the next request, once the device has challenged us"""
+        if not self._auth_challenge or not self.password:
+            return None
+        return digest_auth(self._auth_challenge, self.password, random.randint(1, 2 ** 31 - 1))
+
+    def _send_burst(self, calls):
+        """Send all calls back-to-back; returns their pending handles"""
+        if not self.alive:
+            raise ConnectionError('RPC channel not connected')
+
+        handles = []
+        with self._send_lock:
+            for method, params in calls:
+                call_id = next(self._ids)
+                request = {'id': call_id, 'src': RPC_SOURCE, 'method': method}
+                if params:
+                    request['params'] = params
+                auth = self._auth()
+                if auth:
+                    request['auth'] = auth
+
+                pending = _PendingCall()
+                with self._pending_lock:
+                    self._pending[call_id] = pending
+                self._ws.send(json.dumps(request))
+                handles.append((call_id, pending))
+        return handles
+
+    def _collect(self, handles, deadline):
+        """Wait for every handle; returns results or RpcError/ConnectionError instances"""
+        results = []
+        for call_id, pending in handles:
+            if not pending.event.wait(max(deadline - time.monotonic(), 0)):
+                with self._pending_lock:
+                    self._pending.pop(call_id, None)
+                results.append(TimeoutError(f'No RPC response from {self.ip}'))
+            elif pending.error:
+                results.append(pending.error)
+            elif 'error' in pending.response:
+                error = pending.response['error']
+                results.append(RpcError(error.get('code'), error.get('message')))
+            else:
+                results.append(pending.response.get('result'))
+        return results
+
+    def call_many(self, calls, timeout=5):
+        """
+        Pipeline several calls on the connection.
+
+        Returns one entry per call: the result, or an exception instance for
+        calls that failed. A 401 challenge is answered once with digest auth.
+        """
+        deadline = time.monotonic() + timeout
+        results = self._collect(self._send_burst(calls), deadline)
+
+        unauthorized = [index for index, result in enumerate(results)
+                        if isinstance(result, RpcError) and result.code == 401]
+        if unauthorized and self.password:
+            try:
+                self._auth_challenge = json.loads(results[unauthorized[0]].message)
+            except (TypeError, ValueError):
+                return results
+            retried = self._collect(self._send_burst([calls[index] for index in unauthorized]), deadline)
+            for index, result in zip(unauthorized, retried):
+                results[index] = result
+
+        return results
+
+    def call(self, method, params=None, timeout=5):
+        """Single call; raises the RpcError/ConnectionError on failure"""
+        result = self.call_many([(method, params)], timeout)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def fetch_details(self, timeout=5):
+        """Device info, status, config and update check in one burst"""
+        info, status, config, update = self.call_many(DETAIL_CALLS, timeout)
+        if isinstance(info, Exception):
+            raise info
+
+        details = {
+            'generation': 2,
+            'id': info.get('id'),
+            'name': info.get('name'),
+            'type': info.get('model'),
+            'mac': info.get('mac'),
+            'fw': info.get('ver') or info.get('fw_id'),
+            'auth': info.get('auth_en', False),
+            'transport': 'websocket'
+        }
+        if not isinstance(config, Exception):
+            details['settings'] = config
+        if not isinstance(status, Exception):
+            with self._status_lock:
+                # Notifications that arrived before this snapshot are older - start from it
+                self.status = json.loads(json.dumps(status))
+            details['status'] = status
+        if not isinstance(update, Exception):
+            details['update'] = update
+
+        self.details = details
+        self.details_updated = time.monotonic()
+        return details
+
+    def cached_details(self, max_age):
+        """Last details with the pushed status, or None when too old or disconnected"""
+        if not self.alive or self.details is None or time.monotonic() - self.details_updated > max_age:
+            return None
+        details = dict(self.details)
+        with self._status_lock:
+            if self.status is not None:
+                details['status'] = json.loads(json.dumps(self.status))
+        return details
+
+
+class Gen2ChannelPool:
+    """Keeps up to `max_channels` Gen2 RPC channels open, least recently used closed first"""
+
+    def __init__(self, password='', on_status=None, max_channels=None, details_max_age=600):
+        self.password = password
+        self.on_status = on_status
+        self.max_channels = max_channels or int(os.environ.get('GEN2_WS_MAX_CHANNELS', 64))
+        self.details_max_age = details_max_age
+        self._channels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def channel(self, ip):
+        """A connected channel for the device (opened on first use)"""
+        with self._lock:
+            channel = self._channels.get(ip)
+            if channel and channel.alive:
+                self._channels.move_to_end(ip)
+                return channel
+            self._channels.pop(ip, None)
+
+        channel = Gen2RpcChannel(ip, self.password, on_status=self.on_status).connect()
+
+        with self._lock:
+            existing = self._channels.get(ip)
+            if existing and existing.alive:
+                # Another thread connected first
+                channel.close()
+                return existing
+            self._channels[ip] = channel
+            while len(self._channels) > self.max_channels:
+                _, evicted = self._channels.popitem(last=False)
+                evicted.close()
+        return channel
+
+    def fetch_details(self, ip, timeout=5):
+        return self.channel(ip).fetch_details(timeout)
+
+    def cached_details(self, ip):
+        """Details kept fresh by notifications, without a round-trip (None if unavailable)"""
+        with self._lock:
+            channel = self._channels.get(ip)
+        return channel.cached_details(self.details_max_age) if channel else None
+
+    def close_all(self):
+        with self._lock:
+            channels = list(self._channels.values())
+            self._channels.clear()
+        for channel in channels:
+            channel.close()
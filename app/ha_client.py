@@ -1,140 +1,151 @@
 """
 Home Assistant API client to fetch Shelly devices
 """
+import json
 import os
-import requests
 import logging
-import re
+import time
 from ha_websocket import HAWebSocketClient
+from http_pool import get_supervisor_session
+from inventory import ShellyInventory
+from device_records import extract_shelly_device
+from metrics import REGISTRY_FILTER_DURATION
+from log_config import LogSampler
+from single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# Per-device lines are sampled so large registries don't flood the log
+device_log = LogSampler(logger)
+
+# Renders the registry fields parse_device() needs for a list of device ids
+DEVICE_LOOKUP_TEMPLATE = (
+    "[{% for id in device_ids %}"
+    "{{ {'id': id,"
+    " 'name': device_attr(id, 'name'),"
+    " 'name_by_user': device_attr(id, 'name_by_user'),"
+    " 'manufacturer': device_attr(id, 'manufacturer'),"
+    " 'model': device_attr(id, 'model'),"
+    " 'sw_version': device_attr(id, 'sw_version'),"
+    " 'configuration_url': device_attr(id, 'configuration_url'),"
+    " 'identifiers': (device_attr(id, 'identifiers') or []) | map('list') | list"
+    "} | tojson }}"
+    "{% if not loop.last %},{% endif %}"
+    "{% endfor %}]"
+)
+
 
 class HomeAssistantClient:
     """Client to interact with Home Assistant Supervisor API"""
     
     def __init__(self):
         self.supervisor_token = os.environ.get('SUPERVISOR_TOKEN', '')
-        self.ha_url = 'http://supervisor/core'
+        self.ha_url = os.environ.get('HA_URL', 'http://supervisor/core')
         self.headers = {
             'Authorization': f'Bearer {self.supervisor_token}',
             'Content-Type': 'application/json'
         }
+        self.session = get_supervisor_session()
+        self._connection_check = SingleFlight('ha_connection_check', reuse_seconds=2)
         self.ws_client = HAWebSocketClient()
+        self.inventory = ShellyInventory(self)
+        
+        # Connect and subscribe right away so the first scan finds a ready session
+        self.inventory.start()
         
         logger.info(f"HA Client initialized. Token present: {bool(self.supervisor_token)}")
     
     def get_shelly_devices(self):
-        """Get all Shelly devices from Home Assistant via WebSocket API"""
-        logger.info("=" * 60)
-        logger.info("FETCHING SHELLY DEVICES FROM HOME ASSISTANT")
-        logger.info("=" * 60)
-        
+        """Get all Shelly devices (as dicts) from the incrementally maintained inventory"""
+        shelly_devices = self.inventory.get_devices()
+        logger.debug("Inventory: %d Shelly devices", len(shelly_devices))
+        return shelly_devices
+    
+    def fetch_shelly_devices(self):
+        """Get ShellyDevice records from Home Assistant via WebSocket API (full registry pull; None if it failed)"""
         try:
             # Get device registry via WebSocket
-            logger.info("Getting device registry via WebSocket...")
             device_registry = self.ws_client.get_device_registry()
-            logger.info(f"✓ Found {len(device_registry)} devices in registry")
+            if device_registry is None:
+                return None
             
             # Build device list from device registry
             shelly_devices = []
+            started = time.perf_counter()
             
-            for device in device_registry:
-                # Check if this is a Shelly device
-                identifiers = device.get('identifiers', [])
-                
-                # Check if it's a Shelly device by manufacturer or identifiers
-                manufacturer = device.get('manufacturer', '').lower()
-                is_shelly = 'shelly' in manufacturer
-                
-                # Also check identifiers
-                if not is_shelly:
-                    for identifier_pair in identifiers:
-                        if isinstance(identifier_pair, list) and len(identifier_pair) >= 2:
-                            if 'shelly' in str(identifier_pair[0]).lower():
-                                is_shelly = True
-                                break
-                
-                if is_shelly:
-                    device_id = device.get('id')
-                    name = device.get('name') or device.get('name_by_user', 'Unknown')
-                    model = device.get('model', 'Unknown')
-                    sw_version = device.get('sw_version', '')
-                    
-                    # Extract IP from configuration_url
-                    ip_address = None
-                    configuration_url = device.get('configuration_url', '')
-                    
-                    if configuration_url:
-                        # Extract IP from URL like "http://192.168.1.100" or "http://192.168.1.100/"
-                        # Use regex to find IP pattern
-                        import re
-                        ip_match = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', configuration_url)
-                        if ip_match:
-                            ip_address = ip_match.group(1)
-                            logger.debug(f"Extracted IP {ip_address} from {configuration_url}")
-                    
-                    # Extract MAC address from identifiers
-                    mac_address = 'Unknown'
-                    for identifier_pair in identifiers:
-                        if isinstance(identifier_pair, list) and len(identifier_pair) >= 2:
-                            if identifier_pair[0] == 'shelly':
-                                mac_address = identifier_pair[1].upper()
-                                break
-                    
-                    device_info = {
-                        'id': device_id,
-                        'name': name,
-                        'ip': ip_address,
-                        'model': model,
-                        'sw_version': sw_version,
-                        'mac': mac_address,
-                        'manufacturer': device.get('manufacturer', 'Shelly'),
-                        'type': model,
-                        'fw': sw_version,
-                        'generation': None,  # Will be enriched later
-                        'auth': False  # Will be enriched later
-                    }
-                    
-                    if ip_address:
-                        logger.info(f"✓ Found IP for {name}: {ip_address}")
-                        shelly_devices.append(device_info)
-                    else:
-                        logger.warning(f"⚠ Device {name} has no configuration_url or IP")
-                        logger.debug(f"  Device data: {device}")
-                        # Still add it but mark as no IP
-                        device_info['error'] = 'No IP address found'
+            with REGISTRY_FILTER_DURATION.time():
+                for device in device_registry:
+                    device_info = self.parse_device(device)
+                    if device_info:
                         shelly_devices.append(device_info)
             
-            logger.info(f"✓ Found {len(shelly_devices)} Shelly devices")
-            logger.info(f"  - With IP: {sum(1 for d in shelly_devices if d.get('ip'))}")
-            logger.info(f"  - Without IP: {sum(1 for d in shelly_devices if not d.get('ip'))}")
-            logger.info("=" * 60)
-            
+            without_ip = sum(1 for d in shelly_devices if not d.ip)
+            logger.info(
+                "registry_pull registry=%d shelly=%d without_ip=%d filter_ms=%.1f",
+                len(device_registry), len(shelly_devices), without_ip,
+                (time.perf_counter() - started) * 1000
+            )
             return shelly_devices
             
         except Exception as e:
-            logger.error(f"❌ Error getting Shelly devices: {e}", exc_info=True)
-            logger.info("=" * 60)
-            return []
+            logger.error("❌ Error getting Shelly devices: %s", e, exc_info=True)
+            return None
     
-    def test_connection(self):
-        """Test if we can connect to HA API"""
-        logger.info("Testing HA API connection...")
+    def fetch_devices_by_id(self, device_ids):
+        """
+        Get selected device registry entries without downloading the full registry.
         
+        HA has no WebSocket command for single registry entries, so this renders
+        a template with device_attr() for just the requested ids. Returns None
+        when the lookup fails.
+        """
         try:
-            response = requests.get(
-                f'{self.ha_url}/api/',
+            response = self.session.post(
+                f'{self.ha_url}/api/template',
                 headers=self.headers,
-                timeout=5
+                json={'template': DEVICE_LOOKUP_TEMPLATE, 'variables': {'device_ids': list(device_ids)}}
             )
             
-            logger.info(f"API test response: {response.status_code}")
+            if response.status_code != 200:
+                logger.error(f"❌ Device lookup failed: {response.status_code}")
+                return None
+            
+            return json.loads(response.text)
+            
+        except Exception as e:
+            logger.error(f"❌ Device lookup error: {e}")
+            return None
+    
+    @staticmethod
+    def parse_device(device):
+        """Turn a device registry entry into a ShellyDevice record (None if not a Shelly)"""
+        record = extract_shelly_device(device)
+        if record is None:
+            return None
+        
+        if record.ip:
+            device_log.debug("Found IP for %s: %s", record.name, record.ip)
+        else:
+            device_log.warning("⚠ Device %s (%s) has no configuration_url or IP", record.name, record.id)
+            device_log.debug("Registry entry of %s: %s", record.id, device)
+        
+        return record
+    
+    def test_connection(self):
+        """Test if we can connect to HA API (concurrent checks share one request)"""
+        return self._connection_check.do('api', self._test_connection)
+    
+    def _test_connection(self):
+        try:
+            response = self.session.get(
+                f'{self.ha_url}/api/',
+                headers=self.headers,
+                timeout=(3, 5)
+            )
             
             if response.status_code == 200:
                 data = response.json()
-                logger.info(f"✓ Connected to HA API")
-                logger.info(f"  - Message: {data.get('message')}")
+                logger.debug("✓ Connected to HA API: %s", data.get('message'))
                 return True
             else:
                 logger.error(f"❌ API connection failed: {response.status_code}")
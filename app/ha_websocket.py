@@ -1,143 +1,335 @@
 """
 Home Assistant WebSocket API client
 Used to fetch device registry and config entries
+
+Keeps one persistent, authenticated session. A background reader thread
+routes every response to its waiter by message id, so several commands can
+be in flight at once.
 """
 import json
 import logging
 import os
+import threading
+import time
 import websocket
 
+from metrics import WS_HANDSHAKE_DURATION, WS_COMMAND_DURATION
+from single_flight import SingleFlight
+
 logger = logging.getLogger(__name__)
 
 
+class _PendingCommand:
+    """A command waiting for its result message"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+        self.error = None
+
+
 class HAWebSocketClient:
     """Client to interact with Home Assistant via WebSocket"""
-    
+
     def __init__(self):
         self.supervisor_token = os.environ.get('SUPERVISOR_TOKEN', '')
-        self.ws_url = 'ws://supervisor/core/websocket'
+        self.ws_url = os.environ.get('HA_WS_URL', 'ws://supervisor/core/websocket')
         self.message_id = 0
-        
+
+        self.connect_timeout = 10
+        self.heartbeat_interval = 30
+        self.reconnect_min_delay = 1
+        self.reconnect_max_delay = 60
+
+        self._ws = None
+        self._connected = threading.Event()
+        self._stopping = threading.Event()
+        self._reader = None
+        self._start_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._last_received = 0
+        self._subscriptions = {}
+        self._connect_listeners = []
+        # Concurrent registry downloads share one command
+        self._list_flight = SingleFlight('ha_ws_list', reuse_seconds=1)
+
     def _get_next_id(self):
         """Get next message ID"""
-        self.message_id += 1
-        return self.message_id
-    
-    def _send_message(self, ws, message):
-        """Send a message and return the response"""
-        msg_json = json.dumps(message)
-        logger.debug(f"Sending: {msg_json}")
-        ws.send(msg_json)
-        
-        # Receive response
-        result = ws.recv()
-        logger.debug(f"Received: {result[:200]}...")
-        return json.loads(result)
-    
-    def get_device_registry(self):
-        """Get device registry from Home Assistant via WebSocket"""
-        logger.info("Connecting to HA WebSocket API for device registry...")
-        
-        try:
-            # Connect to WebSocket
-            ws = websocket.create_connection(self.ws_url, timeout=10)
-            
-            # Step 1: Receive auth_required
-            auth_required = json.loads(ws.recv())
-            if auth_required.get('type') != 'auth_required':
-                logger.error(f"Unexpected message: {auth_required}")
-                ws.close()
-                return []
-            
-            logger.debug("✓ Auth required received")
-            
-            # Step 2: Send authentication
-            auth_msg = {
-                'type': 'auth',
-                'access_token': self.supervisor_token
-            }
-            ws.send(json.dumps(auth_msg))
-            
-            # Step 3: Receive auth result
-            auth_result = json.loads(ws.recv())
-            if auth_result.get('type') != 'auth_ok':
-                logger.error(f"Authentication failed: {auth_result}")
+        with self._id_lock:
+            self.message_id += 1
+            return self.message_id
+
+    def start(self):
+        """Start the background session (no-op when already running)"""
+        with self._start_lock:
+            if self._reader and self._reader.is_alive():
+                return
+            self._stopping.clear()
+            self._reader = threading.Thread(
+                target=self._run,
+                name='ha-websocket',
+                daemon=True
+            )
+            self._reader.start()
+
+    def close(self):
+        """Stop the background session and fail all waiting commands"""
+        self._stopping.set()
+        ws = self._ws
+        if ws:
+            try:
                 ws.close()
-                return []
-            
-            logger.info("✓ WebSocket authenticated")
-            
-            # Step 4: Request device registry
-            device_request = {
-                'id': self._get_next_id(),
-                'type': 'config/device_registry/list'
-            }
-            response = self._send_message(ws, device_request)
-            
-            # Step 5: Parse response
+            except Exception:
+                pass
+
+    def subscribe_events(self, event_type, callback):
+        """
+        Call callback(event) for every HA event of this type.
+
+        Subscriptions survive reconnects. Callbacks run on the reader thread,
+        so they must not wait for other WebSocket commands.
+        """
+        first = event_type not in self._subscriptions
+        self._subscriptions.setdefault(event_type, []).append(callback)
+
+        if first and self._connected.is_set():
+            self._subscribe(event_type)
+        self.start()
+
+    def add_connect_listener(self, callback):
+        """Call callback() after every (re)connect, once subscriptions are restored"""
+        self._connect_listeners.append(callback)
+
+    def _subscribe(self, event_type):
+        """Send subscribe_events for one event type"""
+        try:
+            response = self.send_command('subscribe_events', event_type=event_type)
             if response.get('success'):
-                devices = response.get('result', [])
-                logger.info(f"✓ Got {len(devices)} devices from WebSocket")
-                ws.close()
-                return devices
+                logger.info(f"✓ Subscribed to {event_type} events")
             else:
-                logger.error(f"Failed to get device registry: {response}")
-                ws.close()
-                return []
-            
+                logger.error(f"Failed to subscribe to {event_type}: {response}")
         except Exception as e:
-            logger.error(f"WebSocket error getting device registry: {e}", exc_info=True)
-            return []
-    
-    def get_config_entries(self):
-        """Get config entries from Home Assistant via WebSocket"""
-        logger.info("Connecting to HA WebSocket API for config entries...")
-        
+            logger.error(f"WebSocket error subscribing to {event_type}: {e}")
+
+    def _on_connected(self):
+        """Restore subscriptions and notify listeners (runs off the reader thread)"""
+        for event_type in list(self._subscriptions):
+            self._subscribe(event_type)
+
+        for callback in list(self._connect_listeners):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Connect listener failed: {e}", exc_info=True)
+
+    def _connect(self):
+        """Open the WebSocket and run the auth handshake"""
+        logger.info("Connecting to HA WebSocket API...")
+        started = time.perf_counter()
+        ws = websocket.create_connection(self.ws_url, timeout=self.connect_timeout)
+
         try:
-            # Connect to WebSocket
-            ws = websocket.create_connection(self.ws_url, timeout=10)
-            
             # Step 1: Receive auth_required
             auth_required = json.loads(ws.recv())
             if auth_required.get('type') != 'auth_required':
-                logger.error(f"Unexpected message: {auth_required}")
-                ws.close()
-                return []
-            
+                raise ConnectionError(f"Unexpected message: {auth_required}")
+
+            logger.debug("✓ Auth required received")
+
             # Step 2: Send authentication
             auth_msg = {
                 'type': 'auth',
                 'access_token': self.supervisor_token
             }
             ws.send(json.dumps(auth_msg))
-            
+
             # Step 3: Receive auth result
             auth_result = json.loads(ws.recv())
             if auth_result.get('type') != 'auth_ok':
-                logger.error(f"Authentication failed: {auth_result}")
-                ws.close()
-                return []
-            
-            logger.info("✓ WebSocket authenticated")
-            
-            # Step 4: Request config entries
-            entries_request = {
-                'id': self._get_next_id(),
-                'type': 'config_entries/list'
-            }
-            response = self._send_message(ws, entries_request)
-            
-            # Step 5: Parse response
+                raise ConnectionError(f"Authentication failed: {auth_result}")
+        except Exception:
+            ws.close()
+            raise
+
+        WS_HANDSHAKE_DURATION.observe(time.perf_counter() - started)
+        logger.info("✓ WebSocket authenticated")
+
+        # Wake up periodically so the reader can send heartbeats
+        ws.settimeout(self.heartbeat_interval)
+        return ws
+
+    def _run(self):
+        """Reader thread: connect, route messages, reconnect with backoff"""
+        delay = self.reconnect_min_delay
+
+        while not self._stopping.is_set():
+            try:
+                self._ws = self._connect()
+            except Exception as e:
+                logger.error(f"WebSocket connection failed: {e} - retrying in {delay}s")
+                self._stopping.wait(delay)
+                delay = min(delay * 2, self.reconnect_max_delay)
+                continue
+
+            delay = self.reconnect_min_delay
+            self._last_received = time.monotonic()
+            self._connected.set()
+            threading.Thread(target=self._on_connected, name='ha-websocket-connected', daemon=True).start()
+
+            try:
+                self._read_loop(self._ws)
+            except Exception as e:
+                if not self._stopping.is_set():
+                    logger.warning(f"WebSocket session lost: {e}")
+            finally:
+                self._connected.clear()
+                try:
+                    self._ws.close()
+                except Exception:
+                    pass
+                self._ws = None
+                self._fail_pending(ConnectionError('WebSocket connection lost'))
+
+            if not self._stopping.is_set():
+                self._stopping.wait(delay)
+
+    def _read_loop(self, ws):
+        """Receive messages until the connection drops"""
+        while not self._stopping.is_set():
+            try:
+                raw = ws.recv()
+            except websocket.WebSocketTimeoutException:
+                self._heartbeat(ws)
+                continue
+
+            if not raw:
+                raise ConnectionError('WebSocket closed by Home Assistant')
+
+            self._last_received = time.monotonic()
+            self._dispatch(json.loads(raw))
+
+    def _heartbeat(self, ws):
+        """Send a ping, or give up on the session when pings go unanswered"""
+        silence = time.monotonic() - self._last_received
+        if silence > 2 * self.heartbeat_interval:
+            raise ConnectionError(f"No answer to heartbeat for {silence:.0f}s")
+
+        # The pong is routed by id like any other reply; nobody waits for it,
+        # receiving it is enough to refresh _last_received
+        with self._send_lock:
+            ws.send(json.dumps({'id': self._get_next_id(), 'type': 'ping'}))
+
+    def _dispatch(self, message):
+        """Route a received message to the command or subscription waiting for it"""
+        if message.get('type') == 'event':
+            event = message.get('event', {})
+            for callback in self._subscriptions.get(event.get('event_type'), []):
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f"Event callback failed: {e}", exc_info=True)
+            return
+
+        msg_id = message.get('id')
+
+        with self._pending_lock:
+            pending = self._pending.pop(msg_id, None)
+
+        if pending:
+            pending.response = message
+            pending.event.set()
+        elif message.get('type') != 'pong':
+            logger.debug("Unrouted WebSocket message: %.200s", message)
+
+    def _fail_pending(self, error):
+        """Wake all waiters with an error (connection lost or closing)"""
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+
+        for command in pending:
+            command.error = error
+            command.event.set()
+
+    def send_command(self, command_type, timeout=30, **payload):
+        """Send a command over the shared session and wait for its result"""
+        self.start()
+
+        if not self._connected.wait(timeout):
+            raise TimeoutError('WebSocket session not connected')
+
+        pending = _PendingCommand()
+        msg_id = None
+        started = time.perf_counter()
+        outcome = 'error'
+
+        try:
+            ws = self._ws
+            if ws is None:
+                raise ConnectionError('WebSocket connection lost')
+
+            # HA rejects ids that do not increase, so allocate and send atomically
+            with self._send_lock:
+                msg_id = self._get_next_id()
+                with self._pending_lock:
+                    self._pending[msg_id] = pending
+                ws.send(json.dumps({'id': msg_id, 'type': command_type, **payload}))
+            logger.debug("Sent %s (id %d)", command_type, msg_id)
+
+            if not pending.event.wait(timeout):
+                outcome = 'timeout'
+                raise TimeoutError(f"No response to {command_type} within {timeout}s")
+            if not pending.error:
+                outcome = 'ok' if (pending.response or {}).get('success', True) else 'failed'
+        finally:
+            with self._pending_lock:
+                self._pending.pop(msg_id, None)
+            WS_COMMAND_DURATION.observe(time.perf_counter() - started,
+                                        command=command_type, outcome=outcome)
+
+        if pending.error:
+            raise pending.error
+        return pending.response
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def request(self, command_type, timeout=30, **payload):
+        """Send a command and return its result; raises on failure instead of logging it"""
+        response = self.send_command(command_type, timeout=timeout, **payload)
+        if not response.get('success'):
+            error = response.get('error') or {}
+            raise RuntimeError(f"{command_type} failed: {error.get('message') or error.get('code') or 'unknown error'}")
+        return response.get('result')
+
+    def _list_command(self, command_type, label):
+        """Run a list command and return its result, or None on failure (shared by concurrent callers)"""
+        return self._list_flight.do(command_type, self._run_list_command, command_type, label)
+
+    def _run_list_command(self, command_type, label):
+        try:
+            response = self.send_command(command_type)
+
             if response.get('success'):
-                entries = response.get('result', [])
-                logger.info(f"✓ Got {len(entries)} config entries from WebSocket")
-                ws.close()
-                return entries
+                items = response.get('result', [])
+                logger.debug("✓ Got %d %s from WebSocket", len(items), label)
+                return items
             else:
-                logger.error(f"Failed to get config entries: {response}")
-                ws.close()
-                return []
-            
+                logger.error(f"Failed to get {label}: {response}")
+                return None
+
         except Exception as e:
-            logger.error(f"WebSocket error getting config entries: {e}", exc_info=True)
-            return []
+            logger.error(f"WebSocket error getting {label}: {e}", exc_info=True)
+            return None
+
+    def get_device_registry(self):
+        """Get device registry from Home Assistant via WebSocket (None on failure)"""
+        return self._list_command('config/device_registry/list', 'devices')
+
+    def get_config_entries(self):
+        """Get config entries from Home Assistant via WebSocket (None on failure)"""
+        return self._list_command('config_entries/list', 'config entries')
@@ -0,0 +1,129 @@
+"""
+Shared HTTP connection pools
+Keep-alive sessions for Shelly device and Supervisor traffic
+"""
+import logging
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import REGISTRY, AUTH_FAILURES
+
+logger = logging.getLogger(__name__)
+
+# (connect, read) timeouts in seconds
+DEVICE_TIMEOUT = (
+    float(os.environ.get('DEVICE_CONNECT_TIMEOUT', 1.5)),
+    float(os.environ.get('DEVICE_READ_TIMEOUT', 3))
+)
+SUPERVISOR_TIMEOUT = (3, 10)
+
+# Shelly devices only handle a couple of parallel connections
+DEVICE_POOL_SIZE = int(os.environ.get('DEVICE_POOL_SIZE', 2))
+
+
+class PooledSession(requests.Session):
+    """requests.Session with per-host pool limits, keep-alive and default timeouts"""
+
+    def __init__(self, name, max_hosts, per_host, timeout, response_hooks=()):
+        super().__init__()
+        self.name = name
+        self.timeout = timeout
+        self.hooks['response'].extend(response_hooks)
+
+        # No automatic retries: a dead device should fail fast, not three times
+        self.adapter = HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=per_host,
+            max_retries=0
+        )
+        self.mount('http://', self.adapter)
+        self.mount('https://', self.adapter)
+
+        # Counters survive pools that get evicted from the pool manager
+        self._retired_connections = 0
+        self._retired_requests = 0
+        self.adapter.poolmanager.pools.dispose_func = self._retire_pool
+
+    def _retire_pool(self, pool):
+        self._retired_connections += pool.num_connections
+        self._retired_requests += pool.num_requests
+        pool.close()
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(method, url, **kwargs)
+
+    def stats(self):
+        """Connection reuse counters: a miss opened a new TCP connection, a hit reused one"""
+        pools = self.adapter.poolmanager.pools
+        connections = self._retired_connections
+        requests_made = self._retired_requests
+
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_made += pool.num_requests
+
+        return {
+            'hosts': len(pools),
+            'requests': requests_made,
+            'pool_misses': connections,
+            'pool_hits': max(requests_made - connections, 0)
+        }
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(name, **kwargs):
+    with _sessions_lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = PooledSession(name, **kwargs)
+            _sessions[name] = session
+            logger.info(f"HTTP pool '{name}' ready: {kwargs['max_hosts']} hosts, "
+                        f"{kwargs['per_host']} connections per host, timeout {kwargs['timeout']}")
+        return session
+
+
+def _count_auth_failure(response, *args, **kwargs):
+    if response.status_code == 401:
+        AUTH_FAILURES.inc()
+
+
+def get_device_session():
+    """Session for Shelly devices: many hosts, few connections per host"""
+    return _get_session('devices', max_hosts=1024, per_host=DEVICE_POOL_SIZE, timeout=DEVICE_TIMEOUT,
+                        response_hooks=(_count_auth_failure,))
+
+
+def get_supervisor_session():
+    """Session for the Supervisor / HA Core API: one host, more connections"""
+    return _get_session('supervisor', max_hosts=4, per_host=10, timeout=SUPERVISOR_TIMEOUT)
+
+
+def pool_stats():
+    """Reuse counters for every pool created so far"""
+    with _sessions_lock:
+        return {name: session.stats() for name, session in _sessions.items()}
+
+
+def _pool_metrics():
+    """Render pool counters for /metrics"""
+    stats = pool_stats()
+    for metric, key, help_text in (
+        ('http_pool_requests_total', 'requests', 'Requests sent through the pool (add-on probes and reads, not client library actions)'),
+        ('http_pool_hits_total', 'pool_hits', 'Requests that reused a kept-alive connection'),
+        ('http_pool_misses_total', 'pool_misses', 'Requests that opened a new connection'),
+    ):
+        yield f'# HELP {metric} {help_text}'
+        yield f'# TYPE {metric} counter'
+        for name, values in sorted(stats.items()):
+            yield f'{metric}{{pool="{name}"}} {values[key]}'
+
+
+REGISTRY.add_collector(_pool_metrics)
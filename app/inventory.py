@@ -0,0 +1,143 @@
+"""
+In-memory Shelly inventory
+Built once from the device registry, then kept current from
+device_registry_updated events
+"""
+import logging
+import threading
+
+from device_records import DeviceIndex
+
+logger = logging.getLogger(__name__)
+
+
+class ShellyInventory:
+    """Shelly subset of the HA device registry, updated incrementally"""
+
+    def __init__(self, ha_client):
+        self.ha_client = ha_client
+        self.ws_client = ha_client.ws_client
+
+        self._devices = DeviceIndex()  # ShellyDevice records by id, MAC and IP
+        self.revision = 0         # bumped whenever the device set changes
+        self._dirty = set()       # device ids created/updated since last sync
+        self._needs_resync = True
+        self._started = False
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+
+    def start(self):
+        """Subscribe to registry updates (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        self.ws_client.subscribe_events('device_registry_updated', self._on_registry_event)
+        self.ws_client.add_connect_listener(self._on_reconnect)
+
+    def _on_reconnect(self):
+        """Events may have been missed while disconnected - resync on next use"""
+        logger.info("WebSocket (re)connected - Shelly inventory will be resynced")
+        with self._lock:
+            self._needs_resync = True
+
+    def _on_registry_event(self, event):
+        """Record a device_registry_updated event (runs on the WebSocket reader thread)"""
+        data = event.get('data', {})
+        action = data.get('action')
+        device_id = data.get('device_id')
+        if not device_id:
+            return
+
+        logger.debug("Device registry %s: %s", action, device_id)
+
+        with self._lock:
+            if action == 'remove':
+                self._devices.remove(device_id)
+                self._dirty.discard(device_id)
+                self.revision += 1
+            else:
+                self._dirty.add(device_id)
+
+    def get_devices(self):
+        """Return all Shelly devices as fresh dicts, syncing pending changes first"""
+        self.sync()
+
+        with self._lock:
+            return [device.to_dict() for device in self._devices]
+
+    def records(self):
+        """(revision, ShellyDevice records) after syncing pending changes"""
+        self.sync()
+
+        with self._lock:
+            return self.revision, list(self._devices)
+
+    def find_by_ip(self, ip):
+        """The Shelly device HA has at this IP (as a dict), or None"""
+        self.sync()
+
+        with self._lock:
+            device = self._devices.get_by_ip(ip)
+            return device.to_dict() if device else None
+
+    def sync(self):
+        """Apply pending registry changes (cheap when nothing changed)"""
+        self.start()
+
+        with self._sync_lock:
+            with self._lock:
+                needs_resync = self._needs_resync
+                changed = set(self._dirty)
+
+            if needs_resync:
+                self.resync()
+            elif changed:
+                self._apply_changes(changed)
+
+    def resync(self):
+        """Rebuild the inventory from a full device registry pull"""
+        with self._lock:
+            # Events arriving during the pull stay dirty and are applied next time
+            self._needs_resync = False
+            self._dirty.clear()
+
+        devices = self.ha_client.fetch_shelly_devices()
+        if devices is None:
+            # Failed pull; keep what we have and try again next time
+            with self._lock:
+                self._needs_resync = True
+            if self._devices:
+                logger.warning("Registry resync failed - keeping previous inventory")
+            return
+
+        with self._lock:
+            self._devices.replace(devices)
+            self.revision += 1
+
+        logger.info(f"✓ Shelly inventory resynced: {len(devices)} devices")
+
+    def _apply_changes(self, device_ids):
+        """Refresh only the registry entries that changed"""
+        with self._lock:
+            self._dirty -= device_ids
+
+        entries = self.ha_client.fetch_devices_by_id(device_ids)
+        if entries is None:
+            logger.warning("Incremental device lookup failed - falling back to full resync")
+            self.resync()
+            return
+
+        with self._lock:
+            for entry in entries:
+                device_id = entry.get('id')
+                record = self.ha_client.parse_device(entry)
+                if record:
+                    self._devices.add(record)
+                else:
+                    # Removed, or no longer a Shelly device
+                    self._devices.remove(device_id)
+            self.revision += 1
+
+        logger.info(f"✓ Shelly inventory updated: {len(device_ids)} changed devices")
@@ -0,0 +1,66 @@
+"""
+Logging setup
+Log level from the add-on options and sampling for per-device log lines
+"""
+import itertools
+import logging
+import os
+
+# Home Assistant add-on log levels -> Python levels
+LOG_LEVELS = {
+    'trace': logging.DEBUG,
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'notice': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'fatal': logging.CRITICAL,
+}
+
+# Chatty third-party loggers that stay at WARNING unless we are tracing
+NOISY_LOGGERS = ('urllib3', 'websocket', 'waitress', 'werkzeug')
+
+
+def configure_logging(level=None):
+    """Configure the root logger from LOG_LEVEL (default: info)"""
+    name = (level or os.environ.get('LOG_LEVEL') or 'info').lower()
+    python_level = LOG_LEVELS.get(name, logging.INFO)
+
+    logging.basicConfig(
+        level=python_level,
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    logging.getLogger().setLevel(python_level)
+
+    for noisy in NOISY_LOGGERS:
+        logging.getLogger(noisy).setLevel(logging.DEBUG if name == 'trace' else max(python_level, logging.WARNING))
+
+    return python_level
+
+
+class LogSampler:
+    """
+    Lets through one in every `every` per-device log lines.
+
+    Keeps per-device chatter bounded on large registries; summaries are
+    logged separately. LOG_SAMPLE_EVERY=1 logs every device.
+    """
+
+    def __init__(self, logger, every=None):
+        self.logger = logger
+        self.every = max(1, every or int(os.environ.get('LOG_SAMPLE_EVERY', 50)))
+        self._counter = itertools.count()
+
+    def log(self, level, msg, *args):
+        """Log lazily, only if the level is enabled and this line is sampled"""
+        if not self.logger.isEnabledFor(level):
+            return
+        if next(self._counter) % self.every:
+            return
+        self.logger.log(level, msg, *args)
+
+    def debug(self, msg, *args):
+        self.log(logging.DEBUG, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
@@ -0,0 +1,205 @@
+"""
+Prometheus-style metrics
+Minimal counters and histograms, rendered in the text exposition format
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + list(extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}   # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, entry):
+                    yield f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", bound)])} {count}'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {entry[-1]}'
+                yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {entry[-2]}'
+                yield f'{self.name}_count{_format_labels(self.labelnames, key)} {entry[-1]}'
+
+
+class MetricsRegistry:
+    """Holds all metrics and renders them for /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help_text, labelnames=()):
+        metric = Counter(name, help_text, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a callable that yields ready-made exposition lines at render time"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# Device probes
+PROBE_DURATION = REGISTRY.histogram(
+    'shelly_probe_duration_seconds',
+    "Duration of the add-on's own requests to Shelly devices (not client library actions)",
+    ('probe', 'generation', 'outcome')
+)
+PROBE_TIMEOUTS = REGISTRY.counter(
+    'shelly_probe_timeouts_total',
+    'Add-on device requests that timed out',
+    ('probe',)
+)
+AUTH_FAILURES = REGISTRY.counter(
+    'shelly_auth_failures_total',
+    'HTTP 401 responses to add-on device requests (not client library actions)'
+)
+
+# Scans
+SCAN_ENRICHMENT_DURATION = REGISTRY.histogram(
+    'shelly_scan_enrichment_duration_seconds',
+    'Time to enrich all devices of one scan',
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+SCAN_DEVICE_RESULTS = REGISTRY.counter(
+    'shelly_scan_device_results_total',
+    'Per-device enrichment results during scans',
+    ('result',)
+)
+REGISTRY_FILTER_DURATION = REGISTRY.histogram(
+    'shelly_registry_filter_duration_seconds',
+    'Time to extract Shelly devices from the HA device registry',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+
+# Home Assistant WebSocket
+WS_HANDSHAKE_DURATION = REGISTRY.histogram(
+    'ha_websocket_handshake_duration_seconds',
+    'Time to connect and authenticate the HA WebSocket'
+)
+WS_COMMAND_DURATION = REGISTRY.histogram(
+    'ha_websocket_command_duration_seconds',
+    'Round-trip time of HA WebSocket commands (e.g. registry fetches)',
+    ('command', 'outcome')
+)
+
+# Caches
+CACHE_LOOKUPS = REGISTRY.counter(
+    'shelly_cache_lookups_total',
+    'Cache lookups by cache and result',
+    ('cache', 'result')
+)
+
+# Passive discovery
+PRESENCE_ANNOUNCEMENTS = REGISTRY.counter(
+    'shelly_presence_announcements_total',
+    'Shelly multicast announcements heard, by source (mdns, coiot)',
+    ('source',)
+)
+
+# Request coalescing
+SINGLE_FLIGHT_CALLS = REGISTRY.counter(
+    'shelly_single_flight_calls_total',
+    'Coalesced operations: executed, shared with an in-flight call, or reused from a recent one',
+    ('operation', 'result')
+)
+
+# Device authentication
+DEVICE_AUTH_CHALLENGES = REGISTRY.counter(
+    'shelly_device_auth_challenges_total',
+    'Digest challenges answered: new device, expired or stale nonce, or rejected credentials',
+    ('reason',)
+)
+
+# Firmware update checks
+UPDATE_CHECKS = REGISTRY.counter(
+    'shelly_update_checks_total',
+    'Update availability lookups: answered from the cache, checked on a device, or failed',
+    ('result',)
+)
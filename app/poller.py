@@ -0,0 +1,174 @@
+"""
+Background status poller
+Refreshes device info/status/settings on a fixed interval and keeps
+the latest snapshot per device, so API requests don't hit the device
+"""
+import heapq
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from log_config import LogSampler
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Offline devices fail on every round; log a sample, not all of them
+failure_log = LogSampler(logger)
+
+
+class StatusPoller:
+    """Polls each device once per interval, spread out with jitter"""
+
+    def __init__(self, fetch_func, interval=None, jitter=0.2, max_workers=4):
+        self.fetch_func = fetch_func
+        self.interval = interval if interval is not None else float(os.environ.get('POLL_INTERVAL', 60))
+        self.jitter = jitter
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='poller')
+
+        self._refresh_flight = SingleFlight('device_refresh')
+        self._snapshots = {}   # ip -> {'data', 'updated', 'age_base'}
+        self._targets = set()
+        self._schedule = []    # heap of (due, ip)
+        self._due = {}         # ip -> current due time (older heap entries are stale)
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        logger.info(f"Status poller initialized. Interval: {self.interval}s")
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def start(self):
+        """Start the scheduler thread (no-op when disabled or running)"""
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name='status-poller', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop scheduling polls and drop queued ones"""
+        self._stopping.set()
+        self._wakeup.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def set_targets(self, ips):
+        """Poll exactly these IPs; new ones are spread randomly over one interval"""
+        ips = {ip for ip in ips if ip}
+        now = time.monotonic()
+
+        with self._lock:
+            for ip in ips - self._targets:
+                self._schedule_at(ip, now + random.uniform(0, self.interval))
+            for ip in self._targets - ips:
+                self._snapshots.pop(ip, None)
+                self._due.pop(ip, None)
+            self._targets = ips
+
+        self.start()
+        self._wakeup.set()
+
+    def add_target(self, ip):
+        """Start polling one more IP"""
+        with self._lock:
+            if ip in self._targets:
+                return
+            self._targets.add(ip)
+            self._schedule_at(ip, time.monotonic() + self._next_delay())
+
+        self.start()
+        self._wakeup.set()
+
+    def get(self, ip):
+        """Latest snapshot for an IP (with its age), or None"""
+        with self._lock:
+            snapshot = self._snapshots.get(ip)
+            if not snapshot:
+                return None
+            return {
+                'data': snapshot['data'],
+                'updated': snapshot['updated'],
+                'age': round(time.monotonic() - snapshot['age_base'], 1)
+            }
+
+    def refresh(self, ip):
+        """Fetch an IP right now (blocking) and store the result; concurrent refreshes share one fetch"""
+        data = self._refresh_flight.do(ip, self.fetch_func, ip)
+        self._store(ip, data)
+        return data
+
+    def push_status(self, ip, status):
+        """Replace the status of an existing snapshot with one pushed by the device"""
+        with self._lock:
+            snapshot = self._snapshots.get(ip)
+            if not snapshot:
+                return
+            self._snapshots[ip] = {
+                'data': {**snapshot['data'], 'status': status},
+                'updated': time.time(),
+                'age_base': time.monotonic()
+            }
+
+    def _store(self, ip, data):
+        if data is None:
+            return
+        with self._lock:
+            if ip in self._targets:
+                self._snapshots[ip] = {'data': data, 'updated': time.time(), 'age_base': time.monotonic()}
+
+    def _schedule_at(self, ip, due):
+        """Schedule the next poll of an IP (caller holds the lock)"""
+        self._due[ip] = due
+        heapq.heappush(self._schedule, (due, ip))
+
+    def _next_delay(self):
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _run(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                due, ip = self._schedule[0] if self._schedule else (None, None)
+
+            if due is None:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            delay = due - time.monotonic()
+            if delay > 0:
+                # Woken early when targets change; re-check the schedule
+                self._wakeup.wait(delay)
+                self._wakeup.clear()
+                continue
+
+            with self._lock:
+                if not self._schedule or self._schedule[0] != (due, ip):
+                    continue
+                heapq.heappop(self._schedule)
+                if self._due.get(ip) != due:
+                    continue
+                self._schedule_at(ip, time.monotonic() + self._next_delay())
+                if ip in self._in_flight:
+                    # Previous poll still running (slow device) - skip this round
+                    continue
+                self._in_flight.add(ip)
+
+            if self._stopping.is_set():
+                break
+            self.executor.submit(self._poll, ip)
+
+    def _poll(self, ip):
+        try:
+            self._store(ip, self.fetch_func(ip))
+        except Exception as e:
+            failure_log.warning("Polling %s failed: %s", ip, e)
+        finally:
+            with self._lock:
+                self._in_flight.discard(ip)
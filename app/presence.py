@@ -0,0 +1,371 @@
+"""
+Passive presence listener
+Listens for Shelly multicast announcements - mDNS (_shelly._tcp, Gen2+)
+and CoIoT status (Gen1) - and keeps each device's IP, generation and
+last-heard time without sending a single probe
+"""
+import logging
+import os
+import re
+import selectors
+import socket
+import struct
+import threading
+import time
+
+from device_records import normalize_mac
+from log_config import LogSampler
+from metrics import PRESENCE_ANNOUNCEMENTS
+
+logger = logging.getLogger(__name__)
+
+# Announcements arrive continuously; log a sample
+announce_log = LogSampler(logger)
+
+MDNS_GROUP = '224.0.0.251'
+MDNS_PORT = 5353
+COIOT_GROUP = '224.0.1.187'
+COIOT_PORT = 5683
+
+SHELLY_SERVICE = '_shelly._tcp.local'
+
+# DNS record types
+TYPE_A = 1
+TYPE_PTR = 12
+TYPE_TXT = 16
+TYPE_SRV = 33
+
+# CoIoT (CoAP) option carrying "<type>#<mac>#<coiot version>"
+COIOT_OPTION_GLOBAL_DEVID = 3332
+# CoAP codes used by CoIoT: non-standard 0.30 status multicast, 2.05 content
+COIOT_CODES = (30, 69)
+
+MAC_SUFFIX = re.compile(r'([0-9A-Fa-f]{12})$')
+
+
+def _read_name(packet, offset, depth=0):
+    """Decode a (possibly compressed) DNS name; returns (name, offset after it)"""
+    labels = []
+    end = None
+    while True:
+        if offset >= len(packet) or depth > 16:
+            raise ValueError('truncated DNS name')
+        length = packet[offset]
+        if length == 0:
+            offset += 1
+            break
+        if length & 0xC0 == 0xC0:
+            pointer = struct.unpack_from('>H', packet, offset)[0] & 0x3FFF
+            if end is None:
+                end = offset + 2
+            offset = pointer
+            depth += 1
+            continue
+        offset += 1
+        labels.append(packet[offset:offset + length].decode('utf-8', 'replace'))
+        offset += length
+    return '.'.join(labels), end if end is not None else offset
+
+
+def _parse_txt(rdata):
+    """TXT strings as a dict (key=value entries only)"""
+    values = {}
+    offset = 0
+    while offset < len(rdata):
+        length = rdata[offset]
+        entry = rdata[offset + 1:offset + 1 + length].decode('utf-8', 'replace')
+        offset += 1 + length
+        if '=' in entry:
+            key, value = entry.split('=', 1)
+            values[key.lower()] = value
+    return values
+
+
+def parse_mdns(packet, source_ip):
+    """
+    Shelly announcements in one mDNS packet.
+
+    Returns a list of dicts with mac, ip, generation, gen, type, fw, name and
+    online (False for a goodbye, i.e. TTL 0). `generation` is the API family
+    (always 2: Gen3/Gen4 speak the Gen2 RPC API), `gen` the announced one.
+    The IP comes from the A record of the service's host, falling back to
+    the sender address.
+    """
+    if len(packet) < 12:
+        return []
+    flags, qdcount, ancount, nscount, arcount = struct.unpack_from('>HHHHH', packet, 2)
+    if not flags & 0x8000:
+        return []  # a query, not a response
+
+    offset = 12
+    for _ in range(qdcount):
+        _, offset = _read_name(packet, offset)
+        offset += 4
+
+    instances = {}   # instance name -> {'ttl', 'host', 'txt'}
+    addresses = {}   # host name -> ip
+    for _ in range(ancount + nscount + arcount):
+        name, offset = _read_name(packet, offset)
+        rtype, _, ttl, rdlength = struct.unpack_from('>HHIH', packet, offset)
+        offset += 10
+        rdata_offset = offset
+        offset += rdlength
+        if offset > len(packet):
+            raise ValueError('truncated DNS record')
+
+        lower = name.lower()
+        if rtype == TYPE_PTR and lower == SHELLY_SERVICE:
+            instance, _ = _read_name(packet, rdata_offset)
+            instances.setdefault(instance, {})['ttl'] = ttl
+        elif rtype == TYPE_SRV and lower.endswith('.' + SHELLY_SERVICE):
+            host, _ = _read_name(packet, rdata_offset + 6)
+            record = instances.setdefault(name, {})
+            record['host'] = host.lower()
+            record.setdefault('ttl', ttl)
+        elif rtype == TYPE_TXT and lower.endswith('.' + SHELLY_SERVICE):
+            instances.setdefault(name, {})['txt'] = _parse_txt(packet[rdata_offset:offset])
+        elif rtype == TYPE_A and rdlength == 4:
+            addresses[lower] = socket.inet_ntoa(packet[rdata_offset:offset])
+
+    announcements = []
+    for instance, record in instances.items():
+        label = instance[:-len(SHELLY_SERVICE) - 1]
+        mac_match = MAC_SUFFIX.search(label)
+        if not mac_match:
+            continue
+        txt = record.get('txt', {})
+        host = record.get('host') or f'{label.lower()}.local'
+        try:
+            gen = int(txt.get('gen', 2))
+        except ValueError:
+            gen = 2
+        announcements.append({
+            'mac': normalize_mac(mac_match.group(1)),
+            'ip': addresses.get(host, source_ip),
+            'generation': 2,
+            'gen': gen,
+            'type': txt.get('app'),
+            'fw': txt.get('ver'),
+            'name': label,
+            'online': record.get('ttl', 1) > 0,
+            'source': 'mdns'
+        })
+    return announcements
+
+
+def parse_coiot(packet, source_ip):
+    """
+    A Gen1 CoIoT announcement, or None.
+
+    The device id option holds "<type>#<mac>#<version>"; the IP is the
+    sender address (CoIoT packets carry no address of their own).
+    """
+    if len(packet) < 4 or packet[0] >> 6 != 1 or packet[1] not in COIOT_CODES:
+        return None
+
+    offset = 4 + (packet[0] & 0x0F)  # skip header and token
+    option = 0
+    while offset < len(packet) and packet[offset] != 0xFF:
+        delta, length = packet[offset] >> 4, packet[offset] & 0x0F
+        offset += 1
+        values = []
+        for nibble in (delta, length):
+            if nibble == 13:
+                values.append(packet[offset] + 13)
+                offset += 1
+            elif nibble == 14:
+                values.append(struct.unpack_from('>H', packet, offset)[0] + 269)
+                offset += 2
+            elif nibble == 15:
+                return None
+            else:
+                values.append(nibble)
+        option += values[0]
+        value = packet[offset:offset + values[1]]
+        offset += values[1]
+
+        if option == COIOT_OPTION_GLOBAL_DEVID:
+            parts = value.decode('utf-8', 'replace').split('#')
+            if len(parts) < 2 or not MAC_SUFFIX.search(parts[1]):
+                return None
+            return {
+                'mac': normalize_mac(parts[1]),
+                'ip': source_ip,
+                'generation': 1,
+                'gen': 1,
+                'type': parts[0],
+                'fw': None,
+                'name': None,
+                'online': True,
+                'source': 'coiot'
+            }
+    return None
+
+
+def _multicast_socket(group, port, interface='0.0.0.0'):
+    """UDP socket joined to a multicast group (shared with other listeners on the port)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', port))
+        membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton(interface))
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+class PresenceListener:
+    """
+    Background listener for Shelly announcements.
+
+    `on_presence(record, old_ip)` is called (on the listener thread) for each
+    announcement; old_ip is set when the device was last heard at another IP.
+    """
+
+    def __init__(self, on_presence=None, fresh_seconds=None, reprobe_seconds=None,
+                 mdns_port=MDNS_PORT, coiot_port=COIOT_PORT):
+        self.on_presence = on_presence
+        self.fresh_seconds = fresh_seconds or float(os.environ.get('PRESENCE_FRESH_SECONDS', 300))
+        self.reprobe_seconds = reprobe_seconds or float(os.environ.get('PRESENCE_REPROBE_SECONDS', 900))
+        self.ports = {'mdns': mdns_port, 'coiot': coiot_port}
+
+        self._by_mac = {}      # mac -> presence record
+        self._by_ip = {}       # ip -> mac
+        self._probed = {}      # ip -> monotonic time of the last full probe
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Join the multicast groups and start listening (no-op if running)"""
+        if self._thread and self._thread.is_alive():
+            return
+
+        selector = selectors.DefaultSelector()
+        groups = {'mdns': (MDNS_GROUP, parse_mdns), 'coiot': (COIOT_GROUP, parse_coiot)}
+        for source, (group, parser) in groups.items():
+            try:
+                sock = _multicast_socket(group, self.ports[source])
+            except OSError as e:
+                logger.warning(f"Passive discovery: cannot listen for {source} on port {self.ports[source]}: {e}")
+                continue
+            selector.register(sock, selectors.EVENT_READ, parser)
+
+        if not selector.get_map():
+            selector.close()
+            return
+
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(selector,), name='presence', daemon=True)
+        self._thread.start()
+        logger.info(f"Passive discovery listening for {', '.join(sorted(self.ports))} announcements")
+
+    def stop(self):
+        self._stopping.set()
+
+    def _run(self, selector):
+        try:
+            while not self._stopping.is_set():
+                for key, _ in selector.select(timeout=1):
+                    try:
+                        packet, (source_ip, _) = key.fileobj.recvfrom(9000)
+                        result = key.data(packet, source_ip)
+                    except (OSError, ValueError, IndexError, struct.error) as e:
+                        logger.debug("Ignoring malformed announcement: %s", e)
+                        continue
+                    if isinstance(result, dict):
+                        result = [result]  # CoIoT: one device per packet
+                    for record in result or ():
+                        self._record(record)
+        finally:
+            for key in list(selector.get_map().values()):
+                key.fileobj.close()
+            selector.close()
+
+    def _record(self, record):
+        if not record['mac']:
+            return
+        PRESENCE_ANNOUNCEMENTS.inc(source=record['source'])
+        record['heard'] = time.monotonic()
+        record['last_seen'] = time.time()
+
+        with self._lock:
+            previous = self._by_mac.get(record['mac'])
+            old_ip = previous['ip'] if previous and previous['ip'] != record['ip'] else None
+            if old_ip:
+                if self._by_ip.get(old_ip) == record['mac']:
+                    del self._by_ip[old_ip]
+                self._probed.pop(old_ip, None)
+            if previous:
+                # mDNS knows the firmware, CoIoT doesn't - keep what we learned
+                record['fw'] = record['fw'] or previous.get('fw')
+                record['type'] = record['type'] or previous.get('type')
+            self._by_mac[record['mac']] = record
+            self._by_ip[record['ip']] = record['mac']
+
+        if old_ip:
+            logger.info(f"Device {record['mac']} announced itself at {record['ip']} (was {old_ip})")
+        else:
+            announce_log.debug("Heard %s at %s via %s", record['mac'], record['ip'], record['source'])
+
+        if self.on_presence:
+            try:
+                self.on_presence(dict(record), old_ip)
+            except Exception as e:
+                logger.error(f"Presence callback failed for {record['mac']}: {e}", exc_info=True)
+
+    def _fresh(self, record, now):
+        return record['online'] and now - record['heard'] <= self.fresh_seconds
+
+    def get_by_mac(self, mac):
+        """Latest announcement for a MAC if heard recently and online, else None"""
+        with self._lock:
+            record = self._by_mac.get(normalize_mac(mac))
+            return dict(record) if record and self._fresh(record, time.monotonic()) else None
+
+    def mark_probed(self, ip):
+        """A full probe of this IP just succeeded"""
+        with self._lock:
+            self._probed[ip] = time.monotonic()
+
+    def mark_changed(self, ip):
+        """We changed the device (firmware, auth, reboot): probe it on the next scan"""
+        with self._lock:
+            self._probed.pop(ip, None)
+
+    def can_skip_probe(self, ip):
+        """
+        True when the device at this IP announced itself recently and was fully
+        probed within `reprobe_seconds`, so a scan may reuse its last result.
+        """
+        now = time.monotonic()
+        with self._lock:
+            mac = self._by_ip.get(ip)
+            record = self._by_mac.get(mac) if mac else None
+            probed = self._probed.get(ip)
+            return (record is not None and self._fresh(record, now)
+                    and probed is not None and now - probed <= self.reprobe_seconds)
+
+    def to_dict(self):
+        """All announced devices for the API, keyed by MAC"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                mac: {
+                    'ip': record['ip'],
+                    'generation': record['generation'],
+                    'gen': record.get('gen'),
+                    'type': record['type'],
+                    'fw': record['fw'],
+                    'source': record['source'],
+                    'online': record['online'],
+                    'last_seen': record['last_seen'],
+                    'fresh': self._fresh(record, now)
+                }
+                for mac, record in self._by_mac.items()
+            }
@@ -0,0 +1,190 @@
+"""
+Fleet-wide firmware rollout
+Updates many devices in waves (canary first) in a background job
+"""
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENCY = 16
+MAX_JOBS_KEPT = 20
+
+
+class RolloutJob:
+    """State of one batch firmware update"""
+
+    def __init__(self, ips, concurrency, canary_size, wave_size, poll_timeout, stop_on_failure):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = 'queued'
+        self.created = time.time()
+        self.finished = None
+        self.concurrency = concurrency
+        self.canary_size = canary_size
+        self.wave_size = wave_size
+        self.poll_timeout = poll_timeout
+        self.stop_on_failure = stop_on_failure
+        self.devices = [
+            {'ip': ip, 'status': 'queued', 'wave': None, 'old_fw': None, 'new_fw': None, 'error': None}
+            for ip in ips
+        ]
+        self.lock = threading.Lock()
+
+    def waves(self):
+        """Split devices into a canary wave followed by fixed-size waves"""
+        waves = []
+        rest = self.devices
+        if self.canary_size:
+            waves.append(rest[:self.canary_size])
+            rest = rest[self.canary_size:]
+        for start in range(0, len(rest), self.wave_size):
+            waves.append(rest[start:start + self.wave_size])
+        return [wave for wave in waves if wave]
+
+    def set_device(self, device, **fields):
+        with self.lock:
+            device.update(fields)
+
+    def to_dict(self):
+        with self.lock:
+            counts = {}
+            for device in self.devices:
+                counts[device['status']] = counts.get(device['status'], 0) + 1
+
+            return {
+                'id': self.id,
+                'status': self.status,
+                'created': self.created,
+                'finished': self.finished,
+                'concurrency': self.concurrency,
+                'canary_size': self.canary_size,
+                'wave_size': self.wave_size,
+                'counts': counts,
+                'devices': [dict(device) for device in self.devices]
+            }
+
+
+class RolloutManager:
+    """
+    Runs rollout jobs in background threads so no Flask worker is blocked.
+
+    `update_check(ip)` asks a device whether it has an update on offer and
+    returns the update result (with the device's 'fw'), or None when that is
+    unknown. Devices without one are marked up_to_date instead of being sent
+    an update that can only fail.
+    """
+
+    def __init__(self, client_factory, update_check=None, poll_interval=10):
+        self.client_factory = client_factory
+        self.update_check = update_check
+        self.poll_interval = poll_interval
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def start(self, ips, concurrency=4, canary_size=1, wave_size=10,
+              poll_timeout=300, stop_on_failure=True):
+        """Create a job and start it in the background"""
+        job = RolloutJob(
+            ips=list(dict.fromkeys(ips)),  # drop duplicates, keep order
+            concurrency=max(1, min(int(concurrency), MAX_CONCURRENCY)),
+            canary_size=max(0, int(canary_size)),
+            wave_size=max(1, int(wave_size)),
+            poll_timeout=max(30, int(poll_timeout)),
+            stop_on_failure=bool(stop_on_failure)
+        )
+
+        with self._lock:
+            self.jobs[job.id] = job
+            # Forget the oldest jobs
+            for old_id in list(self.jobs)[:-MAX_JOBS_KEPT]:
+                del self.jobs[old_id]
+
+        threading.Thread(target=self._run, args=(job,), name=f'rollout-{job.id}', daemon=True).start()
+        logger.info(f"Rollout {job.id} started for {len(job.devices)} devices")
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def all_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def _run(self, job):
+        job.status = 'running'
+
+        try:
+            with ThreadPoolExecutor(max_workers=job.concurrency, thread_name_prefix=f'rollout-{job.id}') as executor:
+                waves = job.waves()
+                for number, wave in enumerate(waves, start=1):
+                    logger.info(f"Rollout {job.id}: wave {number}/{len(waves)} ({len(wave)} devices)")
+                    for device in wave:
+                        job.set_device(device, wave=number)
+
+                    # Wait for the whole wave before starting the next one
+                    list(executor.map(lambda device: self._update_device(job, device), wave))
+
+                    failed = [device for device in wave if device['status'] == 'failed']
+                    if failed and job.stop_on_failure:
+                        logger.error(f"Rollout {job.id}: {len(failed)} failures in wave {number} - stopping")
+                        for device in job.devices:
+                            if device['status'] == 'queued':
+                                job.set_device(device, status='skipped', error='Rollout stopped after failures')
+                        job.status = 'failed'
+                        return
+
+            job.status = 'completed'
+        except Exception as e:
+            logger.error(f"Rollout {job.id} crashed: {e}", exc_info=True)
+            job.status = 'failed'
+        finally:
+            job.finished = time.time()
+            logger.info(f"Rollout {job.id} finished: {job.status}")
+
+    def _update_device(self, job, device):
+        """Start the update on one device and wait for it to come back with new firmware"""
+        ip = device['ip']
+
+        try:
+            pending = self.update_check(ip) if self.update_check else None
+            if pending is not None and not pending['has_update']:
+                job.set_device(device, status='up_to_date', old_fw=pending.get('fw'))
+                logger.info(f"Rollout {job.id}: {ip} has no update pending")
+                return
+
+            client = self.client_factory(ip)
+            if not client:
+                job.set_device(device, status='failed', error='Could not detect device generation')
+                return
+
+            info = client.get_device_info() or {}
+            old_fw = info.get('fw')
+            job.set_device(device, status='updating', old_fw=old_fw)
+
+            result = client.update_firmware()
+            if not result.get('success'):
+                job.set_device(device, status='failed', error=result.get('error', 'Update failed'))
+                return
+
+            job.set_device(device, status='rebooting')
+
+            # Poll until the device reports a different firmware version
+            deadline = time.monotonic() + job.poll_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                info = client.get_device_info()
+                if info and info.get('fw') and info.get('fw') != old_fw:
+                    job.set_device(device, status='done', new_fw=info.get('fw'))
+                    logger.info(f"Rollout {job.id}: {ip} updated {old_fw} -> {info.get('fw')}")
+                    return
+
+            job.set_device(device, status='failed',
+                           error=f"Firmware did not change within {job.poll_timeout}s")
+
+        except Exception as e:
+            logger.error(f"Rollout {job.id}: error updating {ip}: {e}")
+            job.set_device(device, status='failed', error=str(e))
@@ -0,0 +1,128 @@
+"""
+Versioned scan results
+Latest result per device with a version counter, for ETags and
+?since=<version> deltas on /api/scan
+"""
+import threading
+import time
+
+# How many removed devices to remember for deltas; older clients get a full list
+MAX_TOMBSTONES = 1000
+
+
+class ScanResults:
+    """Latest scan result per device; every change gets a new version number"""
+
+    def __init__(self):
+        # Start from the clock so versions keep increasing across restarts
+        self.version = int(time.time() * 1000)
+        self._devices = {}      # key -> device dict
+        self._versions = {}     # key -> (added_version, changed_version)
+        self._tombstones = {}   # key -> removed_version
+        self._oldest_tombstone = self.version
+        self._scanned = None    # (inventory revision, monotonic time) of the last live scan
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(device):
+        return device.get('id') or device.get('ip')
+
+    def update(self, devices):
+        """Record a completed scan; returns the new version (unchanged if nothing changed)"""
+        with self._lock:
+            latest = self._by_key(devices)
+            removed = [key for key in self._devices if key not in latest]
+            self._apply(latest, removed)
+            self._devices = latest
+            return self.version
+
+    def merge(self, devices):
+        """Record results for some devices (e.g. one page); others are kept"""
+        with self._lock:
+            latest = self._by_key(devices)
+            self._apply(latest, [])
+            self._devices = {**self._devices, **latest}
+            return self.version
+
+    def _by_key(self, devices):
+        latest = {}
+        for device in devices:
+            key = self._key(device)
+            if key:
+                latest[key] = device
+        return latest
+
+    def _apply(self, latest, removed):
+        """Bump the version for changed and removed devices (caller holds the lock)"""
+        changed = [key for key, device in latest.items() if self._devices.get(key) != device]
+        if changed or removed:
+            self.version += 1
+            for key in changed:
+                added_version = self._versions.get(key, (self.version, None))[0]
+                self._versions[key] = (added_version, self.version)
+                self._tombstones.pop(key, None)
+            for key in removed:
+                del self._versions[key]
+                self._tombstones[key] = self.version
+            self._trim_tombstones()
+
+    def _trim_tombstones(self):
+        """Forget the oldest removals (caller holds the lock)"""
+        while len(self._tombstones) > MAX_TOMBSTONES:
+            key = min(self._tombstones, key=self._tombstones.get)
+            self._oldest_tombstone = self._tombstones.pop(key)
+
+    def mark_scanned(self, revision):
+        """A live scan of inventory `revision` just completed"""
+        with self._lock:
+            self._scanned = (revision, time.monotonic())
+
+    def expire(self):
+        """Devices were changed (e.g. updated or rebooted): the next request has to scan"""
+        with self._lock:
+            self._scanned = None
+
+    def is_fresh(self, revision, max_age):
+        """True when the last live scan covered inventory `revision` and is at most `max_age` seconds old"""
+        with self._lock:
+            if self._scanned is None:
+                return False
+            scanned_revision, scanned_at = self._scanned
+            return scanned_revision == revision and time.monotonic() - scanned_at <= max_age
+
+    def get(self, device):
+        """Latest result for this device (matched by HA id or IP), or None"""
+        with self._lock:
+            return self._devices.get(self._key(device))
+
+    def devices(self):
+        with self._lock:
+            return list(self._devices.values())
+
+    def delta(self, since):
+        """
+        Changes after version `since`: added, changed and removed devices.
+
+        Returns a full list ('full': True) when `since` is too old or from
+        the future (e.g. from before a restart).
+        """
+        with self._lock:
+            if since < self._oldest_tombstone or since > self.version:
+                return {'version': self.version, 'full': True, 'devices': list(self._devices.values())}
+
+            added, changed = [], []
+            for key, device in self._devices.items():
+                added_version, changed_version = self._versions[key]
+                if added_version > since:
+                    added.append(device)
+                elif changed_version > since:
+                    changed.append(device)
+
+            return {
+                'version': self.version,
+                'since': since,
+                'full': False,
+                'added': added,
+                'changed': changed,
+                'removed': [key for key, version in self._tombstones.items() if version > since]
+            }
@@ -0,0 +1,50 @@
+"""
+Production WSGI server
+Serves the app with waitress (a threaded server) and shuts down cleanly on SIGTERM
+"""
+import logging
+import os
+import signal
+
+from waitress import create_server
+
+logger = logging.getLogger(__name__)
+
+# 'production' (waitress) or 'development' (Flask debug server)
+SERVER_MODE = os.environ.get('SERVER_MODE', 'production')
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 16))
+
+
+def build_server(app, host, port, threads=None):
+    """Create (but don't start) the waitress server"""
+    return create_server(
+        app,
+        host=host,
+        port=port,
+        threads=threads or SERVER_THREADS,
+        ident='shelly-manager',
+        # Scans and update checks can legitimately take a while
+        channel_timeout=300
+    )
+
+
+def serve(app, host, port, threads=None, on_shutdown=None):
+    """Serve until SIGTERM/SIGINT, then let in-flight requests finish and run on_shutdown"""
+    server = build_server(app, host, port, threads)
+
+    def handle_signal(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name} - shutting down")
+        # waitress closes its sockets and gives running requests a few seconds on SystemExit
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    logger.info(f"Serving on http://{host}:{server.effective_port} with {server.adj.threads} threads")
+
+    try:
+        server.run()
+    finally:
+        if on_shutdown:
+            on_shutdown()
+        logger.info("Server stopped")
@@ -0,0 +1,158 @@
+"""
+Single-flight request coalescing
+Concurrent calls for the same key share one execution and its result;
+a finished result can be reused for a short window afterwards. Streams
+(generators) share one run's events the same way
+"""
+import threading
+import time
+
+from metrics import SINGLE_FLIGHT_CALLS
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'finished')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+
+
+class SingleFlight:
+    """
+    Deduplicates in-flight work per key.
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait for it and get the same result (or exception). A successful
+    result is also handed out for `reuse_seconds` after it finished. Results
+    are shared, not copied - callers must not mutate them.
+    """
+
+    def __init__(self, name, reuse_seconds=0):
+        self.name = name
+        self.reuse_seconds = reuse_seconds
+        self._calls = {}   # key -> _Call (running, or finished within the reuse window)
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and call.done.is_set():
+                if call.error is None and time.monotonic() - call.finished <= self.reuse_seconds:
+                    SINGLE_FLIGHT_CALLS.inc(operation=self.name, result='reused')
+                    return call.result
+                call = None
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            SINGLE_FLIGHT_CALLS.inc(operation=self.name, result='shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        SINGLE_FLIGHT_CALLS.inc(operation=self.name, result='executed')
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            call.finished = time.monotonic()
+            with self._lock:
+                if call.error is not None or self.reuse_seconds <= 0:
+                    # Nothing to reuse; the next caller starts a new execution
+                    if self._calls.get(key) is call:
+                        del self._calls[key]
+                else:
+                    self._prune(call.finished)
+            call.done.set()
+
+    def clear(self):
+        """Forget finished results (calls still running are left alone)"""
+        with self._lock:
+            for key in [key for key, call in self._calls.items() if call.done.is_set()]:
+                del self._calls[key]
+
+    def _prune(self, now):
+        """Drop finished calls whose reuse window has passed (caller holds the lock)"""
+        expired = [key for key, call in self._calls.items()
+                   if call.done.is_set() and now - call.finished > self.reuse_seconds]
+        for key in expired:
+            del self._calls[key]
+
+
+class _StreamRun:
+    __slots__ = ('events', 'done', 'error', 'changed')
+
+    def __init__(self):
+        self.events = []
+        self.done = False
+        self.error = None
+        self.changed = threading.Condition()
+
+
+class SharedStream:
+    """
+    Single-flight for generators.
+
+    The first subscriber starts `produce()` on a background thread; everyone
+    subscribing while it runs gets the same events - the ones produced so
+    far, then each new one as it arrives - so concurrent consumers share one
+    run. The run finishes even when all subscribers go away. Events are
+    shared, not copied.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._run = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, produce):
+        with self._lock:
+            run = self._run
+            leader = run is None or run.done
+            if leader:
+                run = self._run = _StreamRun()
+        SINGLE_FLIGHT_CALLS.inc(operation=self.name, result='executed' if leader else 'shared')
+
+        if leader:
+            threading.Thread(target=self._produce, args=(run, produce),
+                             name=f'{self.name}-producer', daemon=True).start()
+        return self._follow(run)
+
+    @staticmethod
+    def _produce(run, produce):
+        try:
+            for event in produce():
+                with run.changed:
+                    run.events.append(event)
+                    run.changed.notify_all()
+        except BaseException as e:
+            run.error = e
+        finally:
+            with run.changed:
+                run.done = True
+                run.changed.notify_all()
+
+    @staticmethod
+    def _follow(run):
+        index = 0
+        while True:
+            with run.changed:
+                run.changed.wait_for(lambda: run.done or len(run.events) > index)
+                events = run.events[index:]
+                finished = run.done and index + len(events) == len(run.events)
+            for event in events:
+                yield event
+            index += len(events)
+            if finished:
+                if run.error is not None:
+                    raise run.error
+                return
@@ -0,0 +1,163 @@
+"""
+On-disk inventory snapshot
+Persists the enriched device list to /data so the first scan after a
+restart can answer immediately (marked stale) while a live scan runs
+in the background
+"""
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump when the record layout changes; other versions are ignored on load
+SNAPSHOT_VERSION = 1
+
+# Fields persisted per device (enriched state plus the registry fields shown in the panel)
+SNAPSHOT_FIELDS = ('id', 'name', 'ip', 'mac', 'model', 'manufacturer', 'type',
+                   'generation', 'fw', 'auth', 'last_seen')
+
+
+class InventorySnapshot:
+    """Versioned, atomically written snapshot of the enriched inventory"""
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else os.environ.get('SNAPSHOT_PATH', '/data/inventory.json')
+        self._records = {}     # key (HA id or IP) -> snapshot record
+        self._fresh = None     # result of the background revalidation
+        self._revalidated = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    @property
+    def revalidating(self):
+        """True while the startup revalidation has not finished"""
+        return not self._revalidated.is_set()
+
+    @staticmethod
+    def _key(device):
+        return device.get('id') or device.get('ip')
+
+    def load(self):
+        """Load the snapshot; a missing, corrupt or other-version file is ignored"""
+        if not self.enabled or not os.path.exists(self.path):
+            return 0
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or data.get('version') != SNAPSHOT_VERSION:
+                logger.info(f"Ignoring snapshot {self.path}: unsupported format version")
+                return 0
+
+            records = {}
+            for record in data['devices']:
+                if not isinstance(record, dict) or not isinstance(record.get('ip'), (str, type(None))):
+                    raise ValueError(f'invalid record: {record!r:.100}')
+                key = self._key(record)
+                if key:
+                    records[key] = {field: record.get(field) for field in SNAPSHOT_FIELDS}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.path}: {e}")
+            return 0
+
+        with self._lock:
+            self._records = records
+
+        age = time.time() - data.get('saved', time.time())
+        logger.info(f"Loaded inventory snapshot: {len(records)} devices, saved {age:.0f}s ago")
+        return len(records)
+
+    def save(self, devices):
+        """
+        Store the enriched devices of a completed scan.
+
+        Devices that did not answer this time keep their last known
+        generation, firmware and auth state (and their old last_seen).
+        """
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self._lock:
+            records = {}
+            for device in devices:
+                key = self._key(device)
+                if not key:
+                    continue
+                if device.get('generation'):
+                    record = {field: device.get(field) for field in SNAPSHOT_FIELDS}
+                    record['last_seen'] = now
+                else:
+                    previous = self._records.get(key, {})
+                    record = {field: device.get(field) or previous.get(field) for field in SNAPSHOT_FIELDS}
+                records[key] = record
+            self._records = records
+            payload = {'version': SNAPSHOT_VERSION, 'saved': now, 'devices': list(records.values())}
+
+            try:
+                self._write(payload)
+            except OSError as e:
+                logger.warning(f"Could not write inventory snapshot {self.path}: {e}")
+
+    def _write(self, payload):
+        """Write to a temp file in the same directory, then rename over the old snapshot"""
+        directory = os.path.dirname(self.path) or '.'
+        fd, tmp_path = tempfile.mkstemp(prefix='.inventory-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(payload, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def stale_devices(self):
+        """Snapshot devices as scan results, marked stale"""
+        with self._lock:
+            records = list(self._records.values())
+
+        devices = []
+        for record in records:
+            device = dict(record)
+            device['sw_version'] = record.get('fw') or ''
+            device['stale'] = True
+            if not device.get('ip'):
+                device['error'] = 'No IP address found'
+            devices.append(device)
+        return devices
+
+    def start_revalidation(self, scan_func):
+        """Run scan_func in the background; until it finishes scans may answer from the snapshot"""
+        with self._lock:
+            if not self._records:
+                self._revalidated.set()
+                return
+
+        threading.Thread(target=self._revalidate, args=(scan_func,), name='snapshot-revalidate', daemon=True).start()
+
+    def _revalidate(self, scan_func):
+        started = time.monotonic()
+        try:
+            self._fresh = scan_func()
+            logger.info(f"Inventory snapshot revalidated in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Snapshot revalidation failed: {e}", exc_info=True)
+        finally:
+            self._revalidated.set()
+
+    def wait_revalidated(self, timeout=None):
+        """Wait for the startup revalidation; returns its scan result (None if it failed or timed out)"""
+        self._revalidated.wait(timeout)
+        return self._fresh
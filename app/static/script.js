@@ -5,6 +5,7 @@ let sortColumn = 'name';
 let sortDirection = 'asc';
 let selectionMode = false;
 let selectedDevices = new Set();
+let scanVersion = null;
 
 // Helper function to get correct API URL
 function getApiUrl(endpoint) {
@@ -44,11 +45,11 @@ function filterDevices(searchTerm) {
     } else {
         const term = searchTerm.toLowerCase();
         filteredDevices = devicesData.filter(device => 
-            device.name.toLowerCase().includes(term) ||
-            device.ip.includes(term) ||
-            device.mac.toLowerCase().includes(term) ||
-            device.type.toLowerCase().includes(term) ||
-            device.fw.toLowerCase().includes(term)
+            (device.name || '').toLowerCase().includes(term) ||
+            (device.ip || '').includes(term) ||
+            (device.mac || '').toLowerCase().includes(term) ||
+            (device.type || '').toLowerCase().includes(term) ||
+            (device.fw || '').toLowerCase().includes(term)
         );
     }
     displayDevices(filteredDevices);
@@ -71,22 +72,122 @@ async function startScan() {
     status.textContent = i18n.t('scan_status_scanning');
     deviceTable.innerHTML = '<div class="loading"><div class="mdc-circular-progress"></div><div>' + i18n.t('loading_message') + '</div></div>';
     
+    const finishScan = () => {
+        isScanning = false;
+        btn.disabled = false;
+        btnText.textContent = i18n.t('scan_button');
+    };
+    
+    const showError = (message) => {
+        status.textContent = i18n.t('scan_status_error', { error: message });
+        if (devicesData.length === 0) {
+            deviceTable.innerHTML = '<div class="empty-state"><div class="empty-state__icon">⚠️</div><div class="empty-state__message">' + i18n.t('error_occurred') + '</div></div>';
+        }
+    };
+    
+    // Stream results: registry rows first, then each device as it is enriched
+    const source = new EventSource(getApiUrl('/api/scan/stream'));
+    let done = 0;
+    
+    source.addEventListener('devices', (e) => {
+        devicesData = JSON.parse(e.data);
+        scheduleRender();
+        // Right after an add-on restart the first list comes from the saved snapshot
+        if (devicesData.length > 0 && devicesData.every(device => device.stale)) {
+            status.textContent = i18n.t('scan_status_stale', { count: devicesData.length });
+        } else {
+            status.textContent = i18n.t('scan_status_progress', { done: 0, total: devicesData.length });
+        }
+    });
+    
+    source.addEventListener('device', (e) => {
+        const update = JSON.parse(e.data);
+        devicesData[update.index] = update.device;
+        done++;
+        scheduleRender();
+        status.textContent = i18n.t('scan_status_progress', { done: done, total: devicesData.length });
+    });
+    
+    source.addEventListener('summary', (e) => {
+        source.close();
+        scanVersion = JSON.parse(e.data).version ?? null;
+        status.textContent = i18n.t('scan_status_complete', { count: devicesData.length });
+        finishScan();
+    });
+    
+    source.addEventListener('scan_error', (e) => {
+        source.close();
+        showError(JSON.parse(e.data).error);
+        finishScan();
+    });
+    
+    source.onerror = () => {
+        // EventSource would reconnect and start a new scan - stop instead
+        if (source.readyState !== EventSource.CLOSED) {
+            source.close();
+            showError(i18n.t('scan_stream_interrupted'));
+            finishScan();
+        }
+    };
+}
+
+function deviceKey(device) {
+    return device.id || device.ip;
+}
+
+// Refresh the list with only the devices that changed since the last scan
+async function refreshDevices() {
+    if (isScanning) return;
+    if (scanVersion === null) {
+        startScan();
+        return;
+    }
+    
+    // Quiet refresh: the status line keeps whatever the action reported
+    isScanning = true;
+    
     try {
-        const response = await fetch(getApiUrl('/api/scan'));
-        const devices = await response.json();
+        const response = await fetch(getApiUrl(`/api/scan?since=${scanVersion}`), {
+            headers: { 'If-None-Match': `"scan-${scanVersion}"` }
+        });
         
-        devicesData = devices;
-        filteredDevices = [...devices];
-        displayDevices(filteredDevices);
-        status.textContent = i18n.t('scan_status_complete', { count: devices.length });
+        if (response.status !== 304) {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            applyScanDelta(await response.json());
+        }
+        isScanning = false;
     } catch (error) {
-        status.textContent = i18n.t('scan_status_error', { error: error.message });
-        deviceTable.innerHTML = '<div class="empty-state"><div class="empty-state__icon">⚠️</div><div class="empty-state__message">' + i18n.t('error_occurred') + '</div></div>';
-    } finally {
         isScanning = false;
-        btn.disabled = false;
-        btnText.textContent = i18n.t('scan_button');
+        startScan();
+    }
+}
+
+function applyScanDelta(delta) {
+    if (delta.full) {
+        devicesData = delta.devices;
+    } else {
+        const removed = new Set(delta.removed);
+        const changed = new Map(delta.changed.map(device => [deviceKey(device), device]));
+        devicesData = devicesData
+            .filter(device => !removed.has(deviceKey(device)))
+            .map(device => changed.get(deviceKey(device)) || device)
+            .concat(delta.added);
     }
+    scanVersion = delta.version;
+    scheduleRender();
+}
+
+// Re-render at most once per animation frame while results stream in
+let renderPending = false;
+function scheduleRender() {
+    if (renderPending) return;
+    renderPending = true;
+    requestAnimationFrame(() => {
+        renderPending = false;
+        filterDevices(document.getElementById('searchInput').value);
+    });
 }
 
 function sortDevices(column) {
@@ -258,20 +359,127 @@ function updateSelectedCount() {
     document.getElementById('selectedCount').textContent = `${selectedDevices.size} selected`;
 }
 
-// Batch operations (placeholders for v0.7.0)
-function batchUpdate() {
+// Batch operations
+async function batchUpdate() {
     if (selectedDevices.size === 0) return;
-    alert(`Batch update for ${selectedDevices.size} devices will be implemented in v0.7.0`);
+    if (!confirm(i18n.t('batch_update_confirm', { count: selectedDevices.size }))) return;
+    
+    try {
+        const response = await fetch(getApiUrl('/api/update/batch'), {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ips: [...selectedDevices] })
+        });
+        const job = await response.json();
+        
+        if (!response.ok) {
+            alert(i18n.t('fw_update_error', { error: job.error || 'Unknown error' }));
+            return;
+        }
+        
+        pollRollout(job.id);
+    } catch (error) {
+        alert(i18n.t('fw_network_error', { error: error.message }));
+    }
+}
+
+// Follow a rollout job until it finishes, showing progress in the status line
+async function pollRollout(jobId) {
+    const status = document.getElementById('statusMessage');
+    
+    try {
+        const response = await fetch(getApiUrl(`/api/update/batch/${jobId}`));
+        const job = await response.json();
+        const counts = job.counts || {};
+        const finished = (counts.done || 0) + (counts.up_to_date || 0) + (counts.failed || 0) + (counts.skipped || 0);
+        
+        if (job.status === 'running' || job.status === 'queued') {
+            status.textContent = i18n.t('batch_update_progress', { done: finished, total: job.devices.length });
+            setTimeout(() => pollRollout(jobId), 5000);
+        } else {
+            status.textContent = i18n.t('batch_update_complete', { done: counts.done || 0, up_to_date: counts.up_to_date || 0, failed: (counts.failed || 0) + (counts.skipped || 0) });
+            refreshDevices();
+        }
+    } catch (error) {
+        status.textContent = i18n.t('fw_network_error', { error: error.message });
+    }
 }
 
-function batchToggleAuth() {
+// Run a bulk action, reading one JSON result per line as devices finish
+async function runBatchAction(body) {
+    const status = document.getElementById('statusMessage');
+    const total = body.ips.length;
+    let done = 0;
+    const failures = [];
+    
+    status.textContent = i18n.t('batch_action_progress', { done: 0, total: total });
+    
+    try {
+        const response = await fetch(getApiUrl('/api/actions/batch'), {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        
+        if (!response.ok) {
+            const data = await response.json();
+            alert(i18n.t('batch_action_error', { error: data.error || 'Unknown error' }));
+            status.textContent = '';
+            return;
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done: streamDone } = await reader.read();
+            if (streamDone) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const result = JSON.parse(line);
+                if (result.done) {
+                    status.textContent = i18n.t('batch_action_complete', { done: result.succeeded, failed: result.failed });
+                } else {
+                    done++;
+                    if (!result.success) failures.push(`${result.ip}: ${result.error}`);
+                    status.textContent = i18n.t('batch_action_progress', { done: done, total: total });
+                }
+            }
+        }
+        
+        if (failures.length > 0) {
+            alert(i18n.t('batch_action_error', { error: '\n' + failures.join('\n') }));
+        }
+        refreshDevices();
+    } catch (error) {
+        status.textContent = i18n.t('batch_action_error', { error: error.message });
+    }
+}
+
+async function batchToggleAuth() {
     if (selectedDevices.size === 0) return;
-    alert(`Batch auth toggle for ${selectedDevices.size} devices will be implemented in v0.7.0`);
+    
+    // Enable unless every selected device already has authentication on
+    const selected = devicesData.filter(device => selectedDevices.has(device.ip));
+    const enable = !selected.every(device => device.auth);
+    const message = enable
+        ? i18n.t('batch_auth_enable_confirm', { count: selectedDevices.size })
+        : i18n.t('batch_auth_disable_confirm', { count: selectedDevices.size });
+    if (!confirm(message)) return;
+    
+    await runBatchAction({ action: 'auth', enable: enable, ips: [...selectedDevices] });
 }
 
-function batchReboot() {
+async function batchReboot() {
     if (selectedDevices.size === 0) return;
-    alert(`Batch reboot for ${selectedDevices.size} devices will be implemented in v0.7.0`);
+    if (!confirm(i18n.t('batch_reboot_confirm', { count: selectedDevices.size }))) return;
+    
+    await runBatchAction({ action: 'reboot', ips: [...selectedDevices] });
 }
 
 function escapeHtml(text) {
@@ -311,7 +519,7 @@ async function updateFirmware(ip, event) {
             btn.style.background = '#3fb950';
             
             setTimeout(() => {
-                startScan();
+                refreshDevices();
             }, 30000);
         } else {
             btn.textContent = i18n.t('fw_failed');
@@ -366,7 +574,7 @@ async function toggleAuth(ip, currentlyEnabled, event) {
             badge.textContent = i18n.t('auth_toggle_success');
             
             setTimeout(() => {
-                startScan();
+                refreshDevices();
             }, 2000);
         } else {
             badge.textContent = i18n.t('auth_toggle_failed');
@@ -0,0 +1,144 @@
+"""
+Firmware update availability
+Which devices have a pending update (Gen1 /ota, Gen2+ Shelly.CheckForUpdate),
+cached per generation, model and firmware so a fleet of identical devices
+costs one check per TTL instead of one per device
+"""
+import logging
+import os
+import threading
+import time
+
+from metrics import UPDATE_CHECKS
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def parse_gen1_ota(data):
+    """Gen1 /ota answer -> update result"""
+    has_update = bool(data.get('has_update'))
+    return {
+        'has_update': has_update,
+        'latest_version': data.get('new_version') if has_update else data.get('old_version'),
+        'beta_version': data.get('beta_version') or None,
+    }
+
+
+def parse_gen2_check(data):
+    """Gen2+ Shelly.CheckForUpdate answer -> update result (empty: up to date)"""
+    stable = (data.get('stable') or {}).get('version')
+    beta = (data.get('beta') or {}).get('version')
+    return {'has_update': bool(stable), 'latest_version': stable, 'beta_version': beta}
+
+
+class UpdateChecker:
+    """
+    Update availability per (generation, model, firmware).
+
+    `check_func(ip, generation, auth)` asks one device and returns a parsed
+    result, or None when it did not answer. Concurrent checks for the same
+    key share one request; a failed key is not asked again for
+    `retry_seconds`, so an unreachable device doesn't cost a request per scan.
+    """
+
+    def __init__(self, check_func, ttl=None, retry_seconds=60):
+        self.check_func = check_func
+        self.ttl = ttl if ttl is not None else float(os.environ.get('UPDATE_CHECK_TTL', 3600))
+        self.retry_seconds = retry_seconds
+        self._results = {}   # key -> result with 'checked' (wall clock), 'updated' (monotonic) and 'ip'
+        self._failed = {}    # key -> monotonic time of the last failed check
+        self._flight = SingleFlight('update_check')
+        self._lock = threading.Lock()
+
+        logger.info(f"Update checker initialized. TTL: {self.ttl}s")
+
+    @staticmethod
+    def key(device):
+        """Cache key of a probed device, or None when its model or firmware is unknown"""
+        generation = device.get('generation')
+        model = device.get('type') or device.get('model')
+        fw = device.get('fw')
+        if not (generation and model and fw):
+            return None
+        return (generation, model, fw)
+
+    def _fresh(self, key):
+        with self._lock:
+            result = self._results.get(key)
+            if result and time.monotonic() - result['updated'] <= self.ttl:
+                return result
+            return None
+
+    def check(self, device, query=True):
+        """
+        Update result for a device, asking it only when its key is not cached.
+
+        With query=False (e.g. the device needs a password we don't have) only
+        a cached result is returned - possibly from another device of the same
+        model and firmware, or stale. None when nothing is known.
+        """
+        key = self.key(device)
+        if key is None or not device.get('ip'):
+            return None
+
+        result = self._fresh(key)
+        if result:
+            UPDATE_CHECKS.inc(result='cached')
+            return result
+
+        with self._lock:
+            stale = self._results.get(key)
+            failed = self._failed.get(key)
+        if not query or (failed and time.monotonic() - failed < self.retry_seconds):
+            return stale
+
+        return self._flight.do(key, self._check, key, device['ip'], bool(device.get('auth'))) or stale
+
+    def _check(self, key, ip, auth):
+        # A check for this key may have finished between the cache miss and now
+        result = self._fresh(key)
+        if result:
+            return result
+
+        try:
+            result = self.check_func(ip, key[0], auth)
+        except Exception as e:
+            logger.debug("Update check on %s failed: %s", ip, e)
+            result = None
+
+        with self._lock:
+            if result is None:
+                self._failed[key] = time.monotonic()
+                UPDATE_CHECKS.inc(result='failed')
+                return None
+            result = {**result, 'checked': time.time(), 'updated': time.monotonic(), 'ip': ip}
+            self._results[key] = result
+            self._failed.pop(key, None)
+
+        UPDATE_CHECKS.inc(result='checked')
+        return result
+
+    def clear(self):
+        """Forget all results (the next scan checks every model and firmware again)"""
+        with self._lock:
+            self._results.clear()
+            self._failed.clear()
+
+    def to_dict(self):
+        """Cached results per model and firmware, for /api/updates"""
+        now = time.monotonic()
+        with self._lock:
+            entries = [
+                {
+                    'generation': key[0], 'model': key[1], 'fw': key[2],
+                    'has_update': result['has_update'],
+                    'latest_version': result['latest_version'],
+                    'beta_version': result['beta_version'],
+                    'checked': result['checked'],
+                    'checked_via': result['ip'],
+                    'expired': now - result['updated'] > self.ttl,
+                }
+                for key, result in self._results.items()
+            ]
+        return {'ttl': self.ttl, 'entries': sorted(entries, key=lambda e: (e['model'], e['fw']))}
@@ -0,0 +1,288 @@
+"""
+Simulated Shelly fleet
+One local HTTP server that plays many Shelly devices. It is used as an
+HTTP proxy (HTTP_PROXY), so requests to http://<device-ip>/... from the
+add-on arrive here and are answered by the simulated device for that IP.
+The devices can also multicast mDNS (Gen2) and CoIoT (Gen1) announcements.
+"""
+import ipaddress
+import itertools
+import json
+import random
+import socket
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Fake devices live in this range (never routed, always answered by the proxy)
+FLEET_NETWORK = ipaddress.ip_network('10.77.0.0/16')
+
+# Gen2 digest nonces expire after this long (answered with stale=true)
+NONCE_LIFETIME = 300
+
+MDNS_GROUP = ('224.0.0.251', 5353)
+COIOT_GROUP = ('224.0.1.187', 5683)
+
+
+def _dns_name(name):
+    return b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\0'
+
+
+def _dns_record(name, rtype, ttl, rdata, cache_flush=True):
+    rclass = 0x8001 if cache_flush else 0x0001
+    return _dns_name(name) + struct.pack('>HHIH', rtype, rclass, ttl, len(rdata)) + rdata
+
+
+def mdns_packet(instance, ip, txt, ttl=120):
+    """Unsolicited _shelly._tcp announcement (PTR, SRV, TXT and A records); ttl=0 says goodbye"""
+    service = '_shelly._tcp.local'
+    host = f'{instance}.local'
+    full_name = f'{instance}.{service}'
+    txt_data = b''.join(bytes([len(entry)]) + entry for entry in
+                        (f'{key}={value}'.encode() for key, value in txt.items()))
+    records = [
+        _dns_record(service, 12, ttl, _dns_name(full_name), cache_flush=False),
+        _dns_record(full_name, 33, ttl, struct.pack('>HHH', 0, 0, 80) + _dns_name(host)),
+        _dns_record(full_name, 16, ttl, txt_data),
+        _dns_record(host, 1, ttl, socket.inet_aton(ip)),
+    ]
+    return struct.pack('>HHHHHH', 0, 0x8400, 0, len(records), 0, 0) + b''.join(records)
+
+
+def coiot_packet(model, mac, message_id):
+    """Gen1 CoIoT status multicast: CoAP NON, code 0.30, device id option 3332"""
+    device_id = f'{model}#{mac}#2'.encode()
+    # Option delta 3332 and the value length both need extended encoding
+    option = bytes([0xE0 | 13]) + struct.pack('>H', 3332 - 269) + bytes([len(device_id) - 13]) + device_id
+    return bytes([0x50, 30]) + struct.pack('>H', message_id & 0xFFFF) + option + b'\xff{"G":[]}'
+
+
+class PresenceAnnouncer:
+    """Sends the fleet's multicast announcements, once or on an interval"""
+
+    def __init__(self, devices, interval=15, ports=None):
+        self.devices = devices
+        self.interval = interval
+        self.ports = ports or {}   # group address -> port override (for tests)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._stopping = threading.Event()
+
+    def announce(self):
+        for device in self.devices:
+            group, port, payload = device.announcement()
+            self.sock.sendto(payload, (group, self.ports.get(group, port)))
+
+    def start(self):
+        def run():
+            while not self._stopping.is_set():
+                self.announce()
+                self._stopping.wait(self.interval)
+
+        threading.Thread(target=run, name='fake-announcer', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self.sock.close()
+
+
+class SimulatedDevice:
+    """One Gen1 or Gen2 device with its own latency and failure behaviour"""
+
+    def __init__(self, index, generation, latency, jitter, hang, auth):
+        self.index = index
+        self.ip = str(FLEET_NETWORK.network_address + index + 1)
+        self.mac = f'A0B1C2{index:06X}'
+        self.generation = generation
+        self.latency = latency
+        self.jitter = jitter
+        self.hang = hang
+        self.auth = auth
+        self.fw = '20230913-114010/v1.14.0-gcb84623' if generation == 1 else '1.0.8'
+        self.model = 'SHSW-1' if generation == 1 else 'SNSW-001X16EU'
+        self.latest_fw = self.fw   # newer firmware on offer when different
+        self.update_checks = 0
+        self.device_id = f'shellyplus1-{self.mac.lower()}'
+        self.coiot_ids = itertools.count(1)
+        self.nonce = None
+        self.nonce_issued = 0
+        self.challenges = 0
+
+    def registry_entry(self):
+        """What Home Assistant's device registry holds for this device"""
+        return {
+            'id': f'dev{self.index:05d}',
+            'name': f'Shelly {self.index}',
+            'name_by_user': None,
+            'manufacturer': 'Shelly' if self.generation == 1 else 'Allterco Robotics',
+            'model': self.model,
+            'sw_version': self.fw,
+            'configuration_url': f'http://{self.ip}',
+            'identifiers': [['shelly', self.mac.lower()]],
+            'config_entries': [f'entry{self.index:05d}'],
+        }
+
+    def announcement(self):
+        """Multicast packet the device sends: (group, port, payload)"""
+        if self.generation == 1:
+            return (*COIOT_GROUP, coiot_packet(self.model, self.mac, next(self.coiot_ids)))
+        return (*MDNS_GROUP, mdns_packet(self.device_id, self.ip, {
+            'gen': '2', 'app': 'Plus1', 'ver': self.fw
+        }))
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def shelly(self):
+        if self.generation == 1:
+            return {'type': self.model, 'mac': self.mac, 'auth': self.auth, 'fw': self.fw}
+        return {
+            'name': None, 'id': self.device_id, 'mac': self.mac, 'model': self.model,
+            'gen': 2, 'fw_id': self.fw, 'ver': self.fw, 'app': 'Plus1',
+            'auth_en': self.auth, 'auth_domain': self.device_id if self.auth else None,
+        }
+
+    def handle(self, path, headers):
+        """Return (status, extra_headers, body) for a request path"""
+        path = path.split('?')[0]
+
+        if path == '/shelly':
+            return 200, {}, self.shelly()
+
+        if path in ('/ota', '/rpc/Shelly.CheckForUpdate'):
+            self.update_checks += 1
+        has_update = self.latest_fw != self.fw
+
+        authorized = not self.auth or (bool(headers.get('Authorization')) if self.generation == 1
+                                       else self.digest_valid(headers.get('Authorization')))
+
+        if self.generation == 1:
+            routes = {
+                '/settings': {'device': {'type': self.model, 'mac': self.mac}, 'login': {'enabled': self.auth}},
+                '/status': {'uptime': 1000 + self.index, 'update': {'has_update': False, 'old_version': self.fw}},
+                '/ota': {'status': 'pending' if has_update else 'idle', 'has_update': has_update,
+                         'old_version': self.fw, 'new_version': self.latest_fw},
+                '/reboot': {'ok': True},
+            }
+            if path not in routes:
+                return 404, {}, {'error': 'Not found'}
+            if not authorized:
+                return 401, {'WWW-Authenticate': 'Basic realm="Shelly"'}, {'error': 'Unauthorized'}
+            return 200, {}, routes[path]
+
+        routes = {
+            '/rpc/Shelly.GetDeviceInfo': self.shelly(),
+            '/rpc/Shelly.GetStatus': {'sys': {'uptime': 1000 + self.index, 'available_updates': {}}},
+            '/rpc/Shelly.GetConfig': {'sys': {'device': {'name': None, 'mac': self.mac}}},
+            '/rpc/Shelly.CheckForUpdate': {'stable': {'version': self.latest_fw}} if has_update else {},
+            '/rpc/Shelly.Reboot': None,
+        }
+        if path not in routes:
+            return 404, {}, {'code': 404, 'message': 'No handler'}
+        if not authorized and path != '/rpc/Shelly.GetDeviceInfo':
+            return 401, {'WWW-Authenticate': self.challenge(headers.get('Authorization'))}, \
+                {'code': 401, 'message': 'Unauthorized'}
+        return 200, {}, routes[path]
+
+    def digest_valid(self, authorization):
+        """Accept any digest response for the current, unexpired nonce (passwords aren't checked)"""
+        return (bool(authorization) and self.nonce is not None
+                and f'nonce="{self.nonce}"' in authorization
+                and time.monotonic() - self.nonce_issued < NONCE_LIFETIME)
+
+    def challenge(self, authorization):
+        """New Digest challenge; stale=true when the client used our previous nonce"""
+        stale = bool(authorization) and self.nonce is not None and f'nonce="{self.nonce}"' in authorization
+        self.nonce = f'{random.getrandbits(64):016x}'
+        self.nonce_issued = time.monotonic()
+        self.challenges += 1
+        return (f'Digest qop="auth", realm="{self.device_id}", nonce="{self.nonce}", algorithm=SHA-256'
+                + (', stale=true' if stale else ''))
+
+
+class FleetProxy:
+    """HTTP proxy server that dispatches to simulated devices by target IP"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.devices = {}
+        fleet = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; on kept-alive connections
+            # Nagle's algorithm would hold the body until the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                fleet._handle(self)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-fleet', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def configure(self, size, gen2_ratio=0.5, latency=0.02, jitter=0.01,
+                  hang_ratio=0.0, auth_ratio=0.0, seed=42):
+        """Replace the fleet with `size` new simulated devices"""
+        rng = random.Random(seed)
+        devices = []
+        for index in range(size):
+            devices.append(SimulatedDevice(
+                index,
+                generation=2 if rng.random() < gen2_ratio else 1,
+                latency=latency,
+                jitter=jitter,
+                hang=rng.random() < hang_ratio,
+                auth=rng.random() < auth_ratio,
+            ))
+        self.devices = {device.ip: device for device in devices}
+        return devices
+
+    def _handle(self, request):
+        target = urlsplit(request.path)
+        if request.headers.get('Content-Length'):
+            request.rfile.read(int(request.headers['Content-Length']))
+
+        device = self.devices.get(target.hostname)
+        if device is None:
+            # Unknown IP: behave like nothing is there
+            request.close_connection = True
+            return
+
+        time.sleep(device.delay())
+        if device.hang:
+            # Never answer in time; the client's read timeout must fire
+            time.sleep(30)
+            request.close_connection = True
+            return
+
+        status, headers, body = device.handle(target.path, request.headers)
+        payload = json.dumps(body).encode()
+
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload)))
+        for key, value in headers.items():
+            request.send_header(key, value)
+        request.end_headers()
+        request.wfile.write(payload)
@@ -0,0 +1,245 @@
+"""
+Fake Home Assistant Supervisor
+Serves the parts of /core/api/ and /core/websocket the add-on uses:
+auth handshake, device/entity registry, config entries, ping/pong,
+subscribe_events, /api/, /api/states(/<entity_id>) and /api/template
+(device lookup).
+"""
+import base64
+import hashlib
+import json
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError('client went away')
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    """Read one (masked) client frame; returns (opcode, payload)"""
+    header = _recv_exact(sock, 2)
+    opcode = header[0] & 0x0F
+    length = header[1] & 0x7F
+    if length == 126:
+        length = struct.unpack('>H', _recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack('>Q', _recv_exact(sock, 8))[0]
+    mask = _recv_exact(sock, 4) if header[1] & 0x80 else b'\0\0\0\0'
+    payload = bytearray(_recv_exact(sock, length))
+    for i in range(length):
+        payload[i] ^= mask[i % 4]
+    return opcode, bytes(payload)
+
+
+def send_frame(sock, text, lock):
+    """Send one unmasked text frame"""
+    payload = text.encode()
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x81, length])
+    elif length < 65536:
+        header = bytes([0x81, 126]) + struct.pack('>H', length)
+    else:
+        header = bytes([0x81, 127]) + struct.pack('>Q', length)
+    with lock:
+        sock.sendall(header + payload)
+
+
+class FakeSupervisor:
+    """Threaded HTTP + WebSocket server standing in for http://supervisor/core"""
+
+    def __init__(self, host='127.0.0.1', port=0, token='benchmark-token'):
+        self.token = token
+        self.device_registry = []
+        self.entity_registry = []
+        self.config_entries = []
+        self.states = []
+        self.stats = {'ws_connections': 0, 'ws_commands': 0, 'rest_requests': 0}
+        supervisor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body are written separately; on kept-alive connections
+            # Nagle's algorithm would hold the body until the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                supervisor._handle(self)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    @property
+    def ha_url(self):
+        return f'http://127.0.0.1:{self.port}/core'
+
+    @property
+    def ws_url(self):
+        return f'ws://127.0.0.1:{self.port}/core/websocket'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-supervisor', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def configure(self, shelly_entries, other_devices=0):
+        """Load a registry with the given Shelly entries plus non-Shelly noise"""
+        noise = [
+            {
+                'id': f'other{index:05d}', 'name': f'Light {index}', 'name_by_user': None,
+                'manufacturer': 'Signify', 'model': 'LCT015', 'sw_version': '1.0',
+                'configuration_url': None, 'identifiers': [['hue', f'{index:08x}']],
+                'config_entries': ['hue'],
+            }
+            for index in range(other_devices)
+        ]
+        self.device_registry = list(shelly_entries) + noise
+        self.config_entries = [
+            {'entry_id': entry['config_entries'][0], 'domain': 'shelly', 'title': entry['name'], 'state': 'loaded'}
+            for entry in shelly_entries
+        ] + [{'entry_id': 'hue', 'domain': 'hue', 'title': 'Hue', 'state': 'loaded'}]
+        self.entity_registry = [
+            {
+                'entity_id': f"switch.{entry['id']}", 'device_id': entry['id'],
+                'config_entry_id': entry['config_entries'][0], 'platform': 'shelly',
+            }
+            for entry in shelly_entries
+        ]
+        self.states = [
+            {'entity_id': f"switch.{entry['id']}", 'state': 'on',
+             'attributes': {'friendly_name': f"{entry['name']} Switch"}}
+            for entry in shelly_entries
+        ] + [
+            {'entity_id': f'light.other{index:05d}', 'state': 'off',
+             'attributes': {'friendly_name': f'Light {index}'}}
+            for index in range(other_devices)
+        ]
+
+    # REST
+
+    def _handle(self, request):
+        if request.path == '/core/websocket' and request.headers.get('Upgrade', '').lower() == 'websocket':
+            self._handle_websocket(request)
+            return
+
+        self.stats['rest_requests'] += 1
+        body = None
+        if request.headers.get('Content-Length'):
+            body = json.loads(request.rfile.read(int(request.headers['Content-Length'])) or b'null')
+
+        if request.headers.get('Authorization') != f'Bearer {self.token}':
+            self._send_json(request, 401, {'message': 'Unauthorized'})
+        elif request.path == '/core/api/':
+            self._send_json(request, 200, {'message': 'API running.'})
+        elif request.path == '/core/api/states':
+            self._send_json(request, 200, self.states)
+        elif request.path.startswith('/core/api/states/'):
+            entity_id = request.path.rsplit('/', 1)[1]
+            state = next((state for state in self.states if state['entity_id'] == entity_id), None)
+            if state:
+                self._send_json(request, 200, state)
+            else:
+                self._send_json(request, 404, {'message': 'Entity not found.'})
+        elif request.path == '/core/api/template':
+            # Only the device lookup template is supported
+            ids = set((body or {}).get('variables', {}).get('device_ids', []))
+            found = [entry for entry in self.device_registry if entry['id'] in ids]
+            self._send_text(request, 200, json.dumps(found))
+        else:
+            self._send_json(request, 404, {'message': 'Not found'})
+
+    @staticmethod
+    def _send_text(request, status, text):
+        payload = text.encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload)))
+        request.end_headers()
+        request.wfile.write(payload)
+
+    def _send_json(self, request, status, data):
+        self._send_text(request, status, json.dumps(data))
+
+    # WebSocket
+
+    def _handle_websocket(self, request):
+        key = request.headers['Sec-WebSocket-Key']
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        request.send_response(101, 'Switching Protocols')
+        request.send_header('Upgrade', 'websocket')
+        request.send_header('Connection', 'Upgrade')
+        request.send_header('Sec-WebSocket-Accept', accept)
+        request.end_headers()
+        request.wfile.flush()
+        request.close_connection = True
+
+        sock = request.connection
+        lock = threading.Lock()
+        self.stats['ws_connections'] += 1
+
+        try:
+            send_frame(sock, json.dumps({'type': 'auth_required', 'ha_version': '2025.10.0'}), lock)
+            _, payload = read_frame(sock)
+            if json.loads(payload).get('access_token') != self.token:
+                send_frame(sock, json.dumps({'type': 'auth_invalid', 'message': 'Invalid access token'}), lock)
+                return
+            send_frame(sock, json.dumps({'type': 'auth_ok', 'ha_version': '2025.10.0'}), lock)
+
+            while True:
+                opcode, payload = read_frame(sock)
+                if opcode == 0x8:
+                    return
+                if opcode != 0x1:
+                    continue
+                self.stats['ws_commands'] += 1
+                send_frame(sock, json.dumps(self._ws_reply(json.loads(payload))), lock)
+        except (ConnectionError, OSError):
+            return
+
+    def _ws_reply(self, message):
+        command = message.get('type')
+        msg_id = message.get('id')
+
+        if command == 'ping':
+            return {'id': msg_id, 'type': 'pong'}
+
+        results = {
+            'config/device_registry/list': lambda: self.device_registry,
+            'config/entity_registry/list': lambda: self.entity_registry,
+            'config/entity_registry/list_for_display': lambda: {
+                'entity_categories': {'0': 'config', '1': 'diagnostic'},
+                'entities': [
+                    {'ei': entity['entity_id'], 'di': entity['device_id'], 'pl': entity['platform']}
+                    for entity in self.entity_registry
+                ],
+            },
+            'config_entries/list': lambda: self.config_entries,
+            'config_entries/get': lambda: [
+                entry for entry in self.config_entries
+                if not message.get('domain') or entry['domain'] == message['domain']
+            ],
+            'subscribe_events': lambda: None,
+        }
+        if command not in results:
+            return {'id': msg_id, 'type': 'result', 'success': False,
+                    'error': {'code': 'unknown_command', 'message': 'Unknown command.'}}
+        return {'id': msg_id, 'type': 'result', 'success': True, 'result': results[command]()}
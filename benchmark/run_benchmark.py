@@ -0,0 +1,249 @@
+"""
+Benchmark the add-on against a simulated Shelly fleet and a fake Supervisor
+
+Usage:
+    python benchmark/run_benchmark.py --sizes 10,100,1000 --output results.json
+
+Runs the real Flask app in-process, behind the production server (waitress)
+or the Flask development server (--server development). Shelly traffic is
+routed to the simulated fleet through HTTP_PROXY; the Supervisor URLs are
+pointed at the fake Supervisor with HA_URL / HA_WS_URL. Results are written
+as JSON so runs can be compared.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'app')
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_fleet import FleetProxy  # noqa: E402
+from fake_supervisor import FakeSupervisor  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, errors, wall):
+    count = len(latencies) + errors
+    return {
+        'requests': count,
+        'errors': errors,
+        'wall_s': round(wall, 4),
+        'throughput_rps': round(count / wall, 2) if wall else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else None,
+    }
+
+
+class AppUnderTest:
+    """Imports the add-on with its environment pointed at the fakes and serves it"""
+
+    def __init__(self, fleet, supervisor, args):
+        os.environ.update({
+            'SUPERVISOR_TOKEN': supervisor.token,
+            'HA_URL': supervisor.ha_url,
+            'HA_WS_URL': supervisor.ws_url,
+            'HTTP_PROXY': fleet.url,
+            'http_proxy': fleet.url,
+            'NO_PROXY': '127.0.0.1,localhost',
+            'no_proxy': '127.0.0.1,localhost',
+            'SCAN_WORKERS': str(args.scan_workers),
+            'SCAN_TIMEOUT': str(args.scan_timeout),
+            'POLL_INTERVAL': str(args.poll_interval),
+            'LOG_LEVEL': 'warning',
+            # Every run starts cold; don't answer from a previous run's snapshot
+            'SNAPSHOT_PATH': '',
+            # Real announcements on the LAN would let scans skip probes
+            'PASSIVE_DISCOVERY': 'false',
+            # Measure scans, not the reuse windows for back-to-back requests
+            'SCAN_REUSE_SECONDS': '0',
+            'DEVICE_REUSE_SECONDS': '0',
+            # Behind the proxy every device shares one connection pool, so
+            # size it for the whole scan instead of per device
+            'DEVICE_POOL_SIZE': str(args.scan_workers * 2),
+        })
+        sys.path.insert(0, APP_DIR)
+
+        try:
+            import app as app_module
+        except ModuleNotFoundError as e:
+            if e.name not in ('shelly_gen1', 'shelly_gen2'):
+                raise
+            sys.exit(f"Cannot import the add-on: module '{e.name}' not found. The shelly_gen1/shelly_gen2 "
+                     f"client modules are not in this tree - put their directory on PYTHONPATH.")
+
+        logging.getLogger().setLevel(logging.WARNING)
+
+        self.module = app_module
+        if args.server == 'production':
+            from server import build_server
+            server = build_server(app_module.app, '127.0.0.1', 0, threads=args.server_threads)
+            port, serve = server.effective_port, server.run
+        else:
+            from werkzeug.serving import make_server
+            server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+            port, serve = server.server_port, server.serve_forever
+
+        self.url = f'http://127.0.0.1:{port}'
+        threading.Thread(target=serve, name='app-under-test', daemon=True).start()
+
+    def reset(self):
+        """Forget everything learned about the previous fleet"""
+        self.module.device_cache.clear()
+        self.module.device_health.clear()
+        self.module.update_checker.clear()
+        # Includes the registry download, reused for a second after the last one
+        for flight in (self.module.scan_flight, self.module.generation_flight, self.module.info_flight,
+                       self.module.ha_client.ws_client._list_flight):
+            flight.clear()
+        # Every device counts as removed; versions keep increasing
+        self.module.scan_results.update([])
+        self.module.scan_results.expire()
+        self.module.status_poller.set_targets([])
+        self.module.ha_client.inventory.resync()
+
+
+def run_requests(base_url, paths, concurrency):
+    """Issue GET requests for paths with a client pool; return latencies, errors, wall time"""
+    local = threading.local()
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(path):
+        nonlocal errors
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+            session.trust_env = False
+        started = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=300)
+            ok = response.status_code < 500
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, paths))
+    return latencies, errors, time.perf_counter() - started
+
+
+def benchmark_size(app, fleet, supervisor, size, args):
+    devices = fleet.configure(
+        size,
+        gen2_ratio=args.gen2_ratio,
+        latency=args.latency,
+        jitter=args.jitter,
+        hang_ratio=args.hang_ratio,
+        auth_ratio=args.auth_ratio,
+        seed=args.seed,
+    )
+    supervisor.configure([device.registry_entry() for device in devices], other_devices=args.other_devices)
+    app.reset()
+
+    rng = random.Random(args.seed)
+    device_paths = [f'/api/device/{rng.choice(devices).ip}' for _ in range(args.iterations)]
+
+    scenarios = [
+        ('scan_cold', ['/api/scan'], 1),
+        ('scan_warm', ['/api/scan'] * args.iterations, 1),
+        ('scan_concurrent', ['/api/scan'] * args.iterations, args.concurrency),
+        ('device_fresh', [path + '?fresh=1' for path in device_paths], args.concurrency),
+        ('device_cached', device_paths, args.concurrency),
+        ('debug', ['/api/debug'] * args.iterations, 1),
+    ]
+
+    results = []
+    for name, paths, concurrency in scenarios:
+        ws_before = dict(supervisor.stats)
+        latencies, errors, wall = run_requests(app.url, paths, concurrency)
+        result = {
+            'fleet_size': size,
+            'scenario': name,
+            'endpoint': paths[0].split('?')[0] if not name.startswith('device') else '/api/device/<ip>',
+            'concurrency': concurrency,
+            **summarize(latencies, errors, wall),
+            'ws_connections': supervisor.stats['ws_connections'] - ws_before['ws_connections'],
+            'ws_commands': supervisor.stats['ws_commands'] - ws_before['ws_commands'],
+        }
+        results.append(result)
+        print(f"  {size:>5} {name:<16} p50={result['p50_ms']}ms p95={result['p95_ms']}ms "
+              f"rps={result['throughput_rps']} errors={errors}", file=sys.stderr)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated fleet sizes')
+    parser.add_argument('--iterations', type=int, default=20, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='parallel clients for concurrent scenarios')
+    parser.add_argument('--gen2-ratio', type=float, default=0.5, help='fraction of Gen2 devices')
+    parser.add_argument('--latency', type=float, default=0.02, help='device response latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.01, help='latency jitter (+/- s)')
+    parser.add_argument('--hang-ratio', type=float, default=0.0, help='fraction of devices that never answer')
+    parser.add_argument('--auth-ratio', type=float, default=0.0, help='fraction of devices requiring auth')
+    parser.add_argument('--other-devices', type=int, default=2000, help='non-Shelly devices in the registry')
+    parser.add_argument('--scan-workers', type=int, default=16)
+    parser.add_argument('--scan-timeout', type=int, default=30)
+    parser.add_argument('--poll-interval', type=int, default=60)
+    parser.add_argument('--server', choices=('production', 'development'), default='production',
+                        help='waitress or the Flask development server')
+    parser.add_argument('--server-threads', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write JSON results to this file (default: stdout)')
+    args = parser.parse_args()
+
+    fleet = FleetProxy().start()
+    supervisor = FakeSupervisor().start()
+    app = AppUnderTest(fleet, supervisor, args)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        results.extend(benchmark_size(app, fleet, supervisor, size, args))
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'options': vars(args),
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,18 @@ bashio::log.info "Starting Shelly Scanner..."
 # Get configuration
 export ADMIN_PASSWORD=$(bashio::config 'admin_password')
 export NETWORK_RANGE=$(bashio::config 'network_range')
+export SCAN_WORKERS=$(bashio::config 'scan_workers')
+export SCAN_TIMEOUT=$(bashio::config 'scan_timeout')
+export CACHE_TTL=$(bashio::config 'cache_ttl')
+export UPDATE_CHECK_TTL=$(bashio::config 'update_check_ttl')
+export SWEEP_CONCURRENCY=$(bashio::config 'sweep_concurrency')
+export SWEEP_RATE=$(bashio::config 'sweep_rate')
+export POLL_INTERVAL=$(bashio::config 'poll_interval')
+export SERVER_MODE=$(bashio::config 'server')
+export SERVER_THREADS=$(bashio::config 'server_threads')
+export LOG_LEVEL=$(bashio::config 'log_level')
+export GEN2_WEBSOCKET=$(bashio::config 'gen2_websocket')
+export PASSIVE_DISCOVERY=$(bashio::config 'passive_discovery')
 
 # Log configuration (without showing password)
 if bashio::var.has_value "${ADMIN_PASSWORD}"; then
@@ -26,7 +38,7 @@ fi
 export INGRESS_PORT=8099
 export PORT=8099
 
-# Start the Flask application
-bashio::log.info "Starting Flask application..."
+# Start the web server (exec so SIGTERM from the Supervisor reaches Python)
+bashio::log.info "Starting web server (${SERVER_MODE})..."
 cd /app
 exec python3 -u app.py